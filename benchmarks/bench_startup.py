@@ -0,0 +1,123 @@
+"""
+Benchmark khởi động: thời gian từ lúc chạy server tới lúc nhận kết nối và tới lúc GET /ready trả 200
+
+Mỗi lần đo chạy một process server mới (cold start, cache đĩa của OS vẫn còn sau lần đầu):
+  - listen: process được tạo -> GET / trả lời (uvicorn đã mở cổng, model còn đang nạp)
+  - ready:  process được tạo -> GET /ready trả 200 (STT, LLM, TTS, VAD đều đã nạp)
+  - server: cold start do server tự đo (/ready -> cold_start_seconds) và thời gian nạp từng thành phần
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --app main:app
+    # Không cần Gemini/ZipVoice: LLM/TTS giả lập, chỉ đo STT + VAD + overhead của server
+    python -m benchmarks.bench_startup --fake --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def serve(args):
+    """Process con: chạy app (LLM/TTS giả lập nếu --fake)"""
+    if args.fake:
+        from settings import llm_settings, tts_settings
+        llm_settings.LLM_BACKEND = "fake"
+        tts_settings.TTS_BACKEND = "fake"
+    import uvicorn
+    uvicorn.run(args.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def probe(url: str):
+    """(HTTP status, JSON) hoặc (None, None) khi server chưa mở cổng"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+    except OSError:
+        return None, None
+
+
+def measure(args) -> Dict:
+    cmd = [sys.executable, "-m", "benchmarks.bench_startup", "--serve", "--app", args.app, "--port", str(args.port)]
+    if args.fake:
+        cmd.append("--fake")
+    base = f"http://127.0.0.1:{args.port}"
+    start = time.monotonic()
+    server = subprocess.Popen(cmd, cwd=str(ROOT_DIR))
+    result = {"listen": None, "ready": None, "status": None}
+    try:
+        deadline = start + args.timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise SystemExit(f"Server exited with code {server.returncode}")
+            if result["listen"] is None and probe(f"{base}/")[0] is not None:
+                result["listen"] = time.monotonic() - start
+            if result["listen"] is not None:
+                code, status = probe(f"{base}/ready")
+                if code == 200 or (status and status.get("errors")):
+                    result["ready"] = time.monotonic() - start if code == 200 else None
+                    result["status"] = status
+                    return result
+            time.sleep(args.interval)
+        raise SystemExit(f"Server not ready after {args.timeout:.0f}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(runs: List[Dict]):
+    def line(label, values):
+        values = [v for v in values if v is not None]
+        if not values:
+            print(f"  {label:<24} n/a")
+            return
+        print(f"  {label:<24} median {statistics.median(values):6.2f}s   "
+              f"min {min(values):6.2f}s   max {max(values):6.2f}s")
+
+    print(f"\n=== Cold start ({len(runs)} runs) ===")
+    line("listen (port open)", [r["listen"] for r in runs])
+    line("ready (/ready = 200)", [r["ready"] for r in runs])
+    line("server cold_start", [r["status"].get("cold_start_seconds") for r in runs])
+    components = sorted({name for r in runs for name in r["status"].get("load_seconds", {})})
+    for name in components:
+        line(f"  load {name}", [r["status"]["load_seconds"].get(name) for r in runs])
+    for r in runs:
+        if r["status"].get("errors"):
+            print(f"⚠️  Failed components: {r['status']['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="vad_server:app")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--fake", action="store_true", help="LLM/TTS giả lập (không cần Gemini/ZipVoice)")
+    parser.add_argument("--interval", type=float, default=0.05, help="Giây giữa hai lần hỏi /ready")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    runs = []
+    for i in range(args.runs):
+        run = measure(args)
+        ready = "failed" if run["ready"] is None else f"{run['ready']:.2f}s"
+        print(f"Run {i + 1}: listen {run['listen']:.2f}s, ready {ready}")
+        runs.append(run)
+    summarize(runs)
+
+
+if __name__ == "__main__":
+    main()
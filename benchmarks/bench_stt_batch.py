@@ -0,0 +1,108 @@
+"""
+Benchmark: throughput của STT micro-batching theo kích thước cửa sổ gom batch
+
+Mô phỏng N thiết bị kết thúc câu nói cùng lúc (các file WAV trong audio_files/),
+đo số câu/giây, số giây audio xử lý mỗi giây và độ trễ p50/p95 cho từng
+BATCH_WINDOW_MS. Dòng "no batching" (max batch = 1) là mốc so sánh.
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.bench_stt_batch --concurrency 8 --windows 0,10,30,60
+"""
+import argparse
+import statistics
+import threading
+import time
+from pathlib import Path
+
+import soundfile as sf
+
+from modules.audio import to_float32, resample
+from modules.stt import STTEngine
+from modules.stt_batch import BatchingSTTScheduler
+from settings import stt_settings as cfg
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_utterances(folder: Path, limit: int):
+    utterances = []
+    for path in sorted(folder.glob("*.wav"))[:limit]:
+        wav, sr = sf.read(str(path), dtype="float32")
+        utterances.append(resample(to_float32(wav), sr, cfg.SAMPLE_RATE))
+    if not utterances:
+        raise SystemExit(f"No WAV files found in {folder}")
+    return utterances
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+def run(engine, utterances, window_ms, max_batch, concurrency, rounds):
+    scheduler = BatchingSTTScheduler(engine, window_ms=window_ms, max_batch=max_batch)
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency)
+
+    def device(idx):
+        wav = utterances[idx % len(utterances)]
+        for _ in range(rounds):
+            # Mọi thiết bị kết thúc câu cùng lúc ở mỗi vòng
+            barrier.wait()
+            t0 = time.perf_counter()
+            scheduler.submit(wav).result()
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=device, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    scheduler.close()
+
+    total = concurrency * rounds
+    audio_sec = sum(len(utterances[i % len(utterances)]) for i in range(concurrency)) * rounds / cfg.SAMPLE_RATE
+    return {
+        "utt_per_sec": total / elapsed,
+        "audio_sec_per_sec": audio_sec / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "mean_batch": scheduler.mean_batch_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio-dir", type=Path, default=ROOT_DIR / "audio_files")
+    parser.add_argument("--concurrency", type=int, default=8, help="Số thiết bị mô phỏng")
+    parser.add_argument("--rounds", type=int, default=5, help="Số câu mỗi thiết bị")
+    parser.add_argument("--windows", default="0,10,30,60", help="Danh sách BATCH_WINDOW_MS cần đo")
+    parser.add_argument("--max-batch", type=int, default=cfg.BATCH_MAX_SIZE)
+    args = parser.parse_args()
+
+    engine = STTEngine(mode="offline")
+    utterances = load_utterances(args.audio_dir, args.concurrency)
+
+    # Warm-up để không tính thời gian khởi tạo onnxruntime
+    engine.transcribe_batch(utterances[:1])
+
+    rows = [("no batching", run(engine, utterances, 0, 1, args.concurrency, args.rounds))]
+    for window in [float(w) for w in args.windows.split(",") if w]:
+        rows.append((f"window {window:g} ms", run(engine, utterances, window, args.max_batch,
+                                                   args.concurrency, args.rounds)))
+
+    print(f"\nSTT batching benchmark: {args.concurrency} devices x {args.rounds} rounds, "
+          f"max batch {args.max_batch}, {cfg.NUM_THREADS} threads")
+    print(f"{'config':<16}{'utt/s':>8}{'audio s/s':>11}{'mean batch':>12}{'p50 ms':>9}{'p95 ms':>9}")
+    for name, r in rows:
+        print(f"{name:<16}{r['utt_per_sec']:>8.2f}{r['audio_sec_per_sec']:>11.2f}"
+              f"{r['mean_batch']:>12.2f}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Benchmark end-to-end: N thiết bị ESP32 giả lập nói chuyện với server qua websocket /ws
+
+Mỗi thiết bị phát lại các file WAV trong audio_files/ như vad/vad.ino: frame 1024 byte
+PCM 16kHz gửi đúng nhịp thời gian thực (mic không tắt, giữa các câu gửi im lặng), giả lập
+loa phát audio trả về theo đồng hồ thực và gửi "ACK <bytes>" mỗi 4096 byte đã phát.
+Mỗi file WAV nên là một câu nói (VAD cắt câu giữa file thì lượt đó bị tính sai).
+Đo p50/p95/p99 của:
+  - endpoint:    frame cuối của câu nói -> PROCESSING_START (VAD kết thúc câu)
+  - first audio: frame cuối của câu nói -> byte audio trả lời đầu tiên
+  - turn:        frame cuối của câu nói -> TTS_END (server chờ loa phát xong nếu DOWNLINK_WAIT_PLAYBACK)
+  - jitter:      mỗi chunk audio đến trễ hơn nhịp phát bao nhiêu; underrun = loa phát cạn buffer
+
+Chạy từ thư mục gốc của repo:
+    # Server đang chạy sẵn (uvicorn vad_server:app --port 8000)
+    python -m benchmarks.bench_ws_latency --url ws://localhost:8000/ws --devices 4 --turns 5
+    # Offline: tự khởi động vad_server với LLM/TTS giả lập, chỉ đo overhead của server
+    python -m benchmarks.bench_ws_latency --spawn --devices 8 --llm-ttft 0.4 --tts-rtf 0.3
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+import soundfile as sf
+
+from modules.audio import float_to_pcm16, to_float32, resample
+from modules.codec import CODECS
+from settings import server_settings as cfg
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+FRAME_BYTES = 1024        # I2S_READ_CHUNK_SIZE trong vad.ino
+ACK_BYTES = 4096          # PLAYBACK_ACK_BYTES trong vad.ino
+BYTE_RATE = cfg.SAMPLE_RATE * cfg.BIT_DEPTH_BYTES
+
+
+def load_utterances(folder: Path, limit: int) -> List[bytes]:
+    """PCM int16 16kHz của các file WAV (như mic của ESP32 thu được)"""
+    utterances = []
+    for path in sorted(folder.glob("*.wav"))[:limit]:
+        wav, sr = sf.read(str(path), dtype="float32")
+        if wav.ndim > 1:
+            wav = wav[:, 0]
+        utterances.append(float_to_pcm16(resample(to_float32(wav), sr, cfg.SAMPLE_RATE)).tobytes())
+    if not utterances:
+        raise SystemExit(f"No WAV files found in {folder}")
+    return utterances
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+@dataclass
+class TurnResult:
+    speech_end: float = 0.0
+    processing_start: Optional[float] = None
+    first_audio: Optional[float] = None
+    end: Optional[float] = None
+    audio_bytes: int = 0
+    underruns: int = 0
+    late: List[float] = field(default_factory=list)
+    aborted: bool = False
+    busy: bool = False
+
+
+class Playback:
+    """Loa của ESP32: phát audio nhận được theo đồng hồ thực, bắt đầu từ chunk đầu tiên"""
+
+    def __init__(self):
+        self.turn: Optional[TurnResult] = None
+        self.play_end: Optional[float] = None
+        self.received = 0
+        self.acked = 0
+        self._last_arrival = None
+        self._last_bytes = 0
+
+    def begin(self, turn: TurnResult):
+        self.turn = turn
+        self.play_end = None
+        self.received = self.acked = 0
+        self._last_arrival = None
+
+    def on_audio(self, now: float, nbytes: int):
+        turn = self.turn
+        if turn.first_audio is None:
+            turn.first_audio = now
+        if self.play_end is not None and now > self.play_end:
+            turn.underruns += 1
+        if self._last_arrival is not None:
+            # Chunk đến trễ hơn độ dài audio của chunk trước (đến sớm thì chỉ làm đầy buffer)
+            turn.late.append(max(0.0, now - self._last_arrival - self._last_bytes / BYTE_RATE))
+        self._last_arrival, self._last_bytes = now, nbytes
+        self.play_end = max(self.play_end or now, now) + nbytes / BYTE_RATE
+        self.received += nbytes
+        turn.audio_bytes += nbytes
+
+    def played(self, now: float) -> int:
+        if self.play_end is None:
+            return 0
+        return max(0, self.received - int(max(0.0, self.play_end - now) * BYTE_RATE))
+
+
+async def run_device(index: int, url: str, utterances: List[bytes], args, results: List[TurnResult]):
+    import websockets
+
+    codec_name = args.codec
+    encoder, decoder = CODECS[codec_name](), CODECS[codec_name]()
+    frame_bytes = encoder.frame_samples * cfg.BIT_DEPTH_BYTES if encoder.frame_samples else FRAME_BYTES
+    frame_sec = frame_bytes / BYTE_RATE
+    silence = bytes(frame_bytes)
+    # Mỗi thiết bị giả lập có session (lịch sử hội thoại) riêng
+    url = f"{url}?{cfg.SESSION_QUERY_PARAM}=bench-{index}"
+    if codec_name != "pcm":
+        url = f"{url}&codec={codec_name}"
+
+    await asyncio.sleep(index * args.stagger)
+    async with websockets.connect(url, max_size=None) as ws:
+        playback = Playback()
+        turn_done = asyncio.Event()
+
+        async def receiver():
+            async for message in ws:
+                now = time.monotonic()
+                turn = playback.turn
+                if isinstance(message, bytes):
+                    if turn is not None:
+                        playback.on_audio(now, len(decoder.decode(message)))
+                elif message.startswith("CODEC") and message.split()[-1] != codec_name:
+                    raise RuntimeError(f"Server refused codec {codec_name}: {message}")
+                elif turn is None:
+                    continue
+                elif message == "PROCESSING_START":
+                    turn.processing_start = now
+                elif message == "TTS_ABORT":
+                    turn.aborted = True
+                elif message == "SERVER_BUSY":
+                    turn.busy = True
+                elif message == "TTS_END":
+                    turn.end = now
+                    turn_done.set()
+
+        clock = time.monotonic()
+
+        async def send_frame(pcm: bytes):
+            # Nhịp của mic: frame thứ n gửi lúc clock + n * frame_sec, không cộng dồn độ trễ
+            nonlocal clock
+            delay = clock - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            clock += frame_sec
+            if len(pcm) < frame_bytes:
+                pcm += bytes(frame_bytes - len(pcm))
+            await ws.send(encoder.encode(pcm))
+            played = playback.played(time.monotonic())
+            if args.ack and played - playback.acked >= ACK_BYTES:
+                playback.acked = played
+                await ws.send(f"ACK {played}")
+
+        receive_task = asyncio.create_task(receiver())
+        try:
+            for n in range(args.turns):
+                pcm = utterances[(index + n) % len(utterances)]
+                turn = TurnResult()
+                turn_done.clear()
+                playback.begin(turn)
+                for i in range(0, len(pcm), frame_bytes):
+                    await send_frame(pcm[i:i + frame_bytes])
+                turn.speech_end = time.monotonic()
+                # Mic vẫn gửi (im lặng) trong lúc chờ trả lời, như vad.ino khi bật barge-in
+                while not turn_done.is_set() and time.monotonic() - turn.speech_end < args.timeout:
+                    if receive_task.done():
+                        receive_task.result()
+                        return
+                    await send_frame(silence)
+                results.append(turn)
+                for _ in range(int(args.pause / frame_sec)):
+                    await send_frame(silence)
+        finally:
+            receive_task.cancel()
+
+
+def summarize(results: List[TurnResult], args, elapsed: float):
+    done = [r for r in results if r.end is not None]
+    answered = [r for r in done if r.first_audio is not None]
+    rows = [
+        ("endpoint", [r.processing_start - r.speech_end for r in done if r.processing_start is not None]),
+        ("first audio", [r.first_audio - r.speech_end for r in answered]),
+        ("turn", [r.end - r.speech_end for r in done]),
+        ("jitter", [late for r in answered for late in r.late]),
+    ]
+    print(f"\nWebsocket latency benchmark: {args.devices} devices x {args.turns} turns, "
+          f"codec {args.codec}, {elapsed:.1f}s")
+    print(f"turns: {len(results)} finished, {len(results) - len(done)} timed out, "
+          f"{sum(r.busy for r in done)} busy, {sum(r.aborted for r in done)} aborted, "
+          f"{sum(r.underruns for r in answered)} underruns")
+    print(f"{'metric':<14}{'n':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, values in rows:
+        if not values:
+            print(f"{name:<14}{0:>6}")
+            continue
+        print(f"{name:<14}{len(values):>6}{percentile(values, 50) * 1000:>9.0f}"
+              f"{percentile(values, 95) * 1000:>9.0f}{percentile(values, 99) * 1000:>9.0f}"
+              f"{max(values) * 1000:>9.0f}")
+
+
+async def run_clients(args):
+    utterances = load_utterances(args.audio_dir, args.limit)
+    results: List[TurnResult] = []
+    start = time.monotonic()
+    outcomes = await asyncio.gather(
+        *(run_device(i, args.url, utterances, args, results) for i in range(args.devices)),
+        return_exceptions=True
+    )
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            print(f"⚠️  Device {i} failed: {outcome!r}")
+    summarize(results, args, time.monotonic() - start)
+
+
+def serve(args):
+    """Chạy vad_server với LLM/TTS giả lập (process con của --spawn)"""
+    from settings import llm_settings, tts_settings
+    llm_settings.LLM_BACKEND = "fake"
+    llm_settings.FAKE_LLM_FIRST_CHUNK_DELAY = args.llm_ttft
+    llm_settings.FAKE_LLM_CHUNK_DELAY = args.llm_chunk_delay
+    # Mọi lượt đều phải qua LLM + TTS: tắt cache câu trả lời và audio store
+    llm_settings.RESPONSE_CACHE_ENABLED = False
+    tts_settings.TTS_BACKEND = "fake"
+    tts_settings.FAKE_TTS_FIRST_DELAY = args.tts_delay
+    tts_settings.FAKE_TTS_RTF = args.tts_rtf
+    tts_settings.AUDIO_STORE_DIR = None
+    cfg.LOG_LEVEL = args.log_level
+
+    import uvicorn
+    import vad_server
+    uvicorn.run(vad_server.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def spawn_server(args) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "benchmarks.bench_ws_latency", "--serve", "--port", str(args.port),
+        "--llm-ttft", str(args.llm_ttft), "--llm-chunk-delay", str(args.llm_chunk_delay),
+        "--tts-delay", str(args.tts_delay), "--tts-rtf", str(args.tts_rtf), "--log-level", args.log_level,
+    ]
+    server = subprocess.Popen(cmd, cwd=str(ROOT_DIR))
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"Server exited with code {server.returncode}")
+        try:
+            # /ready trả 503 (HTTPError, cũng là OSError) tới khi model nạp xong
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/ready", timeout=1).read()
+            return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise SystemExit("Server did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Mặc định ws://127.0.0.1:<port>/ws")
+    parser.add_argument("--audio-dir", type=Path, default=ROOT_DIR / "audio_files")
+    parser.add_argument("--limit", type=int, default=16, help="Số file WAV tối đa được dùng")
+    parser.add_argument("--devices", type=int, default=4, help="Số thiết bị mô phỏng")
+    parser.add_argument("--turns", type=int, default=5, help="Số câu mỗi thiết bị")
+    parser.add_argument("--stagger", type=float, default=0.5, help="Giây giữa lúc các thiết bị kết nối")
+    parser.add_argument("--pause", type=float, default=1.0, help="Giây im lặng giữa hai câu")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Giây chờ TTS_END tối đa mỗi lượt")
+    parser.add_argument("--codec", default="pcm", choices=sorted(CODECS))
+    parser.add_argument("--no-ack", dest="ack", action="store_false", help="Không gửi ACK khi phát")
+    # Server giả lập (--spawn)
+    parser.add_argument("--spawn", action="store_true", help="Tự chạy vad_server với LLM/TTS giả lập")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-ttft", type=float, default=0.4, help="Giây tới token đầu của LLM giả")
+    parser.add_argument("--llm-chunk-delay", type=float, default=0.03)
+    parser.add_argument("--tts-delay", type=float, default=0.15, help="Giây cố định mỗi đoạn TTS giả")
+    parser.add_argument("--tts-rtf", type=float, default=0.3, help="Real-time factor của TTS giả")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    args.url = args.url or f"ws://127.0.0.1:{args.port}/ws"
+    server = spawn_server(args) if args.spawn else None
+    try:
+        asyncio.run(run_clients(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
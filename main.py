@@ -1,46 +1,51 @@
 import asyncio
-import wave
-from datetime import datetime
+import logging
+import time
+from typing import Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-import os
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 # --- IMPORT PIPELINE TỪ THƯ MỤC MODULES ---
 # Đảm bảo thư mục 'modules' có file __init__.py (dù là file trống)
 # để Python nhận diện nó là một package.
-from modules.pipeline import VoiceAssistantPipeline
+from modules.async_pipeline import AsyncVoiceAssistantPipeline, ServerBusyError
+from modules.audio import to_pcm16
+from modules.codec import negotiate
+from modules import metrics
+from modules.recorder import AudioRecorder
+from modules.session import SessionManager
+from modules.startup import Startup
+from modules.vad import endpoint_silence
+from settings import server_settings as server_cfg
 
 # --- Cấu hình ---
 # Các thông số audio này PHẢI KHỚP với code ESP32
-SAMPLE_RATE = 16000
-BIT_DEPTH_BYTES = 2  # 16-bit = 2 bytes
-CHANNELS = 1
-AUDIO_TIMEOUT = 0.7  # Tăng nhẹ thời gian chờ để linh hoạt hơn
+SAMPLE_RATE = server_cfg.SAMPLE_RATE
+BIT_DEPTH_BYTES = server_cfg.BIT_DEPTH_BYTES  # 16-bit = 2 bytes
+CHANNELS = server_cfg.CHANNELS
+# Thời gian chờ im lặng giảm dần theo độ dài câu (endpoint_silence, settings/vad_settings.py):
+# câu ngắn chờ lâu hơn để không cắt ngang, câu dài kết thúc nhanh hơn
+AUDIO_TIMEOUT_MAX = 1.0
+AUDIO_TIMEOUT_MIN = 0.5
 AUDIO_CHUNK_SIZE = 1024 # Kích thước mỗi đoạn audio gửi về client
 
 # --- Khởi tạo ứng dụng và Pipeline ---
+metrics.setup_logging()
+logger = logging.getLogger("main")
 app = FastAPI()
 
 # Khởi tạo pipeline MỘT LẦN DUY NHẤT khi server bắt đầu.
-# Việc này giúp tải các mô hình AI lên trước, tránh độ trễ khi xử lý.
-pipeline = VoiceAssistantPipeline()
-
-def save_audio_to_wav(audio_data: bytes, folder: str = "audio_files") -> str:
-    """Lưu dữ liệu âm thanh thô vào một file WAV."""
-    os.makedirs(folder, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename = os.path.join(folder, f"recording_{timestamp}.wav")
-    
-    try:
-        with wave.open(filename, 'wb') as wf:
-            wf.setnchannels(CHANNELS)
-            wf.setsampwidth(BIT_DEPTH_BYTES)
-            wf.setframerate(SAMPLE_RATE)
-            wf.writeframes(audio_data)
-        print(f"Audio received and saved to: {filename}")
-        return filename
-    except Exception as e:
-        print(f"Error saving WAV file: {e}")
-        return ""
+# Các mô hình AI được nạp song song trên thread nền (modules/startup.py), server nhận kết nối ngay;
+# GET /ready báo khi nạp xong. STT/TTS chạy trên thread pool riêng, Gemini gọi async -> event loop không bị chặn
+startup = Startup()
+pipeline = AsyncVoiceAssistantPipeline(startup=startup)
+startup.start()
+recorder = AudioRecorder()
+# Mỗi thiết bị (?device=<id> hoặc "HELLO <id>") có lịch sử hội thoại riêng
+sessions = SessionManager(on_evict=lambda session_id: pipeline.llm_engine.history.release(session_id))
+metrics.REGISTRY.add_collector(startup.stats)
+metrics.REGISTRY.add_collector(pipeline.stats)
+metrics.REGISTRY.add_collector(sessions.stats)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -48,70 +53,133 @@ async def websocket_endpoint(websocket: WebSocket):
     Endpoint nhận stream audio, gọi AI pipeline, và stream audio trả về.
     """
     await websocket.accept()
-    print(f"Client connected from: {websocket.client.host}")
+    logger.info("Client connected from: %s", websocket.client.host)
+    if not await startup.wait_ready(server_cfg.STARTUP_WAIT_TIMEOUT):
+        # Model còn đang nạp (1013: thử lại sau) hoặc nạp lỗi (1011)
+        await websocket.close(code=1011 if startup.done else 1013)
+        return
+    # Codec audio của kết nối (?codec=adpcm|opus), mặc định PCM thô
+    codec_offer = websocket.query_params.get("codec")
+    codec = negotiate(codec_offer)
+    if codec_offer is not None:
+        await websocket.send_text(f"CODEC {codec.name}")
+    # Codec theo frame (Opus) cần mỗi message đúng một frame
+    chunk_size = codec.frame_samples * BIT_DEPTH_BYTES if codec.frame_samples else AUDIO_CHUNK_SIZE
+
+    try:
+        device_id, identified, pending = await sessions.identify(websocket)
+    except (WebSocketDisconnect, RuntimeError):
+        return
+    session = await sessions.attach(device_id, websocket, identified)
+    if identified:
+        await websocket.send_text(f"SESSION {session.session_id}")
     
     try:
         # Vòng lặp chính, cho phép xử lý nhiều câu nói trong một kết nối
         while True:
             audio_chunks = []
+            if pending is not None:
+                # Client cũ không handshake: message đầu tiên đã là audio
+                if pending["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(pending.get("code", 1000))
+                if pending.get("bytes"):
+                    audio_chunks.append(codec.decode(pending["bytes"]))
+                pending = None
             
             # 1. NHẬN AUDIO TỪ ESP32
-            print("\nListening for audio from client...")
+            logger.info("Listening for audio from client...")
+            received = sum(len(chunk) for chunk in audio_chunks)
             while True:
+                audio_timeout = endpoint_silence(
+                    received / (SAMPLE_RATE * BIT_DEPTH_BYTES), AUDIO_TIMEOUT_MAX, AUDIO_TIMEOUT_MIN
+                )
                 try:
-                    data = await asyncio.wait_for(
-                        websocket.receive_bytes(), 
-                        timeout=AUDIO_TIMEOUT
+                    message = await asyncio.wait_for(
+                        websocket.receive(), 
+                        timeout=audio_timeout
                     )
-                    audio_chunks.append(data)
                 except asyncio.TimeoutError:
                     # Hết thời gian chờ -> người dùng đã ngừng nói
                     break
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                data = message.get("bytes")
+                if not data:
+                    # Tin nhắn text (vd. "ACK <bytes>" firmware gửi khi phát): server này không pace downlink
+                    continue
+                audio_chunks.append(codec.decode(data))
+                received += len(audio_chunks[-1])
             
+            if not session.owned_by(websocket):
+                return  # Thiết bị đã kết nối lại bằng kết nối khác
             if not audio_chunks:
                 continue # Nếu không có audio, quay lại vòng lặp chờ
+            session.touch()
+
+            # Người dùng ngừng nói từ audio_timeout giây trước: đó là mốc của lượt này
+            trace = metrics.start_turn(session.session_id, start=time.monotonic() - audio_timeout)
+            trace.add_span("vad_endpoint", audio_timeout)
 
-            # 2. LƯU FILE AUDIO NHẬN ĐƯỢC
+            # 2. GHI LẠI AUDIO (chạy nền, không chặn pipeline)
             full_audio_data = b"".join(audio_chunks)
-            input_audio_path = save_audio_to_wav(full_audio_data)
-            
-            if not input_audio_path:
-                print("Failed to save input audio. Awaiting next message.")
-                continue
+            recorder.submit(full_audio_data, prefix=f"recording_{session.file_tag}")
 
-            # 3. GỌI AI PIPELINE ĐỂ XỬ LÝ
+            # 3. GỌI AI PIPELINE ĐỂ XỬ LÝ (trực tiếp trên buffer, không qua file)
             try:
-                # Gọi hàm process từ pipeline của bạn
-                result = pipeline.process(audio_input_path=input_audio_path)
-                output_audio_path = result.get("output_audio")
-
-                if not output_audio_path or not os.path.exists(output_audio_path):
-                    print("Pipeline did not return a valid audio output path.")
-                    continue
+                result = await pipeline.process_pcm(
+                    full_audio_data, session_id=session.session_id, device_id=session.device_id
+                )
 
-                # 4. GỬI AUDIO KẾT QUẢ TRỞ LẠI ESP32
-                print(f"Streaming response audio from: {output_audio_path}")
-                with open(output_audio_path, 'rb') as audio_file:
-                    while True:
-                        chunk = audio_file.read(AUDIO_CHUNK_SIZE)
-                        if not chunk:
-                            break # Đã đọc hết file
-                        await websocket.send_bytes(chunk)
+                # 4. GỬI AUDIO KẾT QUẢ TRỞ LẠI ESP32 (PCM 16-bit mono 16kHz)
+                pcm_bytes = to_pcm16(result["audio"], result["sample_rate"], SAMPLE_RATE).tobytes()
+                logger.info("Streaming response audio (%d bytes)", len(pcm_bytes))
+                for i in range(0, len(pcm_bytes), chunk_size):
+                    await websocket.send_bytes(codec.encode(pcm_bytes[i:i + chunk_size]))
+                    if i == 0:
+                        trace.mark("first_byte_sent")
+                trace.mark("last_byte_sent")
                 
-                print("Finished streaming response.")
+                logger.info("Finished streaming response.")
                 
                 # 5. GỬI TÍN HIỆU KẾT THÚC
                 # Tín hiệu này rất quan trọng để ESP32 biết và chuyển về trạng thái lắng nghe
                 await websocket.send_text("TTS_END")
+                trace.finish("ok")
 
+            except ServerBusyError as e:
+                trace.finish("busy")
+                logger.warning("%s", e)
+                await websocket.send_text("SERVER_BUSY")
+                await websocket.send_text("TTS_END")
+            except WebSocketDisconnect:
+                trace.finish("disconnected")
+                raise
             except Exception as e:
-                print(f"An error occurred during pipeline processing: {e}")
+                trace.finish("error")
+                logger.exception("An error occurred during pipeline processing: %s", e)
 
     except WebSocketDisconnect:
-        print(f"Client {websocket.client.host} disconnected.")
+        logger.info("Client %s disconnected.", websocket.client.host)
     except Exception as e:
-        print(f"A critical error occurred in websocket connection: {e}")
+        logger.error("A critical error occurred in websocket connection: %s", e)
+    finally:
+        await sessions.detach(session, websocket)
 
 @app.get("/")
 def read_root():
-    return {"status": "Voice Assistant Server is running"}
\ No newline at end of file
+    return {"status": "Voice Assistant Server is running", "ready": startup.ready,
+            **pipeline.stats(), **sessions.stats()}
+
+@app.get("/ready")
+def read_ready():
+    """200 khi model đã nạp xong, 503 khi còn đang nạp hoặc nạp lỗi"""
+    return JSONResponse(startup.status(), status_code=200 if startup.ready else 503)
+
+@app.get("/metrics")
+def read_metrics():
+    """Prometheus text format"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+def read_traces(session: Optional[str] = None):
+    return metrics.TRACE_LOG.recent(session)
@@ -0,0 +1,504 @@
+"""
+Async Voice Assistant Pipeline
+Chạy pipeline mà không chặn event loop, để một server phục vụ nhiều ESP32 cùng lúc:
+  - STT, TTS chạy trên các thread pool riêng cho từng stage
+  - Gemini gọi qua client.aio (async I/O, không tốn thread)
+  - AdmissionController giới hạn số lượt xử lý đồng thời, độ dài hàng đợi
+    và chia lượt công bằng (round-robin) giữa các thiết bị; slot được trả ngay khi
+    đoạn TTS cuối xong, không giữ trong lúc audio còn được gửi theo tốc độ phát.
+    Lượt speculative (chưa chắc người dùng đã nói xong) có budget riêng
+  - Mọi stage nhận CancelToken (modules/cancel.py): barge-in huỷ cả lượt đang chạy
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Callable, Optional, Union
+
+import numpy as np
+
+from settings import server_settings as cfg
+from settings import stt_settings as stt_cfg
+from settings import tts_settings as tts_cfg
+from . import metrics
+from .cancel import CancelToken, SpeculativeToken, TurnCancelled, committed, is_cancelled
+from .pipeline import VoiceAssistantPipeline
+from .segmenter import SentenceSegmenter
+from .startup import Startup
+from .stt_batch import BatchingSTTScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class ServerBusyError(RuntimeError):
+    """Hàng đợi đã đầy, lượt xử lý bị từ chối ngay thay vì chờ vô hạn"""
+
+
+class AdmissionSlot:
+    """Slot của một lượt; release() trả slot sớm (TTS đã xong, audio còn đang gửi), gọi nhiều lần không sao"""
+
+    def __init__(self, release: Callable[[], None]):
+        self._release = release
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._release()
+
+
+class AdmissionController:
+    """
+    Giới hạn số lượt (turn) xử lý đồng thời.
+    Lượt vượt quá giới hạn được xếp hàng theo từng thiết bị; khi có slot trống,
+    thiết bị được phục vụ lần lượt theo round-robin để một thiết bị nói nhiều
+    không chiếm hết server.
+    Lượt speculative chạy trong budget riêng (max_speculative) để lượt có thể bị bỏ không đẩy
+    lượt đã xác nhận của thiết bị khác vào hàng đợi; hết budget thì chờ commit rồi xếp hàng như thường.
+    Lượt đã commit giữ slot speculative tới khi xong (chuyển slot giữa chừng có thể bắt lượt đang
+    phát phải xếp hàng): có chủ ý, tối đa max_concurrent + max_speculative lượt cùng chạy.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = None,
+        max_queue: int = None,
+        max_queue_per_device: int = None,
+        max_speculative: int = None
+    ):
+        self.max_concurrent = max_concurrent or cfg.MAX_CONCURRENT_TURNS
+        self.max_queue = cfg.MAX_QUEUED_TURNS if max_queue is None else max_queue
+        self.max_queue_per_device = max_queue_per_device or cfg.MAX_QUEUED_PER_DEVICE
+        self.max_speculative = cfg.MAX_SPECULATIVE_TURNS if max_speculative is None else max_speculative
+        self._active = 0
+        self._waiting = 0
+        self._speculative = 0
+        self.speculation_deferred = 0  # Lượt speculative phải chờ commit vì hết budget
+        # device_id -> deque[Future]; thứ tự key = thứ tự round-robin
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self.rejected = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    async def acquire(self, device_id: str):
+        if self._active < self.max_concurrent and self._waiting == 0:
+            self._active += 1
+            return
+
+        device_queue = self._queues.get(device_id)
+        if self._waiting >= self.max_queue or (
+            device_queue is not None and len(device_queue) >= self.max_queue_per_device
+        ):
+            self.rejected += 1
+            raise ServerBusyError(
+                f"Server busy: {self._active} active, {self._waiting} queued"
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(device_id, deque()).append(future)
+        self._waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Đã được cấp slot đúng lúc bị huỷ: trả slot lại cho người khác
+                self.release()
+            else:
+                self._remove_waiter(device_id, future)
+            raise
+
+    def _remove_waiter(self, device_id: str, future):
+        device_queue = self._queues.get(device_id)
+        if device_queue is not None and future in device_queue:
+            device_queue.remove(future)
+            self._waiting -= 1
+            if not device_queue:
+                del self._queues[device_id]
+
+    def release(self):
+        # Chuyển slot cho thiết bị kế tiếp theo round-robin
+        while self._queues:
+            device_id, device_queue = next(iter(self._queues.items()))
+            future = device_queue.popleft()
+            self._waiting -= 1
+            del self._queues[device_id]
+            if device_queue:
+                # Thiết bị còn lượt chờ -> xuống cuối vòng
+                self._queues[device_id] = device_queue
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def _release_speculative(self):
+        self._speculative -= 1
+
+    @asynccontextmanager
+    async def slot(self, device_id: str, cancel: Optional[CancelToken] = None):
+        """`cancel` là SpeculativeToken chưa được quyết định: dùng budget speculative"""
+        if isinstance(cancel, SpeculativeToken) and cancel.pending:
+            if self._speculative < self.max_speculative:
+                self._speculative += 1
+                slot = AdmissionSlot(self._release_speculative)
+                try:
+                    yield slot
+                finally:
+                    slot.release()
+                return
+            # Hết budget: không làm trước nữa, chờ VAD xác nhận rồi xếp hàng như lượt thường
+            self.speculation_deferred += 1
+            if not await committed(cancel):
+                raise TurnCancelled(cancel.reason or "speculation discarded")
+        with metrics.span("admission_wait"):
+            await self.acquire(device_id)
+        slot = AdmissionSlot(self.release)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def stats(self) -> dict:
+        return {
+            "active_turns": self._active,
+            "queued_turns": self._waiting,
+            "queued_devices": len(self._queues),
+            "rejected_turns": self.rejected,
+            "max_concurrent_turns": self.max_concurrent,
+            "speculative_turns": self._speculative,
+            "speculation_deferred": self.speculation_deferred,
+        }
+
+
+def _discard(future: asyncio.Future):
+    """Future không còn ai chờ: huỷ nếu chưa chạy, đang chạy thì bỏ kết quả (kể cả TurnCancelled)"""
+    if not future.cancel():
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+class AsyncVoiceAssistantPipeline:
+    """Bọc VoiceAssistantPipeline: mỗi stage chạy trên executor riêng, có admission control"""
+
+    def __init__(self, pipeline: VoiceAssistantPipeline = None, startup: Optional[Startup] = None):
+        """`startup`: engine được nạp nền (xem VoiceAssistantPipeline), chỉ dùng sau khi startup.ready"""
+        self.pipeline = pipeline or VoiceAssistantPipeline(startup)
+        self.stt_executor = ThreadPoolExecutor(max_workers=cfg.STT_WORKERS, thread_name_prefix="stt")
+        self.tts_executor = ThreadPoolExecutor(max_workers=cfg.TTS_WORKERS, thread_name_prefix="tts")
+        self.admission = AdmissionController()
+        self.stt_batcher = None
+        if self.stt_engine is not None:
+            self._create_stt_batcher()
+        else:
+            startup.add("stt_batcher", self._create_stt_batcher, after=("stt",))
+
+    def _create_stt_batcher(self):
+        # Offline STT: gom các câu đến gần nhau từ nhiều thiết bị thành một batch
+        # (MODEL_SERVERS: STT server tự gom batch cho mọi worker)
+        if stt_cfg.BATCH_DECODING and not self.stt_engine.is_online and not cfg.MODEL_SERVERS:
+            self.stt_batcher = BatchingSTTScheduler(self.stt_engine)
+
+    @property
+    def stt_engine(self):
+        return self.pipeline.stt_engine
+
+    @property
+    def llm_engine(self):
+        return self.pipeline.llm_engine
+
+    @property
+    def tts_engine(self):
+        return self.pipeline.tts_engine
+
+    async def run_stt(self, fn, *args):
+        """Chạy một hàm STT (vd. OnlineSTTSession.accept_pcm) trên STT executor"""
+        return await metrics.run_in_context(asyncio.get_running_loop(), self.stt_executor, fn, *args)
+
+    async def run_tts(self, fn, *args):
+        return await metrics.run_in_context(asyncio.get_running_loop(), self.tts_executor, fn, *args)
+
+    async def transcribe(self, pcm: Union[bytes, np.ndarray], sample_rate: Optional[int] = None) -> str:
+        with metrics.span("stt"):
+            if self.stt_batcher is not None:
+                text = await self.stt_batcher.transcribe(pcm, sample_rate)
+            else:
+                text = await self.run_stt(self.stt_engine.transcribe_array, pcm, sample_rate)
+        metrics.mark("stt_done")
+        return text
+
+    async def synthesize(self, text: str, cancel: Optional[CancelToken] = None):
+        return await self.run_tts(partial(self.tts_engine.synthesize_array, text, cancel=cancel))
+
+    async def respond_stream(
+        self,
+        input_text: str,
+        session_id: str = "default",
+        start_time: Optional[float] = None,
+        cancel: Optional[CancelToken] = None,
+        slot: Optional[AdmissionSlot] = None
+    ) -> AsyncIterator[dict]:
+        """
+        LLM (async streaming) -> cắt câu -> TTS trên tts_executor.
+        Tối đa STREAM_PREFETCH đoạn được tổng hợp trước trong khi đoạn hiện tại đang gửi.
+        `slot` (admission) được trả ngay khi đoạn cuối đã tổng hợp xong, trước khi nó được gửi.
+
+        `cancel` (vd. barge-in): dừng stream Gemini, huỷ các đoạn chưa tổng hợp và
+        ngắt đoạn đang tổng hợp giữa chừng; generator kết thúc sớm và audio dở dang không
+        được lưu vào cache. Generator bị đóng sớm (client ngắt) cũng huỷ như vậy.
+        """
+        start_time = start_time or time.time()
+        cancel = cancel or CancelToken()
+        audio_tag = self.tts_engine.cache_tag
+        cached = await self.llm_engine.alookup_cache(input_text, session_id)
+        if cached is not None and cached.has_audio(audio_tag):
+            # Câu hỏi lặp lại: phát lại audio đã lưu, không gọi Gemini/ZipVoice
+            if not await committed(cancel):
+                return
+            await self.llm_engine.acommit_cached_reply(input_text, cached, session_id)
+            metrics.mark("response_cache_hit")
+            if slot is not None:
+                slot.release()
+            for index, (segment, wav, sr) in enumerate(cached.iter_segments()):
+                metrics.mark("tts_first_audio")
+                yield {
+                    "input_text": input_text,
+                    "segment": segment,
+                    "audio": wav,
+                    "sample_rate": sr,
+                    "index": index
+                }
+            metrics.mark("tts_done")
+            return
+
+        loop = asyncio.get_running_loop()
+        pending: asyncio.Queue = asyncio.Queue(maxsize=1 + max(tts_cfg.STREAM_PREFETCH, 0))
+        done = object()
+        deltas = []
+        synthesized = []
+        queued = 0         # Số đoạn producer đã đưa vào hàng đợi
+        produced = False   # Producer đã đưa hết các đoạn (LLM xong)
+
+        def synthesize_later(segment):
+            return metrics.run_in_context(
+                loop, self.tts_executor, partial(self.tts_engine.synthesize_array, segment, cancel=cancel)
+            )
+
+        async def enqueue(segment):
+            nonlocal queued
+            await pending.put((segment, synthesize_later(segment)))
+            queued += 1
+
+        async def producer():
+            nonlocal produced
+            try:
+                segmenter = SentenceSegmenter()
+                # Miss đã tra ở trên; chỉ khi có câu trả lời text (chưa có audio) mới tra lại
+                async for delta in self.llm_engine.achat_stream(
+                    input_text, session_id=session_id, use_cache=cached is not None, cancel=cancel
+                ):
+                    deltas.append(delta)
+                    for segment in segmenter.feed(delta):
+                        await enqueue(segment)
+                if not cancel.cancelled:
+                    for segment in segmenter.flush():
+                        await enqueue(segment)
+                    produced = True
+            finally:
+                await pending.put((done, None))
+
+        producer_task = asyncio.create_task(producer())
+        index = 0
+        completed = False
+        try:
+            while True:
+                segment, future = await pending.get()
+                if segment is done:
+                    break
+                if cancel.cancelled:
+                    _discard(future)
+                    break
+                try:
+                    wav, sr = await future
+                except TurnCancelled:
+                    break
+                if cancel.cancelled:
+                    break
+                if slot is not None and produced and index + 1 == queued:
+                    # Đoạn cuối đã có audio: STT/LLM/TTS rảnh cho lượt khác trong lúc đoạn này được phát
+                    slot.release()
+                if index == 0:
+                    metrics.mark("tts_first_audio")
+                    logger.info("✓ First audio ready after %.2fs", time.time() - start_time)
+                synthesized.append((segment, wav, sr))
+                yield {
+                    "input_text": input_text,
+                    "segment": segment,
+                    "audio": wav,
+                    "sample_rate": sr,
+                    "index": index
+                }
+                index += 1
+            if cancel.cancelled:
+                logger.info("⏹️  Turn cancelled (%s) after %d segments", cancel.reason, index)
+                return
+            # Đưa lỗi của producer (nếu có) ra ngoài
+            await producer_task
+            metrics.mark("tts_done")
+            completed = True
+            self.llm_engine.remember_audio(input_text, "".join(deltas), synthesized, audio_tag)
+        finally:
+            if not completed:
+                # Bị huỷ hoặc bị đóng giữa chừng: giải phóng TTS/Gemini cho thiết bị khác
+                cancel.cancel(cancel.reason or "stream closed")
+            if not producer_task.done():
+                producer_task.cancel()
+            # Chờ producer dừng hẳn (finally của nó còn put vào queue) và lấy lỗi nếu có
+            await asyncio.wait([producer_task])
+            if not producer_task.cancelled():
+                producer_task.exception()
+            while not pending.empty():
+                _, future = pending.get_nowait()
+                if future is not None:
+                    _discard(future)
+
+    async def not_heard_stream(
+        self, cancel: Optional[CancelToken] = None, slot: Optional[AdmissionSlot] = None
+    ) -> AsyncIterator[dict]:
+        """STT không ra chữ nào: phát câu NOT_HEARD_REPLY (có sẵn trong phrase bank)"""
+        if not tts_cfg.NOT_HEARD_REPLY or is_cancelled(cancel):
+            return
+        wav, sr = await self.synthesize(tts_cfg.NOT_HEARD_REPLY, cancel)
+        if slot is not None:
+            slot.release()
+        yield {
+            "input_text": "",
+            "segment": tts_cfg.NOT_HEARD_REPLY,
+            "audio": wav,
+            "sample_rate": sr,
+            "index": 0
+        }
+
+    async def process_pcm_stream(
+        self,
+        pcm: Union[bytes, np.ndarray],
+        session_id: str = "default",
+        device_id: str = "default",
+        sample_rate: Optional[int] = None,
+        cancel: Optional[CancelToken] = None
+    ) -> AsyncIterator[dict]:
+        """Một lượt hoàn chỉnh (STT -> LLM -> TTS streaming), có admission control"""
+        async with self.admission.slot(device_id, cancel) as slot:
+            start_time = time.time()
+            input_text = await self.transcribe(pcm, sample_rate)
+            logger.info("✓ Transcribed: %s", input_text)
+            if is_cancelled(cancel):
+                return
+            items = (
+                self.respond_stream(input_text, session_id, start_time, cancel, slot)
+                if input_text else self.not_heard_stream(cancel, slot)
+            )
+            async for item in items:
+                yield item
+
+    async def respond_text_stream(
+        self,
+        input_text: str,
+        session_id: str = "default",
+        device_id: str = "default",
+        cancel: Optional[CancelToken] = None
+    ) -> AsyncIterator[dict]:
+        """Như process_pcm_stream nhưng bắt đầu từ text (STT online đã chạy xong)"""
+        async with self.admission.slot(device_id, cancel) as slot:
+            items = (
+                self.respond_stream(input_text, session_id, cancel=cancel, slot=slot)
+                if input_text else self.not_heard_stream(cancel, slot)
+            )
+            async for item in items:
+                yield item
+
+    async def process_pcm(
+        self,
+        pcm: Union[bytes, np.ndarray],
+        session_id: str = "default",
+        device_id: str = "default",
+        sample_rate: Optional[int] = None,
+        cancel: Optional[CancelToken] = None
+    ) -> dict:
+        """Phiên bản không streaming: trả về cả câu trả lời một lần; lượt bị huỷ raise TurnCancelled"""
+        async with self.admission.slot(device_id, cancel):
+            start_time = time.time()
+            input_text = await self.transcribe(pcm, sample_rate)
+            logger.info("✓ Transcribed: %s", input_text)
+            if not input_text:
+                audio, audio_sr = np.zeros(0, dtype=np.float32), cfg.SAMPLE_RATE
+                if tts_cfg.NOT_HEARD_REPLY:
+                    audio, audio_sr = await self.synthesize(tts_cfg.NOT_HEARD_REPLY, cancel)
+                return {
+                    "input_text": "",
+                    "response_text": tts_cfg.NOT_HEARD_REPLY or "",
+                    "audio": audio,
+                    "sample_rate": audio_sr,
+                    "processing_time": time.time() - start_time
+                }
+
+            audio_tag = self.tts_engine.cache_tag
+            cached = await self.llm_engine.alookup_cache(input_text, session_id)
+            if cached is not None and cached.has_audio(audio_tag):
+                if not await committed(cancel):
+                    cancel.raise_if_cancelled()
+                await self.llm_engine.acommit_cached_reply(input_text, cached, session_id)
+                response_text = cached.reply
+                audio, audio_sr = cached.full_audio()
+            else:
+                parts = []
+                async for delta in self.llm_engine.achat_stream(
+                    input_text, session_id=session_id, use_cache=cached is not None, cancel=cancel
+                ):
+                    parts.append(delta)
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                response_text = "".join(parts)
+
+                audio, audio_sr = await self.synthesize(response_text, cancel)
+                self.llm_engine.remember_audio(
+                    input_text, response_text, [(response_text, audio, audio_sr)], audio_tag
+                )
+            processing_time = time.time() - start_time
+            metrics.mark("tts_done")
+            logger.info("✅ PIPELINE (async) COMPLETED in %.2fs", processing_time)
+
+            return {
+                "input_text": input_text,
+                "response_text": response_text,
+                "audio": audio,
+                "sample_rate": audio_sr,
+                "processing_time": processing_time
+            }
+
+    def stats(self) -> dict:
+        stats = self.admission.stats()
+        # Engine còn đang nạp (startup) thì chưa có số liệu của nó
+        if self.tts_engine is not None and self.tts_engine.audio_store is not None:
+            stats.update(self.tts_engine.audio_store.stats())
+        if self.llm_engine is not None:
+            if self.llm_engine.response_cache is not None:
+                stats.update(self.llm_engine.response_cache.stats())
+            stats.update(self.llm_engine.history.stats())
+        return stats
+
+    def shutdown(self):
+        if self.llm_engine is not None:
+            if self.llm_engine.response_cache is not None:
+                self.llm_engine.response_cache.close()
+            self.llm_engine.history.close()
+        if self.stt_batcher is not None:
+            self.stt_batcher.close()
+        self.stt_executor.shutdown(wait=False, cancel_futures=True)
+        self.tts_executor.shutdown(wait=False, cancel_futures=True)
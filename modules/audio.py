@@ -0,0 +1,61 @@
+"""
+Audio helpers dùng chung: chuyển đổi PCM int16 <-> float32, đổi sample rate
+Giữ audio trong NumPy buffer suốt pipeline, không qua file trung gian.
+Đổi sample rate luôn đi qua resampler polyphase dùng chung (modules/resampler.py).
+"""
+from typing import Dict
+
+import numpy as np
+
+from .resampler import Resampler, resample
+
+
+def to_float32(pcm) -> np.ndarray:
+    """bytes int16 / np.int16 / np.float32 -> float32 mono trong [-1, 1]"""
+    if isinstance(pcm, (bytes, bytearray, memoryview)):
+        return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    pcm = np.asarray(pcm)
+    if pcm.ndim > 1:
+        pcm = pcm.mean(axis=1) if pcm.shape[1] > 1 else pcm[:, 0]
+    if pcm.dtype == np.int16:
+        return pcm.astype(np.float32) / 32768.0
+    return pcm.astype(np.float32, copy=False)
+
+
+def float_to_pcm16(wav: np.ndarray) -> np.ndarray:
+    """float32 [-1, 1] -> int16 (một mảng tạm duy nhất)"""
+    scaled = np.multiply(wav, 32767.0, dtype=np.float32)
+    np.clip(scaled, -32767.0, 32767.0, out=scaled)
+    return scaled.astype(np.int16)
+
+
+def to_pcm16(wav: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """float32 (mono/stereo, sr bất kỳ) -> int16 mono @ dst_rate"""
+    return float_to_pcm16(resample(to_float32(wav), src_rate, dst_rate))
+
+
+class PCM16Stream:
+    """
+    Đổi liên tiếp nhiều đoạn audio (vd. các câu TTS của một lượt trả lời) sang PCM int16 @ dst_rate.
+    Mỗi sample rate nguồn có một Resampler stateful, nên các đoạn nối nhau không bị méo ở biên;
+    gọi flush() ở cuối lượt để lấy nốt phần đuôi của bộ lọc.
+    """
+
+    def __init__(self, dst_rate: int):
+        self.dst_rate = dst_rate
+        self._resamplers: Dict[int, Resampler] = {}
+
+    def convert(self, wav: np.ndarray, src_rate: int) -> bytes:
+        wav = to_float32(wav)
+        if src_rate != self.dst_rate:
+            resampler = self._resamplers.get(src_rate)
+            if resampler is None:
+                resampler = self._resamplers[src_rate] = Resampler(src_rate, self.dst_rate)
+            wav = resampler.process(wav)
+        return float_to_pcm16(wav).tobytes()
+
+    def flush(self) -> bytes:
+        tails = [r.flush() for r in self._resamplers.values()]
+        self._resamplers.clear()
+        tails = [t for t in tails if len(t)]
+        return float_to_pcm16(np.concatenate(tails)).tobytes() if tails else b""
@@ -0,0 +1,150 @@
+"""
+Audio Store: kho audio TTS đánh địa chỉ theo nội dung
+Key = hash(text, giọng tham chiếu, NUM_STEP, checkpoint, ...), giá trị là PCM int16
+mono @ AUDIO_STORE_SAMPLE_RATE (đúng định dạng gửi cho ESP32, đọc ra là gửi được ngay).
+
+Bố cục trên đĩa (AUDIO_STORE_DIR):
+    ab/abcdef....pcm   PCM thô
+    ab/abcdef....wav   bản WAV, chỉ tạo khi có người cần file (TTSEngine.synthesize)
+    phrases.json       manifest của phrase bank: các key này không bao giờ bị prune
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import wave
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from settings import tts_settings as cfg
+
+
+class AudioStore:
+    """PCM int16 theo key nội dung; ghi atomic nên nhiều request cùng lúc không ghi đè lẫn nhau"""
+
+    MANIFEST = "phrases.json"
+
+    def __init__(self, root: Path = None, sample_rate: int = None, max_bytes: int = None):
+        self.root = Path(root or cfg.AUDIO_STORE_DIR)
+        self.sample_rate = sample_rate or cfg.AUDIO_STORE_SAMPLE_RATE
+        self.max_bytes = cfg.AUDIO_STORE_MAX_BYTES if max_bytes is None else max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._manifest_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, suffix: str = ".pcm") -> Path:
+        return self.root / key[:2] / f"{key}{suffix}"
+
+    def _atomic_write(self, path: Path, write):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # mtime = lần dùng gần nhất, prune() xoá file lâu không dùng trước
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def put(self, key: str, pcm: Union[bytes, np.ndarray]) -> Path:
+        """Lưu PCM int16 @ self.sample_rate"""
+        data = pcm.astype(np.int16, copy=False).tobytes() if isinstance(pcm, np.ndarray) else bytes(pcm)
+        path = self._path(key)
+        self._atomic_write(path, lambda f: f.write(data))
+        return path
+
+    def wav_path(self, key: str) -> Optional[Path]:
+        """File WAV của key (tạo từ PCM nếu chưa có), None nếu key chưa có trong store"""
+        path = self._path(key, ".wav")
+        if path.exists():
+            return path
+        pcm = self.get(key)
+        if pcm is None:
+            return None
+
+        def write(f):
+            with wave.open(f, "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(self.sample_rate)
+                wf.writeframes(pcm)
+
+        self._atomic_write(path, write)
+        return path
+
+    # ----- Phrase bank -----
+
+    def load_manifest(self) -> Dict[str, dict]:
+        """key -> {"text", "voice"} của các câu trong phrase bank"""
+        path = self.root / self.MANIFEST
+        if not path.exists():
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️  Failed to read phrase manifest: {e}")
+            return {}
+
+    def pin(self, key: str, text: str, voice: str):
+        """Đánh dấu key thuộc phrase bank (không bị prune)"""
+        with self._manifest_lock:
+            manifest = self.load_manifest()
+            manifest[key] = {"text": text, "voice": voice}
+            data = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+            self._atomic_write(self.root / self.MANIFEST, lambda f: f.write(data))
+
+    def prune(self) -> int:
+        """Xoá các file ít dùng nhất (trừ phrase bank) cho tới khi tổng dung lượng <= max_bytes"""
+        if not self.max_bytes:
+            return 0
+        pinned = set(self.load_manifest())
+        files = []
+        total = 0
+        for path in self.root.glob("*/*"):
+            if path.name.startswith(".tmp_"):
+                continue
+            stat = path.stat()
+            total += stat.st_size
+            if path.stem not in pinned:
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        if removed:
+            print(f"  ✓ Audio store pruned {removed} files ({total / 1e6:.1f} MB left)")
+        return removed
+
+    def stats(self) -> dict:
+        return {"audio_store_hits": self.hits, "audio_store_misses": self.misses}
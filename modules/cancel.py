@@ -0,0 +1,94 @@
+"""
+Cancellation cho một lượt hội thoại (barge-in, client ngắt kết nối)
+CancelToken dùng được từ cả event loop lẫn thread của executor: LLM dừng stream
+Gemini, TTS dừng giữa các batch của ZipVoice, pipeline huỷ các đoạn chưa tổng hợp.
+SpeculativeToken: lượt bắt đầu trước khi chắc chắn người dùng đã nói xong (speculative endpoint).
+"""
+import asyncio
+import threading
+from typing import Optional
+
+
+class TurnCancelled(Exception):
+    """Lượt hiện tại đã bị huỷ, kết quả dở dang bị bỏ"""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = ""
+
+    def cancel(self, reason: str = ""):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TurnCancelled(self.reason or "cancelled")
+
+
+def is_cancelled(token) -> bool:
+    """Tiện cho tham số tuỳ chọn: token None nghĩa là không bao giờ bị huỷ"""
+    return token is not None and token.cancelled
+
+
+class SpeculativeToken(CancelToken):
+    """
+    Lượt chạy trước ở một khoảng lặng ngắn: STT, LLM, TTS làm việc ngay nhưng kết quả chỉ được
+    ghi lại (lịch sử, cache) và gửi cho thiết bị sau commit(). Người dùng nói tiếp thì cancel()
+    như barge-in và mọi thứ bị bỏ. Quyết định (commit / cancel) chỉ xảy ra một lần.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._decided = threading.Event()
+        self._committed = False
+        self._waiter: Optional[asyncio.Future] = None
+
+    def commit(self):
+        if not self._decided.is_set() and not self.cancelled:
+            self._committed = True
+            self._decide()
+
+    def cancel(self, reason: str = ""):
+        super().cancel(reason)
+        self._decide()
+
+    def _decide(self):
+        self._decided.set()
+        waiter = self._waiter
+        if waiter is not None:
+            waiter.get_loop().call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(None))
+
+    @property
+    def pending(self) -> bool:
+        """Chưa commit cũng chưa bị huỷ"""
+        return not self._decided.is_set()
+
+    @property
+    def committed(self) -> bool:
+        return self._committed and not self.cancelled
+
+    async def wait_committed(self) -> bool:
+        if not self._decided.is_set():
+            if self._waiter is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+            if not self._decided.is_set():
+                # shield: một chỗ chờ bị huỷ không làm hỏng future dùng chung
+                await asyncio.shield(self._waiter)
+        return self.committed
+
+
+async def committed(token) -> bool:
+    """
+    Trước khi ghi kết quả của lượt (lịch sử hội thoại, cache): lượt speculative chờ tới khi được
+    quyết định, trả về False nếu bị bỏ. Lượt thường luôn True.
+    """
+    if isinstance(token, SpeculativeToken):
+        return await token.wait_committed()
+    return True
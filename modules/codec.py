@@ -0,0 +1,197 @@
+"""
+Audio codec cho websocket /ws: client chọn codec lúc kết nối (query param ?codec=...),
+mặc định vẫn là PCM 16-bit thô. Mỗi kết nối có một instance codec riêng (giữ state).
+
+  - pcm:    không mã hoá, payload đi thẳng (zero-copy)
+  - adpcm:  IMA-ADPCM 4 bit/sample (64 kbit/s @16kHz), rẻ trên ESP32.
+            Mỗi message websocket là một block độc lập:
+              [int16 LE predictor][uint8 step index][uint8 0] + nibble (nibble thấp trước)
+            header là state của encoder TRƯỚC sample đầu tiên -> mất một message không làm
+            lệch các message sau.
+  - opus:   mỗi message là một packet Opus (OPUS_FRAME_MS); cần `pip install opuslib` + libopus
+"""
+from typing import List, Optional
+
+import numpy as np
+
+from settings import server_settings as cfg
+
+IMA_INDEX_TABLE = [-1, -1, -1, -1, 2, 4, 6, 8] * 2
+IMA_STEP_TABLE = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+]
+ADPCM_HEADER_BYTES = 4
+
+
+def _build_tables():
+    """DIFF[index][code]: độ thay đổi predictor (có dấu); NEXT[index][code]: step index kế tiếp"""
+    diff = np.zeros((len(IMA_STEP_TABLE), 16), dtype=np.int32)
+    next_index = [[0] * 16 for _ in IMA_STEP_TABLE]
+    for index, step in enumerate(IMA_STEP_TABLE):
+        for code in range(16):
+            vpdiff = step >> 3
+            if code & 4:
+                vpdiff += step
+            if code & 2:
+                vpdiff += step >> 1
+            if code & 1:
+                vpdiff += step >> 2
+            diff[index, code] = -vpdiff if code & 8 else vpdiff
+            next_index[index][code] = min(max(index + IMA_INDEX_TABLE[code], 0), 88)
+    return diff, next_index
+
+
+ADPCM_DIFF, ADPCM_NEXT_INDEX = _build_tables()
+_DIFF_LISTS = ADPCM_DIFF.tolist()
+
+
+class PCMCodec:
+    """PCM 16-bit thô (mặc định, tương thích firmware cũ)"""
+    name = "pcm"
+    frame_samples: Optional[int] = None  # None: gửi theo chunk bất kỳ
+
+    def encode(self, pcm):
+        return pcm
+
+    def decode(self, payload):
+        return payload
+
+
+class AdpcmCodec:
+    """IMA-ADPCM; encoder giữ predictor/step index giữa các block của một kết nối"""
+    name = "adpcm"
+    frame_samples: Optional[int] = None
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    def encode(self, pcm) -> bytes:
+        """PCM int16 (bytes/ndarray) -> một block ADPCM; số sample lẻ thì đệm thêm một sample 0"""
+        samples = np.frombuffer(pcm, dtype=np.int16) if not isinstance(pcm, np.ndarray) else pcm
+        values = samples.tolist()
+        if len(values) % 2:
+            values.append(0)
+
+        header = bytes([self.predictor & 0xFF, (self.predictor >> 8) & 0xFF, self.index, 0])
+        predictor, index = self.predictor, self.index
+        codes = bytearray(len(values))
+        steps, next_index, diffs = IMA_STEP_TABLE, ADPCM_NEXT_INDEX, _DIFF_LISTS
+        # Mã hoá vốn tuần tự (mỗi code phụ thuộc predictor đã tái tạo): vòng lặp int thuần
+        for i, sample in enumerate(values):
+            delta = sample - predictor
+            code = 0
+            if delta < 0:
+                code = 8
+                delta = -delta
+            step = steps[index]
+            if delta >= step:
+                code |= 4
+                delta -= step
+            step >>= 1
+            if delta >= step:
+                code |= 2
+                delta -= step
+            if delta >= step >> 1:
+                code |= 1
+            predictor += diffs[index][code]
+            if predictor > 32767:
+                predictor = 32767
+            elif predictor < -32768:
+                predictor = -32768
+            index = next_index[index][code]
+            codes[i] = code
+
+        self.predictor, self.index = predictor, index
+        packed = np.frombuffer(codes, dtype=np.uint8)
+        return header + (packed[0::2] | (packed[1::2] << 4)).tobytes()
+
+    def decode(self, payload) -> memoryview:
+        """Một block ADPCM -> PCM int16 (memoryview trên mảng mới, không copy thêm)"""
+        if len(payload) < ADPCM_HEADER_BYTES:
+            return memoryview(b"")
+        data = np.frombuffer(payload, dtype=np.uint8)
+        predictor = int(data[:2].view("<i2")[0])
+        index = min(int(data[2]), 88)
+        nibbles = data[ADPCM_HEADER_BYTES:]
+        codes = np.empty(len(nibbles) * 2, dtype=np.uint8)
+        codes[0::2] = nibbles & 0x0F
+        codes[1::2] = nibbles >> 4
+
+        # Step index chỉ phụ thuộc chuỗi code: quét nhanh trên int nhỏ
+        indices = np.empty(len(codes), dtype=np.intp)
+        next_index = ADPCM_NEXT_INDEX
+        for i, code in enumerate(codes.tolist()):
+            indices[i] = index
+            index = next_index[index][code]
+
+        # Predictor = tổng tích luỹ của các bước (vector hoá); chỉ khi bị chặn ở biên int16
+        # mới phải tính lại tuần tự
+        deltas = ADPCM_DIFF[indices, codes]
+        out = predictor + np.cumsum(deltas, dtype=np.int64)
+        if len(out) and (out.min() < -32768 or out.max() > 32767):
+            for i, delta in enumerate(deltas.tolist()):
+                predictor = min(max(predictor + delta, -32768), 32767)
+                out[i] = predictor
+        return memoryview(out.astype(np.int16)).cast("B")
+
+
+class OpusCodec:
+    """Opus (libopus qua opuslib); mỗi message là đúng một packet OPUS_FRAME_MS"""
+    name = "opus"
+
+    def __init__(self):
+        import opuslib
+        self.frame_samples = cfg.SAMPLE_RATE * cfg.OPUS_FRAME_MS // 1000
+        self._encoder = opuslib.Encoder(cfg.SAMPLE_RATE, cfg.CHANNELS, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = cfg.OPUS_BITRATE
+        self._decoder = opuslib.Decoder(cfg.SAMPLE_RATE, cfg.CHANNELS)
+        # Packet dài nhất Opus cho phép là 120ms
+        self._max_decode_samples = cfg.SAMPLE_RATE * 120 // 1000
+
+    def encode(self, pcm) -> bytes:
+        """Một frame PCM (frame cuối ngắn hơn thì đệm 0)"""
+        frame_bytes = self.frame_samples * cfg.BIT_DEPTH_BYTES
+        pcm = bytes(pcm)
+        if len(pcm) < frame_bytes:
+            pcm += b"\0" * (frame_bytes - len(pcm))
+        return self._encoder.encode(pcm, self.frame_samples)
+
+    def decode(self, payload) -> bytes:
+        return self._decoder.decode(bytes(payload), self._max_decode_samples)
+
+
+CODECS = {"pcm": PCMCodec, "adpcm": AdpcmCodec, "opus": OpusCodec}
+
+
+def available_codecs() -> List[str]:
+    """Codec bật trong settings và dùng được trên máy này (opus cần opuslib)"""
+    names = []
+    for name in cfg.AUDIO_CODECS:
+        if name == "opus":
+            try:
+                import opuslib  # noqa: F401
+            except Exception:
+                continue
+        if name in CODECS:
+            names.append(name)
+    return names
+
+
+def negotiate(offer: Optional[str]):
+    """
+    Chọn codec cho một kết nối từ danh sách client đề nghị ("opus,adpcm", theo thứ tự ưu tiên).
+    Không đề nghị hoặc không có codec nào dùng được -> PCM.
+    """
+    supported = available_codecs()
+    for name in (offer or "").lower().split(","):
+        name = name.strip()
+        if name in supported:
+            return CODECS[name]()
+    return PCMCodec()
@@ -0,0 +1,154 @@
+"""
+Downlink: gửi audio PCM về ESP32 theo deadline đồng hồ thực thay vì sleep cố định
+  - Mốc thời gian của lượt trả lời: byte thứ n được phát lúc t0 + n / byte_rate,
+    byte đó được gửi trước DOWNLINK_LEAD_MS -> sleep trễ không cộng dồn thành drift
+  - Đầu stream (và sau mỗi lần thiết bị phát cạn buffer) gửi liền DOWNLINK_PRIME_MS để mồi buffer
+  - Client gửi "ACK <n>" (n = tổng số byte đã đưa vào I2S trong lượt) thì mốc thời gian
+    được chỉnh theo ACK; không có ACK thì chỉ dựa vào đồng hồ
+  - Mỗi chunk được mã hoá bằng codec của kết nối (modules/codec.py) ngay trước khi gửi;
+    mốc thời gian và ACK luôn tính theo byte PCM
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from settings import server_settings as cfg
+from . import metrics
+from .codec import PCMCodec
+
+logger = logging.getLogger(__name__)
+
+
+class DownlinkStats:
+    """Số liệu cộng dồn của mọi kết nối: underrun ước lượng, độ lệch thời điểm gửi"""
+
+    def __init__(self):
+        self.streams = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.underruns = 0
+        self.acks = 0
+        self.paced_chunks = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+
+    def record_jitter(self, jitter: float):
+        self.paced_chunks += 1
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    def stats(self) -> dict:
+        mean = self.jitter_sum / self.paced_chunks if self.paced_chunks else 0.0
+        return {
+            "downlink_streams": self.streams,
+            "downlink_chunks": self.chunks,
+            "downlink_bytes": self.bytes,
+            "downlink_underruns": self.underruns,
+            "downlink_acks": self.acks,
+            "downlink_jitter_mean_ms": round(mean * 1000, 2),
+            "downlink_jitter_max_ms": round(self.jitter_max * 1000, 2),
+        }
+
+
+class PacedSender:
+    """
+    Bộ gửi audio của một kết nối. Gọi begin() đầu mỗi lượt trả lời, send() cho từng đoạn
+    (các đoạn nối tiếp nhau trên cùng một mốc thời gian), drain() để chờ thiết bị phát xong.
+    """
+
+    def __init__(
+        self,
+        send_bytes: Callable[[bytes], Awaitable],
+        totals: Optional[DownlinkStats] = None,
+        sample_rate: int = None,
+        chunk_samples: int = None,
+        lead_ms: float = None,
+        prime_ms: float = None,
+        codec=None
+    ):
+        self._send_bytes = send_bytes
+        self.codec = codec or PCMCodec()
+        self.totals = totals or DownlinkStats()
+        sample_rate = sample_rate or cfg.SAMPLE_RATE
+        self.byte_rate = float(sample_rate * cfg.BIT_DEPTH_BYTES)
+        # Codec theo frame (Opus) quyết định kích thước chunk
+        chunk_samples = self.codec.frame_samples or chunk_samples or cfg.DOWNLINK_CHUNK_SAMPLES
+        self.chunk_bytes = chunk_samples * cfg.BIT_DEPTH_BYTES
+        self.lead = (cfg.DOWNLINK_LEAD_MS if lead_ms is None else lead_ms) / 1000.0
+        self.prime_bytes = int((cfg.DOWNLINK_PRIME_MS if prime_ms is None else prime_ms) / 1000.0 * self.byte_rate)
+        self.begin()
+
+    def begin(self):
+        """Bắt đầu lượt trả lời mới: thiết bị chưa có gì trong buffer"""
+        self.sent = 0
+        self.acked = 0
+        self._t0: Optional[float] = None   # Thời điểm (monotonic) thiết bị phát byte 0
+        self._prime_until = 0
+
+    def _play_end(self) -> float:
+        """Thời điểm thiết bị phát xong mọi byte đã gửi (theo mốc hiện tại)"""
+        return self._t0 + self.sent / self.byte_rate
+
+    def on_ack(self, played_bytes: int):
+        """Thiết bị báo đã đưa played_bytes vào I2S: đặt lại mốc thời gian theo vị trí thực"""
+        played_bytes = min(max(played_bytes, self.acked), self.sent)
+        self.acked = played_bytes
+        self.totals.acks += 1
+        if self._t0 is not None:
+            self._t0 = time.monotonic() - played_bytes / self.byte_rate
+
+    def handle_message(self, text: str) -> bool:
+        """Xử lý tin nhắn điều khiển của client; trả về True nếu là ACK"""
+        parts = text.split()
+        if len(parts) != 2 or parts[0] != "ACK":
+            return False
+        try:
+            self.on_ack(int(parts[1]))
+        except ValueError:
+            return False
+        return True
+
+    async def send(self, pcm_bytes: bytes) -> bool:
+        """Gửi một đoạn PCM theo deadline. Trả về False nếu client đã ngắt kết nối."""
+        if self.sent == 0 and pcm_bytes:
+            self.totals.streams += 1
+        for i in range(0, len(pcm_bytes), self.chunk_bytes):
+            chunk = pcm_bytes[i:i + self.chunk_bytes]
+            now = time.monotonic()
+            if self._t0 is None or now > self._play_end():
+                # Lần đầu, hoặc thiết bị đã phát cạn (TTS chậm hơn real-time, event loop quá tải):
+                # mốc mới bắt đầu từ bây giờ và mồi lại buffer
+                if self._t0 is not None:
+                    self.totals.underruns += 1
+                self._t0 = now - self.sent / self.byte_rate
+                self._prime_until = self.sent + self.prime_bytes
+
+            if self.sent >= self._prime_until:
+                deadline = self._t0 + self.sent / self.byte_rate - self.lead
+                if deadline > now:
+                    await asyncio.sleep(deadline - now)
+                    # Jitter = thức dậy trễ hơn deadline bao lâu (event loop bận)
+                    self.totals.record_jitter(max(0.0, time.monotonic() - deadline))
+
+            payload = self.codec.encode(chunk)
+            try:
+                await self._send_bytes(payload)
+            except Exception:
+                # Client đã đóng kết nối (ví dụ: reset hoặc reconnect)
+                logger.info("Client disconnected during streaming; aborting send loop.")
+                return False
+            if self.sent == 0:
+                metrics.mark("first_byte_sent")
+            self.sent += len(chunk)
+            self.totals.chunks += 1
+            self.totals.bytes += len(payload)
+        return True
+
+    async def drain(self):
+        """Chờ tới khi thiết bị (ước lượng) phát xong phần đã gửi"""
+        if self._t0 is None:
+            return
+        remaining = self._play_end() - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
@@ -0,0 +1,105 @@
+"""
+Fake Gemini client cho chạy offline (test, benchmark, demo không cần API key)
+Giả lập google.genai.Client: client.models.* và client.aio.models.*,
+trả lời theo từng chunk với độ trễ cấu hình được.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Callable, List, Optional, Union
+
+from settings import llm_settings as cfg
+
+DEFAULT_REPLY = (
+    "Chào cậu! Tớ là bạn học của cậu đây. "
+    "Hôm nay mình cùng học phép cộng nhé, cậu có thích không? "
+    "Một cộng một bằng hai đó!"
+)
+
+
+class _FakeModels:
+    def __init__(self, client: "FakeGeminiClient"):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        chunks = self._client._chunks(contents)
+        time.sleep(self._client.first_chunk_delay + self._client.chunk_delay * (len(chunks) - 1))
+        return SimpleNamespace(text="".join(chunks))
+
+    def generate_content_stream(self, model, contents, config=None):
+        for i, chunk in enumerate(self._client._chunks(contents)):
+            time.sleep(self._client.first_chunk_delay if i == 0 else self._client.chunk_delay)
+            yield SimpleNamespace(text=chunk)
+
+
+class _FakeAsyncModels:
+    def __init__(self, client: "FakeGeminiClient"):
+        self._client = client
+
+    async def generate_content(self, model, contents, config=None):
+        chunks = self._client._chunks(contents)
+        await asyncio.sleep(self._client.first_chunk_delay + self._client.chunk_delay * (len(chunks) - 1))
+        return SimpleNamespace(text="".join(chunks))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        chunks = self._client._chunks(contents)
+
+        async def stream():
+            for i, chunk in enumerate(chunks):
+                await asyncio.sleep(self._client.first_chunk_delay if i == 0 else self._client.chunk_delay)
+                yield SimpleNamespace(text=chunk)
+
+        return stream()
+
+
+class FakeGeminiClient:
+    """
+    Client giả lập Gemini.
+
+    Args:
+        reply: câu trả lời cố định, hoặc hàm (user_text) -> str
+        chunk_chars: số ký tự mỗi chunk khi streaming
+        first_chunk_delay: độ trễ trước chunk đầu tiên (giây), mô phỏng time-to-first-token
+        chunk_delay: độ trễ giữa các chunk tiếp theo (giây)
+        fail_after: nếu đặt, raise RuntimeError sau số chunk này (test xử lý lỗi giữa stream)
+    """
+
+    def __init__(
+        self,
+        reply: Union[str, Callable[[str], str]] = DEFAULT_REPLY,
+        chunk_chars: int = None,
+        first_chunk_delay: float = None,
+        chunk_delay: float = None,
+        fail_after: Optional[int] = None
+    ):
+        self.reply = reply
+        self.chunk_chars = chunk_chars or cfg.FAKE_LLM_CHUNK_CHARS
+        self.first_chunk_delay = cfg.FAKE_LLM_FIRST_CHUNK_DELAY if first_chunk_delay is None else first_chunk_delay
+        self.chunk_delay = cfg.FAKE_LLM_CHUNK_DELAY if chunk_delay is None else chunk_delay
+        self.fail_after = fail_after
+        self.calls: List[list] = []
+        self.models = _FakeModels(self)
+        self.aio = SimpleNamespace(models=_FakeAsyncModels(self))
+
+    def _chunks(self, contents) -> List[str]:
+        self.calls.append(contents)
+        user_text = contents[-1]["parts"][0]["text"] if contents else ""
+        reply = self.reply(user_text) if callable(self.reply) else self.reply
+        chunks = [reply[i:i + self.chunk_chars] for i in range(0, len(reply), self.chunk_chars)]
+        if self.fail_after is not None:
+            return _FailingList(chunks, self.fail_after)
+        return chunks
+
+
+class _FailingList(list):
+    """List chunk raise lỗi khi duyệt tới phần tử thứ `fail_after`"""
+
+    def __init__(self, items, fail_after: int):
+        super().__init__(items)
+        self.fail_after = fail_after
+
+    def __iter__(self):
+        for i, item in enumerate(list.__iter__(self)):
+            if i >= self.fail_after:
+                raise RuntimeError("Fake LLM stream failure")
+            yield item
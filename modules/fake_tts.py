@@ -0,0 +1,56 @@
+"""
+Fake TTS backend cho chạy offline (benchmark, test không cần ZipVoice/torch)
+Cùng interface với ResidentBackend: sinh một tiếng "bíp" dài tỉ lệ với số ký tự,
+sau một độ trễ cấu hình được (FAKE_TTS_* trong settings/tts_settings.py).
+"""
+import time
+
+import numpy as np
+
+from settings import tts_settings as cfg
+
+
+class FakeBackend:
+    """
+    Backend TTS giả lập.
+
+    Args:
+        sampling_rate: sample rate của audio sinh ra (mặc định như ZipVoice, 24kHz)
+        first_delay: độ trễ cố định mỗi lần tổng hợp (giây)
+        rtf: real-time factor, thời gian tổng hợp = first_delay + rtf * độ dài audio
+        seconds_per_char: độ dài audio cho mỗi ký tự của text
+    """
+
+    def __init__(
+        self,
+        sampling_rate: int = None,
+        first_delay: float = None,
+        rtf: float = None,
+        seconds_per_char: float = None
+    ):
+        self.sampling_rate = sampling_rate or cfg.FAKE_TTS_SAMPLE_RATE
+        self.first_delay = cfg.FAKE_TTS_FIRST_DELAY if first_delay is None else first_delay
+        self.rtf = cfg.FAKE_TTS_RTF if rtf is None else rtf
+        self.seconds_per_char = seconds_per_char or cfg.FAKE_TTS_SECONDS_PER_CHAR
+        self.calls = 0
+
+    def generate(self, text, ref_audio, prompt_text, cancel=None):
+        """Waveform float32 @ self.sampling_rate; ngủ theo độ trễ mô phỏng, dừng sớm nếu `cancel`"""
+        self.calls += 1
+        duration = max(len(text.strip()), 1) * self.seconds_per_char
+        deadline = time.monotonic() + self.first_delay + self.rtf * duration
+        while True:
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.02))
+        t = np.arange(int(duration * self.sampling_rate), dtype=np.float32) / self.sampling_rate
+        return (0.1 * np.sin(2 * np.pi * 220.0 * t)).astype(np.float32)
+
+    def synthesize(self, text, output_path, ref_audio, prompt_text):
+        import soundfile as sf
+        wav = self.generate(text, ref_audio, prompt_text)
+        sf.write(str(output_path), wav, self.sampling_rate, subtype="PCM_16")
+        return output_path
@@ -0,0 +1,473 @@
+"""
+Chat history của mọi session: giới hạn bộ nhớ, ghi đĩa ở thread nền, khởi động nhanh
+
+  - RAM: MAX_HISTORY_TURNS lượt gần nhất của mỗi session, LRU theo session, tổng dung lượng
+    <= HISTORY_MEMORY_BYTES; session bị đẩy ra vẫn còn trên đĩa, được nạp lại khi cần
+  - Write-behind: add() chỉ cập nhật RAM và xếp message vào hàng đợi; thread nền gom
+    message trong HISTORY_FLUSH_INTERVAL_MS rồi ghi một lần (không chặn event loop)
+  - Log chia segment: history-000001.jsonl, ... mỗi segment tối đa HISTORY_SEGMENT_BYTES.
+    Giữ HISTORY_MAX_SEGMENTS segment; lượt gần nhất của session còn nằm ở segment sắp xoá
+    được chép sang segment mới trước
+  - index.json: vị trí (segment, offset, length) các message gần nhất của mỗi session và vị trí
+    log đã được index. Khởi động chỉ đọc index + phần log ghi sau lần lưu index cuối
+  - history.jsonl kiểu cũ (các record nối bằng chuỗi "\\n" thay vì xuống dòng) được nhập một lần
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Tuple
+
+from settings import llm_settings as cfg
+
+INDEX_VERSION = 1
+LEGACY_FILE = "history.jsonl"
+MESSAGE_OVERHEAD = 96  # Ước lượng bytes của dict + timestamp mỗi message trong RAM
+
+Entry = Tuple[int, int, int]  # (segment, offset, length) của một dòng trong log
+
+
+def parse_legacy(text: str) -> Iterator[dict]:
+    """Đọc history.jsonl cũ: record JSON nối nhau bằng xuống dòng hoặc chuỗi hai ký tự "\\n" """
+    decoder = json.JSONDecoder()
+    pos, end = 0, len(text)
+    while pos < end:
+        while pos < end and (text[pos].isspace() or text.startswith("\\n", pos)):
+            pos += 1 if text[pos].isspace() else 2
+        if pos >= end:
+            break
+        try:
+            record, pos = decoder.raw_decode(text, pos)
+        except ValueError:
+            # Record hỏng: nhảy tới record kế tiếp
+            pos = text.find('{"session_id"', pos + 1)
+            if pos < 0:
+                break
+            continue
+        if isinstance(record, dict):
+            yield record
+
+
+class ChatHistory:
+    """Quản lý lịch sử hội thoại"""
+
+    def __init__(self, history_dir: str = None):
+        self.history_dir = Path(history_dir or cfg.HISTORY_DIR)
+        self.history_dir.mkdir(parents=True, exist_ok=True)
+        self.limit = cfg.MAX_HISTORY_TURNS * 2
+        self.memory_budget = cfg.HISTORY_MEMORY_BYTES
+        self.max_sessions = cfg.HISTORY_MAX_SESSIONS
+        self.segment_bytes = cfg.HISTORY_SEGMENT_BYTES
+        self.max_segments = cfg.HISTORY_MAX_SEGMENTS
+        self.flush_sec = cfg.HISTORY_FLUSH_INTERVAL_MS / 1000.0
+
+        # RAM: session -> messages (cuối OrderedDict là session dùng gần nhất)
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._pending: Dict[str, int] = {}  # Số message chưa ghi xuống đĩa của mỗi session
+        self._bytes = 0
+        self.evictions = 0
+        self.disk_loads = 0
+
+        # Đĩa: chỉ thread ghi sửa log/index (index được đọc dưới _index_lock)
+        self._index_lock = threading.Lock()
+        self._index: Dict[str, Deque[Entry]] = {}
+        self._segment = 1
+        self._file = None
+        self._size = 0
+        self._index_dirty = False
+        self._index_saved = time.monotonic()
+        self._legacy_imported = False
+        self.written = 0
+        self.batches = 0
+
+        self._load()
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ----- API -----
+
+    def add(self, session_id: str, role: str, text: str):
+        """Thêm message vào history (ghi đĩa ở thread nền)"""
+        record = {"role": role, "content": text, "timestamp": time.time()}
+        self._resident(session_id)
+        with self._lock:
+            messages = self._memory.get(session_id)
+            if messages is None:
+                messages = self._memory[session_id] = []
+                self._sizes[session_id] = 0
+            messages.append(record)
+            if len(messages) > self.limit:
+                messages = self._memory[session_id] = messages[-self.limit:]
+            self._memory.move_to_end(session_id)
+            self._resize(session_id, messages)
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+            self._evict()
+        self._queue.put(("add", session_id, record))
+
+    def get_history(self, session_id: str) -> List[Dict]:
+        """Lấy lịch sử hội thoại"""
+        return self._resident(session_id)
+
+    def clear(self, session_id: str):
+        """Xóa lịch sử một session (cả trên đĩa)"""
+        with self._lock:
+            # Giữ list rỗng trong RAM tới khi tombstone được ghi, để không nạp lại bản cũ từ đĩa
+            self._memory[session_id] = []
+            self._resize(session_id, [])
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._queue.put(("clear", session_id, {"event": "clear", "timestamp": time.time()}))
+
+    def release(self, session_id: str):
+        """Thả messages của session khỏi RAM (vẫn còn trên đĩa, lần sau nạp lại qua index)"""
+        with self._lock:
+            if session_id in self._memory and not self._pending.get(session_id):
+                del self._memory[session_id]
+                self._bytes -= self._sizes.pop(session_id, 0)
+
+    def flush(self, timeout: float = None):
+        """Chờ thread nền ghi hết các message đang chờ"""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(("flush", None, done))
+        done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._save_index()
+
+    def stats(self) -> dict:
+        return {
+            "history_sessions": len(self._memory),
+            "history_bytes": self._bytes,
+            "history_evictions": self.evictions,
+            "history_disk_loads": self.disk_loads,
+            "history_written": self.written,
+            "history_write_batches": self.batches,
+        }
+
+    # ----- RAM -----
+
+    def _resident(self, session_id: str) -> List[Dict]:
+        """Messages của session trong RAM, nạp từ đĩa (qua index) nếu đã bị đẩy ra"""
+        with self._lock:
+            messages = self._memory.get(session_id)
+            if messages is not None:
+                self._memory.move_to_end(session_id)
+                return messages
+        loaded = self._read_session(session_id)
+        if not loaded:
+            return []
+        with self._lock:
+            messages = self._memory.get(session_id)
+            if messages is None:
+                messages = self._memory[session_id] = loaded
+                self._resize(session_id, messages)
+                self.disk_loads += 1
+                self._evict()
+            return messages
+
+    def _resize(self, session_id: str, messages: List[Dict]):
+        size = sum(len(m["content"].encode("utf-8")) + MESSAGE_OVERHEAD for m in messages)
+        self._bytes += size - self._sizes.get(session_id, 0)
+        self._sizes[session_id] = size
+
+    def _evict(self):
+        """Đẩy session ít dùng nhất ra khỏi RAM; session còn message chưa ghi thì giữ lại"""
+        if not self._memory or (self._bytes <= self.memory_budget and len(self._memory) <= self.max_sessions):
+            return
+        newest = next(reversed(self._memory))
+        for session_id in list(self._memory):
+            if self._bytes <= self.memory_budget and len(self._memory) <= self.max_sessions:
+                break
+            if session_id == newest or self._pending.get(session_id):
+                continue
+            del self._memory[session_id]
+            self._bytes -= self._sizes.pop(session_id, 0)
+            self.evictions += 1
+
+    # ----- Đĩa: đọc -----
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.history_dir / f"history-{segment:06d}.jsonl"
+
+    def _read_entries(self, entries) -> List[Dict]:
+        """Đọc các dòng log theo vị trí trong index (gọi khi đang giữ _index_lock)"""
+        messages = []
+        handles = {}
+        try:
+            for segment, offset, length in entries:
+                f = handles.get(segment)
+                if f is None:
+                    f = handles[segment] = open(self._segment_path(segment), "rb")
+                f.seek(offset)
+                record = json.loads(f.read(length))
+                messages.append({k: record[k] for k in ("role", "content", "timestamp")})
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  Failed to read history: {e}")
+        finally:
+            for f in handles.values():
+                f.close()
+        return messages
+
+    def _read_session(self, session_id: str) -> List[Dict]:
+        with self._index_lock:
+            entries = self._index.get(session_id)
+            return self._read_entries(list(entries)) if entries else []
+
+    # ----- Đĩa: ghi (thread nền) -----
+
+    def _collect(self) -> List:
+        """Chờ message đầu tiên, gom thêm trong HISTORY_FLUSH_INTERVAL_MS"""
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_sec
+        while len(batch) < cfg.HISTORY_FLUSH_BATCH and first[0] != "flush":
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+            if item[0] == "flush":
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                break
+            records = [(kind, session_id, payload) for kind, session_id, payload in batch if kind != "flush"]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                print(f"⚠️  Failed to save history: {e}")
+            finally:
+                with self._lock:
+                    for _, session_id, _ in records:
+                        left = self._pending.get(session_id, 0) - 1
+                        if left > 0:
+                            self._pending[session_id] = left
+                        else:
+                            self._pending.pop(session_id, None)
+                    # Session vừa ghi xong mới được phép đẩy ra khỏi RAM
+                    self._evict()
+                for kind, _, payload in batch:
+                    if kind == "flush":
+                        payload.set()
+            if self._index_dirty and time.monotonic() - self._index_saved >= cfg.HISTORY_INDEX_INTERVAL:
+                self._save_index()
+
+    def _open_segment(self):
+        path = self._segment_path(self._segment)
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+
+    def _write(self, records):
+        """Ghi một batch vào segment hiện tại bằng một lần write, cập nhật index"""
+        if self._file is None:
+            self._open_segment()
+        lines = []
+        offset = self._size
+        with self._index_lock:
+            for kind, session_id, payload in records:
+                line = (json.dumps({"session_id": session_id, **payload}, ensure_ascii=False) + "\n").encode("utf-8")
+                if kind == "clear":
+                    self._index.pop(session_id, None)
+                else:
+                    self._session_entries(session_id).append((self._segment, offset, len(line)))
+                lines.append(line)
+                offset += len(line)
+            self._file.write(b"".join(lines))
+            self._file.flush()
+        self._size = offset
+        self._index_dirty = True
+        self.written += len(records)
+        self.batches += 1
+        if self._size >= self.segment_bytes:
+            self._rotate()
+
+    def _session_entries(self, session_id: str) -> Deque[Entry]:
+        entries = self._index.get(session_id)
+        if entries is None:
+            entries = self._index[session_id] = deque(maxlen=self.limit)
+        return entries
+
+    def _rotate(self):
+        """Sang segment mới; xoá segment cũ quá HISTORY_MAX_SEGMENTS sau khi chép lượt còn dùng"""
+        self._file.close()
+        self._segment += 1
+        self._open_segment()
+        if self.max_segments:
+            oldest_kept = self._segment - self.max_segments + 1
+            with self._index_lock:
+                carried = [(sid, entries) for sid, entries in self._index.items()
+                           if entries and entries[0][0] < oldest_kept]
+                lines = []
+                offset = self._size
+                for session_id, entries in carried:
+                    moved = deque(maxlen=self.limit)
+                    for message in self._read_entries(list(entries)):
+                        line = (json.dumps({"session_id": session_id, **message}, ensure_ascii=False) + "\n").encode("utf-8")
+                        moved.append((self._segment, offset, len(line)))
+                        lines.append(line)
+                        offset += len(line)
+                    self._index[session_id] = moved
+                if lines:
+                    self._file.write(b"".join(lines))
+                    self._file.flush()
+                self._size = offset
+                for path in self.history_dir.glob("history-*.jsonl"):
+                    if self._segment_number(path) < oldest_kept:
+                        path.unlink(missing_ok=True)
+        self._save_index()
+
+    def _save_index(self):
+        with self._index_lock:
+            data = {
+                "version": INDEX_VERSION,
+                "segment": self._segment,
+                "position": self._size,
+                "legacy_imported": self._legacy_imported,
+                "sessions": {sid: [list(e) for e in entries] for sid, entries in self._index.items()},
+            }
+        path = self.history_dir / "index.json"
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"⚠️  Failed to save history index: {e}")
+            return
+        self._index_dirty = False
+        self._index_saved = time.monotonic()
+
+    # ----- Khởi động -----
+
+    @staticmethod
+    def _segment_number(path: Path) -> int:
+        try:
+            return int(path.stem.split("-")[1])
+        except (IndexError, ValueError):
+            return -1
+
+    def _load(self):
+        """Nạp index, replay phần log ghi sau lần lưu index cuối, nhập history.jsonl cũ nếu có"""
+        segment, position = 1, 0
+        index_path = self.history_dir / "index.json"
+        if index_path.exists():
+            try:
+                data = json.loads(index_path.read_text(encoding="utf-8"))
+                if data.get("version") == INDEX_VERSION:
+                    segment, position = data["segment"], data["position"]
+                    self._legacy_imported = data.get("legacy_imported", False)
+                    for sid, entries in data["sessions"].items():
+                        self._index[sid] = deque((tuple(e) for e in entries), maxlen=self.limit)
+            except Exception as e:
+                print(f"⚠️  Failed to read history index, rebuilding: {e}")
+                self._index.clear()
+                segment, position = 1, 0
+
+        segments = sorted(n for n in map(self._segment_number, self.history_dir.glob("history-*.jsonl")) if n > 0)
+        if segments and segment < segments[0]:
+            segment, position = segments[0], 0
+        self._segment = max(segments + [segment])
+        replayed = 0
+        for n in [s for s in segments if s >= segment]:
+            replayed += self._replay(n, position if n == segment else 0)
+
+        legacy = self.history_dir / LEGACY_FILE
+        if not self._legacy_imported and legacy.exists():
+            self._import_legacy(legacy)
+        if replayed or not index_path.exists():
+            self._save_index()
+        self._warm()
+        if self._index:
+            print(f"  ✓ Chat history: {len(self._index)} sessions (replayed {replayed} records)")
+
+    def _replay(self, segment: int, position: int) -> int:
+        """Đưa các dòng log từ `position` của segment vào index; bỏ dòng cuối ghi dở"""
+        path = self._segment_path(segment)
+        with open(path, "rb") as f:
+            f.seek(position)
+            data = f.read()
+        count = 0
+        offset = position
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                # Dòng cuối bị cắt ngang (process bị kill giữa lúc ghi)
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+                break
+            try:
+                record = json.loads(line)
+                session_id = record["session_id"]
+            except (ValueError, KeyError):
+                offset += len(line)
+                continue
+            if record.get("event") == "clear":
+                self._index.pop(session_id, None)
+            else:
+                self._session_entries(session_id).append((segment, offset, len(line)))
+            offset += len(line)
+            count += 1
+        if segment == self._segment:
+            self._size = offset
+        return count
+
+    def _import_legacy(self, legacy: Path):
+        """Chép MAX_HISTORY_TURNS lượt cuối của mỗi session từ history.jsonl cũ sang segment"""
+        try:
+            text = legacy.read_text(encoding="utf-8")
+        except Exception as e:
+            print(f"⚠️  Failed to read legacy history {legacy.name}: {e}")
+            return
+        sessions: Dict[str, Deque[dict]] = {}
+        for record in parse_legacy(text):
+            session_id = record.get("session_id")
+            if session_id is None or "content" not in record:
+                continue
+            sessions.setdefault(session_id, deque(maxlen=self.limit)).append({
+                "role": record.get("role", "user"),
+                "content": record["content"],
+                "timestamp": record.get("timestamp", 0.0),
+            })
+        records = [("add", sid, message) for sid, messages in sessions.items() for message in messages]
+        if records:
+            self._write(records)
+            self._file.close()
+            self._file = None
+        self._legacy_imported = True
+        self._save_index()
+        print(f"  ✓ Imported legacy chat history: {len(sessions)} sessions, {len(records)} messages")
+
+    def _warm(self):
+        """Nạp sẵn HISTORY_WARM_SESSIONS session có message mới nhất"""
+        if not cfg.HISTORY_WARM_SESSIONS:
+            return
+        latest = sorted(self._index.items(), key=lambda kv: kv[1][-1][:2] if kv[1] else (0, 0))
+        for session_id, _ in latest[-cfg.HISTORY_WARM_SESSIONS:]:
+            self._resident(session_id)
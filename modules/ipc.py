@@ -0,0 +1,245 @@
+"""
+IPC giữa front-end websocket và model server (modules/model_server.py) trên cùng một máy
+  - Điều khiển: multiprocessing.connection qua unix socket MODEL_SERVER_DIR/<stage>.sock,
+    mỗi tin nhắn là một tuple nhỏ (op, args...) được pickle
+  - Audio/tensor: float32 nằm trong shared memory. Mỗi phía của một kết nối có một vùng "outbox"
+    riêng, tin nhắn chỉ mang tên vùng + shape của từng mảng -> audio không đi qua socket
+  - Byte đầu outbox của client là cờ huỷ: server đọc nó như một CancelToken (TTS dừng giữa các batch)
+Một kết nối xử lý tuần tự từng request; client cần gọi song song thì mở nhiều kết nối (ClientPool).
+"""
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from multiprocessing.connection import Client
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from settings import server_settings as cfg
+from .cancel import TurnCancelled, is_cancelled
+
+logger = logging.getLogger(__name__)
+
+HEADER_BYTES = 64        # Đầu mỗi vùng nhớ: byte 0 là cờ huỷ, phần còn lại để dành
+CANCEL_POLL_SEC = 0.02   # Client chờ kết quả theo từng khoảng này để kịp báo huỷ
+
+
+class RemoteError(RuntimeError):
+    """Model server báo lỗi khi xử lý request"""
+
+
+def socket_path(stage: str) -> Path:
+    return Path(cfg.MODEL_SERVER_DIR) / f"{stage}.sock"
+
+
+def _attach(name: str) -> SharedMemory:
+    """Mở vùng nhớ do phía bên kia tạo (phía đó sở hữu và xoá nó)"""
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    # Python < 3.13 luôn đăng ký với resource_tracker. Launcher (modules/model_server.py) chạy mọi
+    # process với cùng một tracker nên không sao; process chạy riêng thì tracker có thể xoá vùng nhớ
+    # của phía kia khi process này thoát, nhưng lúc đó kết nối dùng vùng nhớ ấy cũng đã đóng.
+    return SharedMemory(name=name)
+
+
+class SharedBuffer:
+    """Outbox: vùng shared memory do phía gửi sở hữu (tạo, nới rộng, xoá)"""
+
+    def __init__(self, size: int = None):
+        self.shm = SharedMemory(create=True, size=HEADER_BYTES + (size or cfg.SHM_INITIAL_BYTES))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def cancel_flag(self) -> bool:
+        return bool(self.shm.buf[0])
+
+    @cancel_flag.setter
+    def cancel_flag(self, value: bool):
+        self.shm.buf[0] = 1 if value else 0
+
+    def write(self, arrays: Sequence[np.ndarray]) -> List[Tuple]:
+        """Chép các mảng (đổi sang float32) vào vùng nhớ, trả về shape của từng mảng"""
+        arrays = [np.asarray(a, dtype=np.float32) for a in arrays]
+        needed = HEADER_BYTES + sum(a.nbytes for a in arrays)
+        if needed > self.shm.size:
+            # Nới gấp đôi; tên mới đi kèm tin nhắn nên phía đọc tự attach lại
+            old = self.shm
+            self.shm = SharedMemory(create=True, size=max(needed, 2 * old.size))
+            old.close()
+            try:
+                old.unlink()
+            except FileNotFoundError:
+                pass
+        offset = HEADER_BYTES
+        shapes = []
+        for a in arrays:
+            np.ndarray(a.shape, dtype=np.float32, buffer=self.shm.buf, offset=offset)[...] = a
+            offset += a.nbytes
+            shapes.append(a.shape)
+        return shapes
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedView:
+    """Inbox: attach vào outbox của phía bên kia theo tên (attach lại khi bên kia nới vùng nhớ)"""
+
+    def __init__(self):
+        self.shm: Optional[SharedMemory] = None
+
+    def _ensure(self, name: str):
+        if self.shm is None or self.shm.name != name:
+            self.close()
+            self.shm = _attach(name)
+
+    def read(self, name: str, shapes: Sequence[Tuple]) -> List[np.ndarray]:
+        """Chép các mảng float32 ra khỏi vùng nhớ (phía kia ghi đè ở request kế tiếp)"""
+        if not shapes:
+            return []
+        self._ensure(name)
+        offset = HEADER_BYTES
+        arrays = []
+        for shape in shapes:
+            a = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf, offset=offset)
+            offset += a.nbytes
+            arrays.append(a.copy())
+        return arrays
+
+    def cancel_flag(self, name: str) -> bool:
+        self._ensure(name)
+        return bool(self.shm.buf[0])
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+
+class FlagCancel:
+    """Phía server: cờ huỷ trong outbox của client, cùng interface với CancelToken"""
+
+    def __init__(self, inbox: SharedView, name: str):
+        self.inbox = inbox
+        self.name = name
+
+    @property
+    def cancelled(self) -> bool:
+        return self.inbox.cancel_flag(self.name)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TurnCancelled("cancelled by client")
+
+
+class ModelClient:
+    """Một kết nối tới model server của `stage`"""
+
+    def __init__(self, stage: str, timeout: float = None):
+        self.stage = stage
+        address = str(socket_path(stage))
+        deadline = time.monotonic() + (cfg.MODEL_CONNECT_TIMEOUT if timeout is None else timeout)
+        while True:
+            try:
+                self.conn = Client(address, family="AF_UNIX", authkey=cfg.MODEL_SERVER_AUTHKEY)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Model server còn đang nạp model
+                if time.monotonic() > deadline:
+                    raise RemoteError(f"{stage} model server not reachable at {address}")
+                time.sleep(0.2)
+        self.outbox = SharedBuffer()
+        self.inbox = SharedView()
+        self._closed = False
+
+    def call(self, op: str, *args, arrays: Sequence[np.ndarray] = (), cancel=None):
+        """Gửi request, chờ kết quả: (result, list mảng float32)"""
+        shapes = self.outbox.write(arrays) if arrays else []
+        self.outbox.cancel_flag = False
+        self.conn.send((op, args, self.outbox.name, shapes))
+        while not self.conn.poll(CANCEL_POLL_SEC if cancel is not None else None):
+            if is_cancelled(cancel) and not self.outbox.cancel_flag:
+                self.outbox.cancel_flag = True
+        reply = self.conn.recv()
+        status = reply[0]
+        if status == "cancelled":
+            raise TurnCancelled(reply[1])
+        if status == "error":
+            raise RemoteError(f"{self.stage} server: {reply[1]}")
+        _, result, name, shapes = reply
+        return result, self.inbox.read(name, shapes)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.conn.close()
+        finally:
+            self.inbox.close()
+            self.outbox.close()
+
+
+class ClientPool:
+    """Các kết nối tới một model server; mỗi lần gọi mượn một kết nối rảnh (mở thêm khi cần)"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._idle: "queue.LifoQueue[ModelClient]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._clients: List[ModelClient] = []
+
+    def call(self, op: str, *args, arrays: Sequence[np.ndarray] = (), cancel=None):
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            client = ModelClient(self.stage)
+            with self._lock:
+                self._clients.append(client)
+        try:
+            result = client.call(op, *args, arrays=arrays, cancel=cancel)
+        except (TurnCancelled, RemoteError):
+            # Server đã trả lời đầy đủ, kết nối vẫn dùng lại được
+            self._idle.put(client)
+            raise
+        except BaseException:
+            # Server khởi động lại / request bị ngắt giữa chừng: bỏ kết nối, lần sau mở kết nối mới
+            self._discard(client)
+            raise
+        self._idle.put(client)
+        return result
+
+    def _discard(self, client: ModelClient):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            client.close()
+
+
+def remove_stale_socket(path: Path):
+    """Xoá socket còn sót của lần chạy trước (server không bind lại được lên file cũ)"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -1,150 +1,420 @@
 import os
+import asyncio
+import hashlib
+import heapq
+import logging
 import json
 import time
 import re
+import threading
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
-from google import genai
-from google.genai import types
+import numpy as np
 
 from settings import llm_settings as cfg
+from settings import server_settings as server_cfg
+from . import metrics
+from .cancel import committed, is_cancelled
+from .history import ChatHistory
+from .response_cache import CachedResponse, ResponseCache
+
+logger = logging.getLogger(__name__)
+
+
+class _BM25Index:
+    """Snapshot bất biến của index; search() đọc một snapshot nên không cần khoá"""
+    
+    def __init__(self, chunks, term_ids, offsets, post_chunks, post_tfs, idf, length_norm):
+        self.chunks: List[Tuple[str, str]] = chunks
+        # Inverted index dạng CSR: posting list của term t là
+        # post_chunks/post_tfs[offsets[t]:offsets[t + 1]] (chunk_id, term frequency)
+        self.term_ids: Dict[str, int] = term_ids
+        self.offsets: np.ndarray = offsets
+        self.post_chunks: np.ndarray = post_chunks
+        self.post_tfs: np.ndarray = post_tfs
+        self.idf: np.ndarray = idf
+        # k1 * (1 - b + b * dl / avgdl) cho từng chunk, tính sẵn lúc build index
+        self.length_norm: np.ndarray = length_norm
+    
+    @classmethod
+    def empty(cls) -> "_BM25Index":
+        return cls(
+            [], {}, np.zeros(1, dtype=np.int64),
+            np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+            np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.float64)
+        )
+    
+    def chunk_term_freqs(self) -> List[Dict[str, int]]:
+        """Đảo ngược postings thành term -> tf của từng chunk (chỉ cần khi rebuild)"""
+        per_chunk: List[Dict[str, int]] = [{} for _ in self.chunks]
+        for term, term_id in self.term_ids.items():
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            for chunk_id, tf in zip(self.post_chunks[start:end].tolist(), self.post_tfs[start:end].tolist()):
+                per_chunk[chunk_id][term] = tf
+        return per_chunk
 
 
 class SimpleRAG:
-    """Simple RAG implementation with chunking and keyword-based search"""
+    """
+    Simple RAG implementation with chunking and BM25 search over an inverted index.
+    Index (postings, idf, độ dài chunk) được lưu nguyên dạng ra đĩa (cfg.RAG_INDEX_PATH, .npz)
+    cùng mtime/hash của từng file: khởi động không đổi gì thì chỉ nạp lại mảng, file mới/sửa/xoá
+    mới phải chunk lại, và thư mục được quét lại định kỳ (RAG_REFRESH_INTERVAL) để cập nhật
+    tài liệu không cần restart.
+    """
+    
+    INDEX_VERSION = 2
     
     def __init__(
         self,
         folder: str,
         chunk_size: int = None,
-        overlap: int = None
+        overlap: int = None,
+        index_path: str = None
     ):
         self.folder = Path(folder)
         self.chunk_size = chunk_size or cfg.RAG_CHUNK_SIZE
         self.overlap = overlap or cfg.RAG_CHUNK_OVERLAP
-        self.chunks: List[Tuple[str, str]] = []
+        self.k1 = cfg.RAG_BM25_K1
+        self.b = cfg.RAG_BM25_B
+        self.index_path = Path(index_path) if index_path else cfg.RAG_INDEX_PATH
+        # path -> {"mtime_ns", "size", "sha1", "chunks": [str]}
+        # (+ "term_freqs": [dict] với file vừa chunk lại, cho tới lần build index kế tiếp)
+        self._files: Dict[str, Dict] = {}
+        self._index = _BM25Index.empty()
+        # Có record đổi mtime/size (file chỉ bị "touch") nhưng chưa ghi ra đĩa
+        self._stat_dirty = False
         self._loaded = False
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+    
+    @property
+    def chunks(self) -> List[Tuple[str, str]]:
+        return self._index.chunks
     
     def _tokenize(self, s: str) -> List[str]:
         """Tokenize text thành các từ"""
-        return re.findall(r"\\w+", s.lower(), flags=re.UNICODE)
+        return re.findall(r"\w+", s.lower(), flags=re.UNICODE)
     
-    def _load(self):
-        """Load và chunk các document"""
-        if self._loaded:
+    def _chunk_text(self, text: str) -> List[str]:
+        chunks = []
+        i = 0
+        while i < len(text):
+            chunks.append(text[i:i + self.chunk_size])
+            i += self.chunk_size - self.overlap
+        return chunks
+    
+    def _index_params(self) -> Dict:
+        return {
+            "version": self.INDEX_VERSION,
+            "chunk_size": self.chunk_size,
+            "overlap": self.overlap,
+            "k1": self.k1,
+            "b": self.b,
+        }
+    
+    def _read_index_file(self):
+        """Nạp index đã lưu; bỏ qua nếu tham số chunking/BM25 đã đổi"""
+        if not self.index_path or not self.index_path.exists():
             return
-        
-        if not self.folder.exists():
-            print(f"⚠️  RAG folder không tồn tại: {self.folder}")
-            self.folder.mkdir(parents=True, exist_ok=True)
-            self._loaded = True
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("params") != self._index_params():
+                    print("  ⚠️  RAG index params changed, rebuilding")
+                    return
+                files = meta["files"]
+                chunks = [(key, chunk) for key in sorted(files) for chunk in files[key]["chunks"]]
+                terms = data["terms"].tolist()
+                index = _BM25Index(
+                    chunks,
+                    dict(zip(terms, range(len(terms)))),
+                    data["offsets"],
+                    data["post_chunks"],
+                    data["post_tfs"],
+                    data["idf"],
+                    data["length_norm"],
+                )
+            if len(index.length_norm) != len(chunks) or len(index.offsets) != len(terms) + 1:
+                raise ValueError("postings do not match file records")
+            self._files = files
+            self._index = index
+        except Exception as e:
+            print(f"  ⚠️  Failed to read RAG index {self.index_path}: {e}")
+    
+    def _write_index_file(self):
+        self._stat_dirty = False
+        if not self.index_path:
             return
+        index = self._index
+        meta = {
+            "params": self._index_params(),
+            "files": {
+                key: {field: record[field] for field in ("mtime_ns", "size", "sha1", "chunks")}
+                for key, record in self._files.items()
+            },
+        }
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_suffix(".tmp.npz")
+            np.savez(
+                tmp_path,
+                meta=np.array(json.dumps(meta, ensure_ascii=False)),
+                terms=np.array(list(index.term_ids), dtype=str),
+                offsets=index.offsets,
+                post_chunks=index.post_chunks,
+                post_tfs=index.post_tfs,
+                idf=index.idf,
+                length_norm=index.length_norm,
+            )
+            tmp_path.replace(self.index_path)
+        except Exception as e:
+            print(f"  ⚠️  Failed to save RAG index: {e}")
+    
+    def _index_file(self, file_path: Path, stat, sha1: str, text: str) -> Dict:
+        chunks = self._chunk_text(text)
+        return {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha1": sha1,
+            "chunks": chunks,
+            "term_freqs": [dict(Counter(self._tokenize(chunk))) for chunk in chunks],
+        }
+    
+    def _sync_files(self) -> bool:
+        """So sánh thư mục với records: chỉ chunk lại file mới/đã sửa. Trả về True nếu nội dung có thay đổi"""
+        changed = False
+        seen = set()
         
-        print(f"📚 Loading RAG documents from {self.folder}...")
-        doc_count = 0
-        
-        for file_path in self.folder.rglob("*.txt"):
+        for file_path in sorted(self.folder.rglob("*.txt")):
+            key = str(file_path)
+            seen.add(key)
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
+                stat = file_path.stat()
+                record = self._files.get(key)
+                if record and record["mtime_ns"] == stat.st_mtime_ns and record["size"] == stat.st_size:
+                    continue
                 
-                i = 0
-                while i < len(text):
-                    chunk = text[i:i + self.chunk_size]
-                    self.chunks.append((str(file_path), chunk))
-                    i += self.chunk_size - self.overlap
+                raw = file_path.read_bytes()
+                sha1 = hashlib.sha1(raw).hexdigest()
+                if record and record["sha1"] == sha1:
+                    # Chỉ bị "touch", nội dung không đổi: lưu stat mới để lần sau khỏi hash lại
+                    record["mtime_ns"] = stat.st_mtime_ns
+                    record["size"] = stat.st_size
+                    self._stat_dirty = True
+                    continue
                 
-                doc_count += 1
+                self._files[key] = self._index_file(file_path, stat, sha1, raw.decode("utf-8"))
+                print(f"  ✓ Indexed {file_path.name} ({len(self._files[key]['chunks'])} chunks)")
+                changed = True
             except Exception as e:
                 print(f"  ⚠️  Error loading {file_path}: {e}")
         
-        print(f"  ✓ Loaded {doc_count} documents, {len(self.chunks)} chunks")
-        self._loaded = True
-    
-    def search(self, query: str, top_k: int = None) -> List[Dict[str, any]]:
-        """Tìm kiếm các chunk liên quan nhất"""
-        self._load()
+        for key in list(self._files):
+            if key not in seen:
+                print(f"  ✓ Removed {Path(key).name} from index")
+                del self._files[key]
+                changed = True
         
-        if not self.chunks:
-            return []
-        
-        top_k = top_k or cfg.RAG_TOP_K
-        q_tokens = set(self._tokenize(query))
+        return changed
+    
+    def _build_index(self) -> _BM25Index:
+        """Gộp records thành inverted index + thống kê BM25 (không tokenize lại file không đổi)"""
+        # term_freqs của file không đổi lấy lại từ postings của index hiện tại
+        previous: Dict[str, List[Dict[str, int]]] = None
+        chunks: List[Tuple[str, str]] = []
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lens: List[int] = []
+        for key in sorted(self._files):
+            record = self._files[key]
+            file_term_freqs = record.pop("term_freqs", None)
+            if file_term_freqs is None:
+                if previous is None:
+                    previous = {}
+                    for (src, _), term_freqs in zip(self._index.chunks, self._index.chunk_term_freqs()):
+                        previous.setdefault(src, []).append(term_freqs)
+                file_term_freqs = previous[key]
+            for chunk, term_freqs in zip(record["chunks"], file_term_freqs):
+                chunk_id = len(chunks)
+                chunks.append((key, chunk))
+                doc_lens.append(sum(term_freqs.values()))
+                for term, tf in term_freqs.items():
+                    postings.setdefault(term, []).append((chunk_id, tf))
         
-        scored = []
-        for src, chunk in self.chunks:
-            c_tokens = set(self._tokenize(chunk))
-            score = len(q_tokens & c_tokens)
-            if score > 0:
-                scored.append((score, src, chunk))
+        terms = list(postings)
+        doc_freqs = np.fromiter((len(postings[term]) for term in terms), dtype=np.int64, count=len(terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=offsets[1:])
+        n_postings = int(offsets[-1])
+        post_chunks = np.fromiter(
+            (chunk_id for term in terms for chunk_id, _ in postings[term]), dtype=np.int32, count=n_postings
+        )
+        post_tfs = np.fromiter(
+            (tf for term in terms for _, tf in postings[term]), dtype=np.int32, count=n_postings
+        )
         
-        scored.sort(key=lambda x: x, reverse=True)
+        n_docs = len(chunks)
+        idf = np.log1p((n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        doc_lens = np.asarray(doc_lens, dtype=np.float64)
+        avg_len = doc_lens.mean() if n_docs else 0.0
+        length_norm = self.k1 * (1.0 - self.b + self.b * (doc_lens / avg_len if avg_len else 0.0))
+        return _BM25Index(
+            chunks, dict(zip(terms, range(len(terms)))), offsets, post_chunks, post_tfs, idf, length_norm
+        )
+    
+    def _load(self):
+        """Nạp index từ đĩa, đồng bộ với thư mục tài liệu"""
+        if self._loaded:
+            return
         
+        with self._lock:
+            if self._loaded:
+                return
+            
+            if not self.folder.exists():
+                print(f"⚠️  RAG folder không tồn tại: {self.folder}")
+                self.folder.mkdir(parents=True, exist_ok=True)
+            
+            print(f"📚 Loading RAG documents from {self.folder}...")
+            self._read_index_file()
+            changed = self._sync_files()
+            if changed:
+                self._index = self._build_index()
+            if changed or self._stat_dirty:
+                self._write_index_file()
+            self._last_refresh = time.time()
+            print(f"  ✓ Loaded {len(self._files)} documents, {len(self.chunks)} chunks, "
+                  f"{len(self._index.term_ids)} terms")
+            self._loaded = True
+    
+    def refresh(self, force: bool = False) -> bool:
+        """Quét lại thư mục (tối đa mỗi RAG_REFRESH_INTERVAL giây), rebuild nếu có file đổi"""
+        if not force and (
+            cfg.RAG_REFRESH_INTERVAL is None
+            or time.time() - self._last_refresh < cfg.RAG_REFRESH_INTERVAL
+        ):
+            return False
+        if not self._lock.acquire(blocking=False):
+            # Một thread khác đang refresh; dùng snapshot hiện tại
+            return False
+        try:
+            self._last_refresh = time.time()
+            if not self.folder.exists():
+                return False
+            changed = self._sync_files()
+            if changed:
+                self._index = self._build_index()
+                print(f"📚 RAG index refreshed: {len(self.chunks)} chunks")
+            if changed or self._stat_dirty:
+                self._write_index_file()
+            return changed
+        finally:
+            self._lock.release()
+    
+    @property
+    def index(self) -> _BM25Index:
+        """Snapshot index hiện tại (dùng chung với DenseRAG/HybridRAG để chunk_id khớp nhau)"""
+        return self._index
+    
+    def ensure_loaded(self):
+        self._load()
+        self.refresh()
+    
+    def score_chunks(self, query: str, index: _BM25Index = None) -> Dict[int, float]:
+        """Điểm BM25 của các chunk có chứa từ trong câu hỏi: {chunk_id: score}"""
+        index = index or self._index
+        scores: Dict[int, float] = {}
+        k1_plus_1 = self.k1 + 1.0
+        for term in set(self._tokenize(query)):
+            term_id = index.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = index.offsets[term_id], index.offsets[term_id + 1]
+            chunk_ids = index.post_chunks[start:end]
+            tfs = index.post_tfs[start:end]
+            bm25 = index.idf[term_id] * tfs * k1_plus_1 / (tfs + index.length_norm[chunk_ids])
+            for chunk_id, score in zip(chunk_ids.tolist(), bm25.tolist()):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + score
+        return scores
+    
+    def format_results(
+        self,
+        index: _BM25Index,
+        scores: Dict[int, float],
+        top_k: int,
+        min_score: float = None
+    ) -> List[Dict[str, any]]:
+        """Lấy top-k bằng heap và đổi sang dạng kết quả dùng cho _format_rag_context"""
         results = []
-        for score, src, chunk in scored[:top_k]:
+        for chunk_id, score in heapq.nlargest(top_k, scores.items(), key=lambda x: x[1]):
+            if min_score is not None and score < min_score:
+                continue
+            src, chunk = index.chunks[chunk_id]
             results.append({
                 "source": Path(src).name,
-                "score": int(score),
+                "score": round(score, 4),
                 "text": chunk
             })
-        
         return results
-
-
-class ChatHistory:
-    """Quản lý lịch sử hội thoại"""
-    
-    def __init__(self, history_dir: str = None):
-        self.history_dir = Path(history_dir or cfg.HISTORY_DIR)
-        self.history_dir.mkdir(parents=True, exist_ok=True)
-        self.history_file = self.history_dir / "history.jsonl"
-        self.memory: Dict[str, List[Dict]] = {}
-    
-    def add(self, session_id: str, role: str, text: str):
-        """Thêm message vào history"""
-        messages = self.memory.setdefault(session_id, [])
-        messages.append({
-            "role": role,
-            "content": text,
-            "timestamp": time.time()
-        })
-        
-        if len(messages) > cfg.MAX_HISTORY_TURNS * 2:
-            self.memory[session_id] = messages[-cfg.MAX_HISTORY_TURNS * 2:]
-        
-        try:
-            with open(self.history_file, "a", encoding="utf-8") as f:
-                f.write(json.dumps({
-                    "session_id": session_id,
-                    "role": role,
-                    "content": text,
-                    "timestamp": time.time()
-                }, ensure_ascii=False) + "\\n")
-        except Exception as e:
-            print(f"⚠️  Failed to save history: {e}")
-    
-    def get_history(self, session_id: str) -> List[Dict]:
-        """Lấy lịch sử hội thoại"""
-        return self.memory.get(session_id, [])
     
-    def clear(self, session_id: str):
-        """Xóa lịch sử một session"""
-        if session_id in self.memory:
-            del self.memory[session_id]
+    def search(self, query: str, top_k: int = None) -> List[Dict[str, any]]:
+        """Tìm kiếm các chunk liên quan nhất (BM25, chỉ duyệt posting list của từ trong câu hỏi)"""
+        self.ensure_loaded()
+        
+        index = self._index
+        if not index.chunks:
+            return []
+        
+        top_k = top_k or cfg.RAG_TOP_K
+        return self.format_results(index, self.score_chunks(query, index), top_k)
 
 
 class LLMEngine:
     """LLM Engine with Gemini API - Features: Chain of Thought, RAG"""
     
-    def __init__(self):
-        self.client = None
-        self.rag = SimpleRAG(cfg.RAG_DIR)
-        self.history = ChatHistory()
-        self._initialize_client()
+    def __init__(self, client=None):
+        self.client = client
+        self.rag = self._create_retriever()
+        self.history = self._create_history()
+        if self.client is None:
+            self._initialize_client()
+        self.response_cache = None
+        if cfg.RESPONSE_CACHE_ENABLED:
+            self.response_cache = ResponseCache(cfg.RESPONSE_CACHE_DIR, namespace=self._cache_namespace())
+    
+    @staticmethod
+    def _create_history():
+        if server_cfg.MODEL_SERVERS:
+            # Nhiều worker: lịch sử do history server giữ, một process ghi log/index
+            from .remote import RemoteChatHistory
+            return RemoteChatHistory()
+        return ChatHistory()
+
+    def _create_retriever(self):
+        """BM25 (mặc định) hoặc dense/hybrid dùng embedding ONNX offline"""
+        keyword_rag = SimpleRAG(cfg.RAG_DIR)
+        if cfg.RAG_MODE == "bm25":
+            return keyword_rag
+        
+        from .rag_dense import DenseRAG, HybridRAG
+        print(f"🔧 Initializing {cfg.RAG_MODE} retriever ({cfg.EMBEDDING_MODEL_DIR.name})...")
+        if cfg.RAG_MODE == "dense":
+            return DenseRAG(keyword_rag)
+        if cfg.RAG_MODE == "hybrid":
+            return HybridRAG(keyword_rag)
+        raise ValueError(f"Unknown RAG_MODE: {cfg.RAG_MODE}")
     
     def _initialize_client(self):
         """Khởi tạo Gemini client"""
+        if cfg.LLM_BACKEND == "fake":
+            from .fake_llm import FakeGeminiClient
+            print("🔧 Initializing fake LLM client (offline)...")
+            self.client = FakeGeminiClient()
+            print("✅ LLM initialized successfully")
+            return
+        
         print("🔧 Initializing Gemini LLM...")
         
         api_key = cfg.GEMINI_API_KEY
@@ -155,11 +425,72 @@ class LLMEngine:
                 "hoặc cập nhật settings/llm_settings.py"
             )
         
+        # google-genai chỉ được import khi chọn backend Gemini (nặng, chậm khởi động)
+        from google import genai
         self.client = genai.Client(api_key=api_key)
         print(f"  ✓ Model: {cfg.GEMINI_MODEL}")
         print(f"  ✓ Chain of Thought: {'Enabled' if cfg.USE_THINKING else 'Disabled'}")
         print("✅ LLM initialized successfully")
     
+    def _cache_namespace(self) -> str:
+        """Đổi model/prompt/backend thì câu trả lời đã cache không còn dùng được"""
+        parts = [cfg.LLM_BACKEND, cfg.GEMINI_MODEL, cfg.ROLE_PROMPT, cfg.SAFETY_PROMPT, str(cfg.TEMPERATURE)]
+        return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+    
+    def lookup_cache(self, text: str, session_id: str = "default") -> Optional[CachedResponse]:
+        """Câu trả lời đã cache cho `text`, hoặc None (cache tắt, miss, hoặc lượt phụ thuộc ngữ cảnh)"""
+        if self.response_cache is None:
+            return None
+        return self._cached_reply(text, self.history.get_history(session_id))
+    
+    async def alookup_cache(self, text: str, session_id: str = "default") -> Optional[CachedResponse]:
+        """lookup_cache trên thread: history có thể nằm ở model server (round trip qua socket)"""
+        if self.response_cache is None:
+            return None
+        return await asyncio.to_thread(self.lookup_cache, text, session_id)
+    
+    def _cached_reply(self, text: str, history: List[Dict]) -> Optional[CachedResponse]:
+        if self.response_cache.is_context_dependent(text, history):
+            return None
+        cached = self.response_cache.get(text)
+        if cached is not None:
+            logger.info("⚡ Response cache hit: %s", cached.key)
+        return cached
+    
+    def _is_cacheable(self, text: str, history: List[Dict]) -> bool:
+        """Chỉ lưu câu trả lời sinh ra không dựa vào các lượt trước của hội thoại"""
+        if self.response_cache is None:
+            return False
+        return not (
+            self.response_cache.has_recent_context(history)
+            or self.response_cache.is_context_dependent(text, history)
+        )
+    
+    def _prepare_turn(
+        self,
+        text: str,
+        session_id: str,
+        use_cache: bool
+    ) -> Tuple[Optional[CachedResponse], bool, List[Dict]]:
+        """(cached, cacheable, history) với một lần đọc history cho cả cache lẫn prompt"""
+        history = self.history.get_history(session_id)
+        cached = None
+        if use_cache and self.response_cache is not None:
+            cached = self._cached_reply(text, history)
+        return cached, self._is_cacheable(text, history), history
+    
+    def commit_cached_reply(self, text: str, cached: CachedResponse, session_id: str = "default"):
+        """Ghi lượt được trả lời từ cache vào history (lượt sau vẫn có ngữ cảnh)"""
+        self._commit_turn(session_id, text, cached.reply)
+    
+    async def acommit_cached_reply(self, text: str, cached: CachedResponse, session_id: str = "default"):
+        await asyncio.to_thread(self.commit_cached_reply, text, cached, session_id)
+    
+    def remember_audio(self, text: str, reply: str, segments, audio_tag: str):
+        """Gắn audio TTS của câu trả lời vào cache (chỉ khi lượt này đã được cache)"""
+        if self.response_cache is not None:
+            self.response_cache.attach_audio(text, reply, segments, audio_tag)
+    
     def _build_system_prompt(self) -> str:
         """Xây dựng system prompt"""
         return cfg.ROLE_PROMPT + "\\n" + cfg.SAFETY_PROMPT
@@ -187,23 +518,21 @@ class LLMEngine:
             })
         return gemini_history
     
-    def chat(
+    def _build_request(
         self,
         text: str,
-        session_id: str = "default",
+        history: List[Dict],
         use_rag: bool = True
-    ) -> str:
-        """Chat với LLM"""
-        print(f"💬 User: {text}")
-        
-        self.history.add(session_id, "user", text)
-        
+    ):
+        """Chuẩn bị contents + config cho Gemini (history KHÔNG gồm câu hỏi hiện tại)"""
         rag_context = ""
         if use_rag:
-            docs = self.rag.search(text)
+            with metrics.span("rag"):
+                docs = self.rag.search(text)
+            metrics.mark("rag_done")
             if docs:
                 rag_context = self._format_rag_context(docs)
-                print(f"  📚 Retrieved {len(docs)} relevant documents")
+                logger.debug("  📚 Retrieved %d relevant documents", len(docs))
         
         system_prompt = self._build_system_prompt()
         
@@ -216,27 +545,52 @@ class LLMEngine:
         else:
             enhanced_prompt = system_prompt
         
-        history = self.history.get_history(session_id)
-        gemini_history = self._format_history_for_gemini(history[:-1])
+        gemini_history = self._format_history_for_gemini(history)
         
         contents = gemini_history + [{
             "role": "user",
             "parts": [{"text": text}]
         }]
         
-        generation_config = types.GenerateContentConfig(
-            temperature=cfg.TEMPERATURE,
-            max_output_tokens=cfg.MAX_OUTPUT_TOKENS,
-            top_p=cfg.TOP_P,
-            top_k=cfg.TOP_K,
-            system_instruction=enhanced_prompt,
-        )
+        # Dict như contents (SDK tự validate thành GenerateContentConfig): backend fake
+        # không cần import google-genai
+        generation_config = {
+            "temperature": cfg.TEMPERATURE,
+            "max_output_tokens": cfg.MAX_OUTPUT_TOKENS,
+            "top_p": cfg.TOP_P,
+            "top_k": cfg.TOP_K,
+            "system_instruction": enhanced_prompt,
+        }
         
         if cfg.USE_THINKING:
-            generation_config.thinking_config = types.ThinkingConfig(
-                thinking_budget=cfg.THINKING_BUDGET,
-                include_thoughts=cfg.INCLUDE_THOUGHTS
-            )
+            generation_config["thinking_config"] = {
+                "thinking_budget": cfg.THINKING_BUDGET,
+                "include_thoughts": cfg.INCLUDE_THOUGHTS
+            }
+        
+        return contents, generation_config
+    
+    def _error_reply(self, e: Exception) -> str:
+        logger.error("❌ LLM Error: %s", e)
+        return cfg.ERROR_REPLY
+    
+    def chat(
+        self,
+        text: str,
+        session_id: str = "default",
+        use_rag: bool = True,
+        use_cache: bool = True
+    ) -> str:
+        """Chat với LLM"""
+        logger.info("💬 User: %s", text)
+        
+        cached, cacheable, history = self._prepare_turn(text, session_id, use_cache)
+        if cached is not None:
+            self.commit_cached_reply(text, cached, session_id)
+            return cached.reply
+        
+        self.history.add(session_id, "user", text)
+        contents, generation_config = self._build_request(text, history, use_rag)
         
         try:
             response = self.client.models.generate_content(
@@ -246,16 +600,150 @@ class LLMEngine:
             )
             
             reply = response.text
-            print(f"🤖 Assistant: {reply}")
+            logger.info("🤖 Assistant: %s", reply)
             
             self.history.add(session_id, "assistant", reply)
+            if cacheable:
+                self.response_cache.put_reply(text, reply)
             
             return reply
             
         except Exception as e:
-            error_msg = f"❌ LLM Error: {str(e)}"
-            print(error_msg)
-            return f"Xin lỗi, tớ gặp lỗi khi xử lý câu hỏi của cậu. Lỗi: {str(e)}"
+            return self._error_reply(e)
+    
+    def _commit_turn(self, session_id: str, text: str, reply: str, cacheable: bool = False):
+        """Ghi cả lượt hỏi-đáp vào history sau khi stream xong"""
+        logger.info("🤖 Assistant: %s", reply)
+        self.history.add(session_id, "user", text)
+        self.history.add(session_id, "assistant", reply)
+        if cacheable:
+            self.response_cache.put_reply(text, reply)
+    
+    def chat_stream(
+        self,
+        text: str,
+        session_id: str = "default",
+        use_rag: bool = True,
+        use_cache: bool = True,
+        cancel=None
+    ) -> Iterator[str]:
+        """
+        Chat với LLM dạng streaming: yield từng đoạn text (delta) ngay khi Gemini sinh ra.
+        Câu hỏi và câu trả lời đầy đủ chỉ được ghi vào history khi stream kết thúc,
+        nên lượt bị bỏ dở (client ngắt, lỗi, `cancel` bị huỷ) không làm bẩn history.
+        """
+        logger.info("💬 User (stream): %s", text)
+        
+        cached, cacheable, history = self._prepare_turn(text, session_id, use_cache)
+        if cached is not None:
+            self.commit_cached_reply(text, cached, session_id)
+            yield cached.reply
+            return
+        
+        contents, generation_config = self._build_request(text, history, use_rag)
+        
+        parts = []
+        stream = None
+        requested = time.monotonic()
+        try:
+            stream = self.client.models.generate_content_stream(
+                model=cfg.GEMINI_MODEL,
+                contents=contents,
+                config=generation_config
+            )
+            for chunk in stream:
+                if is_cancelled(cancel):
+                    logger.info("⏹️  LLM stream cancelled")
+                    return
+                delta = chunk.text
+                if delta:
+                    if not parts:
+                        metrics.mark("llm_first_token")
+                        metrics.add_span("llm_first_token", time.monotonic() - requested)
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            if not parts:
+                yield self._error_reply(e)
+            else:
+                logger.error("❌ LLM Error mid-stream: %s", e)
+            return
+        finally:
+            # Đóng kết nối tới Gemini ngay khi lượt bị bỏ, không đợi GC
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+        
+        metrics.mark("llm_done")
+        metrics.add_span("llm", time.monotonic() - requested)
+        self._commit_turn(session_id, text, "".join(parts), cacheable=cacheable)
+    
+    async def achat_stream(
+        self,
+        text: str,
+        session_id: str = "default",
+        use_rag: bool = True,
+        use_cache: bool = True,
+        cancel=None
+    ) -> AsyncIterator[str]:
+        """
+        Phiên bản async của chat_stream, dùng client.aio (không chặn event loop).
+        Đọc/ghi history và cache chạy trên thread: với MODEL_SERVERS, history là
+        RemoteChatHistory và mỗi lời gọi là một round trip qua socket.
+        """
+        logger.info("💬 User (async stream): %s", text)
+        
+        cached, cacheable, history = await asyncio.to_thread(
+            self._prepare_turn, text, session_id, use_cache
+        )
+        if cached is not None:
+            if not await committed(cancel):
+                return
+            await self.acommit_cached_reply(text, cached, session_id)
+            yield cached.reply
+            return
+        
+        # RAG search là việc CPU, không chạy trên event loop
+        contents, generation_config = await asyncio.to_thread(
+            self._build_request, text, history, use_rag
+        )
+        
+        parts = []
+        stream = None
+        requested = time.monotonic()
+        try:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=cfg.GEMINI_MODEL,
+                contents=contents,
+                config=generation_config
+            )
+            async for chunk in stream:
+                if is_cancelled(cancel):
+                    logger.info("⏹️  LLM stream cancelled")
+                    return
+                delta = chunk.text
+                if delta:
+                    if not parts:
+                        metrics.mark("llm_first_token")
+                        metrics.add_span("llm_first_token", time.monotonic() - requested)
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            if not parts:
+                yield self._error_reply(e)
+            else:
+                logger.error("❌ LLM Error mid-stream: %s", e)
+            return
+        finally:
+            # Đóng kết nối tới Gemini ngay khi lượt bị bỏ (barge-in, client ngắt), không đợi GC
+            if stream is not None and hasattr(stream, "aclose"):
+                await stream.aclose()
+        
+        metrics.mark("llm_done")
+        metrics.add_span("llm", time.monotonic() - requested)
+        # Lượt speculative: chỉ ghi vào lịch sử khi người dùng thật sự đã nói xong
+        if not await committed(cancel):
+            return
+        await asyncio.to_thread(self._commit_turn, session_id, text, "".join(parts), cacheable)
 
 
 def chat_with_llm(text: str, session_id: str = "default") -> str:
@@ -0,0 +1,266 @@
+"""
+Metrics & tracing: độ trễ từng stage của mỗi lượt hội thoại
+  - TurnTrace: các mốc (tính từ lúc VAD kết thúc câu) và span (thời gian từng stage) của một lượt,
+    gắn vào contextvar nên stage nào cũng gọi mark()/span() được mà không phải truyền tham số
+    (kể cả trong executor, nếu được gọi qua run_in_context)
+  - Histogram/Counter tối giản + Registry xuất Prometheus text format cho GET /metrics
+  - TraceLog: N lượt gần nhất của mỗi session (GET /traces)
+Không có lượt nào đang trace thì mark()/span() là no-op.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from settings import server_settings as cfg
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0)
+
+
+def setup_logging(level: str = None):
+    """Cấu hình logging cho server; log dưới `level` bị bỏ trước khi format (không tốn gì)"""
+    logging.basicConfig(
+        level=getattr(logging, (level or cfg.LOG_LEVEL).upper(), logging.INFO),
+        format=cfg.LOG_FORMAT,
+    )
+
+
+def _format_labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            names = self.labelnames + ("le",)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, labels + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Registry:
+    """Các metric của process + collector (hàm trả về dict số liệu, xuất thành gauge)"""
+
+    def __init__(self, prefix: str = "voice"):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors: List[Callable[[], dict]] = []
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        metric = Counter(f"{self.prefix}_{name}", documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect: Callable[[], dict]):
+        """vd. pipeline.stats: mỗi key số thành một gauge voice_<key>"""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{self.prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_seconds", "Duration of each pipeline stage within a turn", ["stage"]
+)
+MILESTONE_SECONDS = REGISTRY.histogram(
+    "turn_milestone_seconds", "Time from VAD end-of-utterance to each milestone of a turn", ["milestone"]
+)
+TURNS = REGISTRY.counter("turns_total", "Finished turns by outcome", ["outcome"])
+
+
+class TurnTrace:
+    """
+    Một lượt: mốc (giây kể từ start, chỉ lần đầu được ghi) và span (cộng dồn, vd. nhiều câu TTS).
+    Mốc chuẩn: stt_done, rag_done, llm_first_token, llm_done, tts_first_audio, tts_done,
+    first_byte_sent, last_byte_sent; endpoint_committed khi lượt speculative được VAD xác nhận.
+    """
+
+    def __init__(self, session_id: str, start: Optional[float] = None):
+        self.session_id = session_id
+        self.start = start if start is not None else time.monotonic()
+        self.wall_time = time.time()
+        self.marks: Dict[str, float] = {}
+        self.spans: Dict[str, float] = {}
+        self.outcome: Optional[str] = None
+
+    def mark(self, name: str):
+        # Lượt đã finish() thì bỏ qua (vd. generator còn chạy nốt sau khi lượt bị huỷ)
+        if self.outcome is None and name not in self.marks:
+            self.marks[name] = time.monotonic() - self.start
+
+    def add_span(self, name: str, seconds: float):
+        if self.outcome is None:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name: str):
+        began = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.monotonic() - began)
+
+    def finish(self, outcome: str = "ok"):
+        """Đưa lượt vào histogram và TraceLog (chỉ lần đầu)"""
+        if self.outcome is not None:
+            return
+        self.outcome = outcome
+        for name, seconds in self.marks.items():
+            MILESTONE_SECONDS.observe(seconds, name)
+        for name, seconds in self.spans.items():
+            STAGE_SECONDS.observe(seconds, name)
+        TURNS.inc(outcome)
+        TRACE_LOG.add(self)
+        if logger.isEnabledFor(logging.INFO):
+            marks = " ".join(f"{k}={v:.3f}" for k, v in sorted(self.marks.items(), key=lambda kv: kv[1]))
+            logger.info("⏱️  Turn %s [%s] %s", self.session_id, outcome, marks)
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "time": self.wall_time,
+            "outcome": self.outcome,
+            "marks": {k: round(v, 4) for k, v in self.marks.items()},
+            "spans": {k: round(v, 4) for k, v in self.spans.items()},
+        }
+
+
+class TraceLog:
+    """TRACE_HISTORY lượt gần nhất của mỗi session, tối đa TRACE_MAX_SESSIONS session (LRU)"""
+
+    def __init__(self, per_session: int = None, max_sessions: int = None):
+        self.per_session = per_session or cfg.TRACE_HISTORY
+        self.max_sessions = max_sessions or cfg.TRACE_MAX_SESSIONS
+        self._sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, trace: TurnTrace):
+        with self._lock:
+            traces = self._sessions.pop(trace.session_id, None) or deque(maxlen=self.per_session)
+            traces.append(trace)
+            self._sessions[trace.session_id] = traces
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def recent(self, session_id: Optional[str] = None) -> Dict[str, List[dict]]:
+        with self._lock:
+            sessions = {session_id: self._sessions.get(session_id, ())} if session_id else dict(self._sessions)
+            return {sid: [t.to_dict() for t in traces] for sid, traces in sessions.items()}
+
+
+TRACE_LOG = TraceLog()
+
+_current: contextvars.ContextVar[Optional[TurnTrace]] = contextvars.ContextVar("turn_trace", default=None)
+
+
+def start_turn(session_id: str, start: Optional[float] = None) -> TurnTrace:
+    """Bắt đầu trace cho lượt hiện tại (trong context hiện tại: task asyncio / thread)"""
+    trace = TurnTrace(session_id, start)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[TurnTrace]:
+    return _current.get()
+
+
+def mark(name: str):
+    trace = _current.get()
+    if trace is not None:
+        trace.mark(name)
+
+
+def add_span(name: str, seconds: float):
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(name, seconds)
+
+
+@contextmanager
+def span(name: str):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def run_in_context(loop, executor, fn, *args):
+    """run_in_executor nhưng giữ contextvar (trace) của lượt hiện tại trong thread worker"""
+    return loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
@@ -0,0 +1,316 @@
+"""
+Model server: STT, VAD, TTS và lịch sử hội thoại chạy trong các process riêng, dùng chung cho mọi
+worker uvicorn của front-end websocket (MODEL_SERVERS trong settings/server_settings.py)
+
+    python -m modules.model_server                                   # mọi stage, mỗi stage một process
+    python -m modules.model_server --stage stt                       # chỉ một stage
+    python -m modules.model_server --frontend vad_server:app --workers 4 --port 8000
+
+  - Mỗi model được nạp MỘT lần cho cả máy thay vì một lần cho mỗi worker
+  - Mỗi stage được ghim vào các core trong STAGE_CORES; số thread của model = số core được giao
+  - Front-end gọi qua modules/ipc.py (unix socket + shared memory); proxy ở modules/remote.py
+  - STT offline: câu của mọi worker được gom batch chung (BatchingSTTScheduler)
+  - Lịch sử hội thoại chỉ có một process ghi (log/index của ChatHistory không chia sẻ được giữa các process)
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from multiprocessing.connection import Listener, wait
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from settings import server_settings as cfg
+from . import metrics
+from .cancel import TurnCancelled
+from .ipc import FlagCancel, SharedBuffer, SharedView, remove_stale_socket, socket_path
+
+logger = logging.getLogger(__name__)
+
+STT_STREAM_TTL = 120  # Giây; stream STT online bị bỏ dở (barge-in, mất kết nối) được dọn sau chừng này
+
+
+def pin_stage(stage: str) -> Optional[int]:
+    """Ghim process hiện tại vào các core của `stage`; trả về số core (= số thread nên dùng) hoặc None"""
+    cores = (cfg.STAGE_CORES or {}).get(stage)
+    if not cores:
+        return None
+    if not hasattr(os, "sched_setaffinity"):
+        logger.warning("CPU pinning is not supported on this platform, ignoring STAGE_CORES")
+        return None
+    available = os.sched_getaffinity(0)
+    cores = sorted(set(cores) & available)
+    if not cores:
+        logger.warning("No core of STAGE_CORES[%r] is available (have %s), not pinning", stage, sorted(available))
+        return None
+    os.sched_setaffinity(0, cores)
+    # OpenMP/BLAS đọc biến này khi được nạp (trước khi import model)
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    logger.info("📌 %s pinned to cores %s", stage, cores)
+    return len(cores)
+
+
+class ModelServer:
+    """Nhận kết nối trên socket của stage, mỗi kết nối một thread; subclass cài handle()"""
+
+    stage = ""
+
+    def __init__(self):
+        self.requests = 0
+
+    def hello(self) -> dict:
+        """Thông tin cho proxy phía front-end (mode STT, sample rate TTS...)"""
+        return {}
+
+    def handle(self, op: str, args: tuple, arrays: List[np.ndarray], cancel) -> tuple:
+        """(kết quả, list mảng float32 trả về qua shared memory)"""
+        raise NotImplementedError
+
+    def serve_forever(self):
+        path = socket_path(self.stage)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        remove_stale_socket(path)
+        listener = Listener(str(path), family="AF_UNIX", authkey=cfg.MODEL_SERVER_AUTHKEY)
+        logger.info("✅ %s model server listening on %s", self.stage, path)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Sai authkey, client bỏ đi giữa lúc bắt tay...
+                    logger.warning("Rejected %s connection: %s", self.stage, e)
+                    continue
+                threading.Thread(
+                    target=self._serve, args=(conn,), name=f"{self.stage}-conn", daemon=True
+                ).start()
+        finally:
+            listener.close()
+
+    def _serve(self, conn):
+        outbox, inbox = SharedBuffer(), SharedView()
+        try:
+            while True:
+                try:
+                    op, args, name, shapes = conn.recv()
+                except EOFError:
+                    break
+                try:
+                    arrays = inbox.read(name, shapes)
+                except FileNotFoundError:
+                    # Vùng nhớ của client đã mất (client khởi động lại): đóng kết nối để client mở lại
+                    logger.warning("%s client buffer %s is gone, dropping connection", self.stage, name)
+                    break
+                try:
+                    if op == "hello":
+                        result, out = self.hello(), []
+                    else:
+                        result, out = self.handle(op, args, arrays, FlagCancel(inbox, name))
+                    out_shapes = outbox.write(out) if out else []
+                    reply = ("ok", result, outbox.name, out_shapes)
+                except TurnCancelled as e:
+                    reply = ("cancelled", str(e))
+                except Exception as e:
+                    logger.exception("%s request %r failed", self.stage, op)
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                self.requests += 1
+                conn.send(reply)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+            inbox.close()
+            outbox.close()
+
+
+class STTServer(ModelServer):
+    stage = "stt"
+
+    def __init__(self, threads: int = None):
+        super().__init__()
+        from settings import stt_settings as stt_cfg
+        if threads:
+            stt_cfg.NUM_THREADS = threads
+        from .stt import STTEngine
+        from .stt_batch import BatchingSTTScheduler
+        self.engine = STTEngine()
+        self.batcher = None
+        if stt_cfg.BATCH_DECODING and not self.engine.is_online:
+            self.batcher = BatchingSTTScheduler(self.engine)
+        # Stream STT online của mọi front-end: id -> [OnlineSTTSession, lần dùng cuối]
+        self._streams: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def hello(self) -> dict:
+        return {"mode": self.engine.mode}
+
+    def handle(self, op, args, arrays, cancel):
+        if op == "transcribe":
+            wav = arrays[0]
+            text = self.batcher.submit(wav).result() if self.batcher else self.engine.transcribe_array(wav)
+            return text, []
+        if op == "transcribe_batch":
+            return self.engine.transcribe_batch(arrays), []
+        if op == "stream_open":
+            self._expire_streams()
+            stream_id = uuid.uuid4().hex
+            with self._lock:
+                self._streams[stream_id] = [self.engine.create_session(), time.monotonic()]
+            return stream_id, []
+
+        stream_id = args[0]
+        with self._lock:
+            entry = self._streams.get(stream_id)
+            if entry is None:
+                raise KeyError(f"unknown STT stream {stream_id}")
+            entry[1] = time.monotonic()
+            if op == "stream_finish":
+                del self._streams[stream_id]
+        session = entry[0]
+        if op == "stream_accept":
+            session.accept_pcm(arrays[0])
+            return (session.partial, session.is_endpoint()), []
+        if op == "stream_finish":
+            return session.finish(), []
+        raise ValueError(f"unknown STT op {op!r}")
+
+    def _expire_streams(self):
+        deadline = time.monotonic() - STT_STREAM_TTL
+        with self._lock:
+            for stream_id in [k for k, (_, used) in self._streams.items() if used < deadline]:
+                del self._streams[stream_id]
+
+
+class VADServer(ModelServer):
+    """Chạy model Silero cho batch frame mà BatchedVAD của mỗi front-end đã gom sẵn"""
+
+    stage = "vad"
+
+    def __init__(self, threads: int = None):
+        super().__init__()
+        from settings import vad_settings as vad_cfg
+        if threads:
+            vad_cfg.VAD_NUM_THREADS = threads
+        from .vad import BatchedVAD
+        self.session = BatchedVAD._load_model()
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def hello(self) -> dict:
+        return {"inputs": self.input_names}
+
+    def handle(self, op, args, arrays, cancel):
+        if op != "run":
+            raise ValueError(f"unknown VAD op {op!r}")
+        rows, state = arrays
+        probs, new_state = self.session.run(
+            None, {"input": rows, "state": state, "sr": np.array(args[0], dtype=np.int64)}
+        )
+        return None, [probs, new_state]
+
+
+class TTSServer(ModelServer):
+    """Chỉ chạy model; audio store, response cache, chia câu vẫn ở TTSEngine phía front-end"""
+
+    stage = "tts"
+
+    def __init__(self, threads: int = None):
+        super().__init__()
+        from settings import tts_settings as tts_cfg
+        if threads:
+            tts_cfg.NUM_THREADS = threads
+        from .tts import TTSEngine
+        self.engine = TTSEngine()
+
+    def hello(self) -> dict:
+        return {
+            "sampling_rate": getattr(self.engine.backend, "sampling_rate", None),
+            "checkpoint_id": self.engine.checkpoint_id,
+        }
+
+    def handle(self, op, args, arrays, cancel):
+        if op != "generate":
+            raise ValueError(f"unknown TTS op {op!r}")
+        text, ref_audio, prompt_text = args
+        wav = self.engine.backend.generate(text, ref_audio, prompt_text, cancel)
+        return self.engine.backend.sampling_rate, [wav]
+
+
+class HistoryServer(ModelServer):
+    stage = "history"
+    OPS = ("add", "get_history", "clear", "release", "flush", "stats")
+
+    def __init__(self, threads: int = None):
+        super().__init__()
+        from .history import ChatHistory
+        self.history = ChatHistory()
+
+    def handle(self, op, args, arrays, cancel):
+        if op not in self.OPS:
+            raise ValueError(f"unknown history op {op!r}")
+        return getattr(self.history, op)(*args), []
+
+
+SERVERS = {"stt": STTServer, "vad": VADServer, "tts": TTSServer, "history": HistoryServer}
+
+
+def run_stage(stage: str):
+    """Entry point của process model server"""
+    metrics.setup_logging()
+    # terminate() từ launcher: thoát bình thường để atexit (vd. ghi index lịch sử) kịp chạy
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    threads = pin_stage(stage)
+    server = SERVERS[stage](threads)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stage", action="append", choices=sorted(SERVERS),
+                        help="Stage cần chạy (lặp lại được); mặc định MODEL_SERVER_STAGES")
+    parser.add_argument("--frontend", default=None, help="App uvicorn chạy kèm, vd. vad_server:app")
+    parser.add_argument("--workers", type=int, default=cfg.FRONTEND_WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    stages = args.stage or list(cfg.MODEL_SERVER_STAGES)
+
+    metrics.setup_logging()
+    if len(stages) == 1 and args.frontend is None:
+        run_stage(stages[0])
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=run_stage, args=(stage,), name=f"model-{stage}") for stage in stages]
+    for process in processes:
+        process.start()
+    try:
+        if args.frontend is not None:
+            # Worker uvicorn kế thừa biến môi trường và CPU affinity của process này
+            os.environ[cfg.MODEL_SERVERS_ENV] = "1"
+            pin_stage("frontend")
+            import uvicorn
+            uvicorn.run(args.frontend, host=args.host, port=args.port, workers=args.workers)
+        else:
+            wait([process.sentinel for process in processes])
+            for process in processes:
+                if process.exitcode is not None:
+                    logger.error("Model server %s exited with code %s", process.name, process.exitcode)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == '__main__':
+    main()
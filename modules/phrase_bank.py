@@ -0,0 +1,83 @@
+"""
+Phrase Bank: tổng hợp sẵn các câu trả lời hay dùng lúc deploy
+(chào hỏi, "tớ chưa nghe rõ", câu báo lỗi LLM...) vào audio store, để lúc chạy
+chúng được phát ngay mà không phải chờ ZipVoice.
+
+Chạy từ thư mục gốc của repo:
+    python -m modules.phrase_bank                         # cfg.PHRASE_BANK + ERROR_REPLY, giọng mặc định
+    python -m modules.phrase_bank --voices default,teacher
+    python -m modules.phrase_bank --file phrases.txt      # thêm câu từ file (mỗi dòng một câu)
+    python -m modules.phrase_bank --list                  # xem phrase bank hiện có
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import List
+
+from settings import llm_settings as llm_cfg
+from settings import tts_settings as cfg
+
+
+def default_phrases() -> List[str]:
+    phrases = [p for p in cfg.PHRASE_BANK if p]
+    if llm_cfg.ERROR_REPLY not in phrases:
+        phrases.append(llm_cfg.ERROR_REPLY)
+    return phrases
+
+
+def read_phrases(path: Path) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def build_phrase_bank(engine, phrases: List[str], voices: List[str]) -> int:
+    """Tổng hợp (nếu chưa có) và pin từng câu cho từng giọng; trả về số câu phải tổng hợp mới"""
+    synthesized = 0
+    for voice in voices:
+        for text in phrases:
+            cached = engine.has_audio(text, voice)
+            start = time.time()
+            pcm = engine.synthesize_pcm16(text, voice=voice, pin=True)
+            duration = len(pcm) / 2 / engine.audio_store.sample_rate
+            status = "cached" if cached else f"{time.time() - start:.2f}s"
+            print(f"  [{voice}] {text[:50]:<50} {duration:5.2f}s audio ({status})")
+            synthesized += 0 if cached else 1
+    return synthesized
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-synthesize common replies into the TTS audio store")
+    parser.add_argument("--file", type=Path, help="Text file with extra phrases, one per line")
+    parser.add_argument("--voices", default=cfg.DEFAULT_VOICE, help="Comma-separated voice names from cfg.VOICES")
+    parser.add_argument("--no-defaults", action="store_true", help="Skip cfg.PHRASE_BANK and ERROR_REPLY")
+    parser.add_argument("--list", action="store_true", help="Print the current phrase bank and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        from .audio_store import AudioStore
+        manifest = AudioStore().load_manifest()
+        for key, entry in manifest.items():
+            print(f"{key[:12]}  [{entry['voice']}] {entry['text']}")
+        print(f"{len(manifest)} phrases")
+        return
+
+    phrases = [] if args.no_defaults else default_phrases()
+    if args.file:
+        phrases += [p for p in read_phrases(args.file) if p not in phrases]
+    voices = [v.strip() for v in args.voices.split(",") if v.strip()]
+    unknown = [v for v in voices if v not in cfg.VOICES]
+    if unknown:
+        raise SystemExit(f"Unknown voices: {unknown} (known: {list(cfg.VOICES)})")
+
+    from .tts import TTSEngine
+    engine = TTSEngine()
+    if engine.audio_store is None:
+        raise SystemExit("AUDIO_STORE_DIR is disabled in settings/tts_settings.py")
+
+    print(f"🗂️  Building phrase bank: {len(phrases)} phrases x {len(voices)} voices")
+    synthesized = build_phrase_bank(engine, phrases, voices)
+    print(f"✅ Phrase bank ready ({synthesized} newly synthesized) in {engine.audio_store.root}")
+
+
+if __name__ == "__main__":
+    main()
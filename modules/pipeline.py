@@ -1,10 +1,20 @@
+import logging
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional, Union
 import time
 
+import numpy as np
+
+from settings import server_settings as server_cfg
 from .stt import STTEngine
 from .tts import TTSEngine
 from .llm import LLMEngine
+from .segmenter import SentenceSegmenter
+from .cancel import CancelToken, TurnCancelled, is_cancelled
+from .startup import Startup
+from . import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class VoiceAssistantPipeline:
@@ -13,19 +23,46 @@ class VoiceAssistantPipeline:
     Flow: Audio Input -> STT -> LLM -> TTS -> Audio Output
     """
     
-    def __init__(self):
-        print("\\n" + "="*60)
-        print("🚀 Initializing Voice Assistant Pipeline")
-        print("="*60 + "\\n")
-        
-        self.stt_engine = STTEngine()
+    def __init__(self, startup: Optional[Startup] = None):
+        """
+        STT, LLM, TTS được nạp song song (modules/startup.py).
+        Có `startup`: chỉ đăng ký, server gọi startup.start() và nhận kết nối trong lúc nạp;
+        không có thì nạp xong mới trả về như trước.
+        """
+        self.stt_engine = None
+        self.llm_engine = None
+        self.tts_engine = None
+        standalone = startup is None
+        if standalone:
+            print("\\n" + "="*60)
+            print("🚀 Initializing Voice Assistant Pipeline")
+            print("="*60 + "\\n")
+            startup = Startup()
+
+        startup.add("stt", self._load_stt)
+        startup.add("llm", self._load_llm)
+        startup.add("tts", self._load_tts)
+
+        if standalone:
+            startup.run()
+            print("\\n" + "="*60)
+            print("✅ Pipeline Ready!")
+            print("="*60 + "\\n")
+
+    def _load_stt(self):
+        if server_cfg.MODEL_SERVERS:
+            # Model nằm ở model server (modules/model_server.py), ở đây chỉ là proxy
+            from .remote import RemoteSTTEngine
+            self.stt_engine = RemoteSTTEngine()
+        else:
+            self.stt_engine = STTEngine()
+
+    def _load_llm(self):
         self.llm_engine = LLMEngine()
-        self.tts_engine = TTSEngine()
-        
-        print("\\n" + "="*60)
-        print("✅ Pipeline Ready!")
-        print("="*60 + "\\n")
-    
+
+    def _load_tts(self):
+        self.tts_engine = TTSEngine(backend="remote" if server_cfg.MODEL_SERVERS else None)
+
     def process(
         self,
         audio_input_path: str,
@@ -49,38 +86,35 @@ class VoiceAssistantPipeline:
             }
         """
         start_time = time.time()
-        
-        print("\\n" + "🔄 " + "="*58)
-        print("STARTING PIPELINE PROCESSING")
-        print("="*60 + "\\n")
+        trace = metrics.start_turn(session_id)
+        logger.info("🔄 STARTING PIPELINE PROCESSING")
         
         # Step 1: STT
-        print("📍 STEP 1: Speech to Text")
-        print("-" * 60)
-        input_text = self.stt_engine.transcribe(audio_input_path)
-        print(f"✓ Transcribed: {input_text}\\n")
+        logger.info("📍 STEP 1: Speech to Text")
+        with metrics.span("stt"):
+            input_text = self.stt_engine.transcribe(audio_input_path)
+        trace.mark("stt_done")
+        logger.info("✓ Transcribed: %s", input_text)
         
         # Step 2: LLM
-        print("📍 STEP 2: Language Model Processing")
-        print("-" * 60)
-        response_text = self.llm_engine.chat(input_text, session_id=session_id)
-        print(f"✓ Generated response\\n")
+        logger.info("📍 STEP 2: Language Model Processing")
+        with metrics.span("llm"):
+            response_text = self.llm_engine.chat(input_text, session_id=session_id)
+        trace.mark("llm_done")
         
         # Step 3: TTS
-        print("📍 STEP 3: Text to Speech")
-        print("-" * 60)
-        output_audio = self.tts_engine.synthesize(
-            response_text,
-            output_path=audio_output_path
-        )
-        print(f"✓ Audio generated: {output_audio}\\n")
+        logger.info("📍 STEP 3: Text to Speech")
+        with metrics.span("tts"):
+            output_audio = self.tts_engine.synthesize(
+                response_text,
+                output_path=audio_output_path
+            )
+        trace.mark("tts_done")
         
         # Calculate processing time
         processing_time = time.time() - start_time
-        
-        print("="*60)
-        print(f"✅ PIPELINE COMPLETED in {processing_time:.2f}s")
-        print("="*60 + "\\n")
+        trace.finish()
+        logger.info("✅ PIPELINE COMPLETED in %.2fs", processing_time)
         
         return {
             "input_text": input_text,
@@ -89,6 +123,187 @@ class VoiceAssistantPipeline:
             "processing_time": processing_time
         }
     
+    def process_pcm(
+        self,
+        pcm: Union[bytes, np.ndarray],
+        session_id: str = "default",
+        sample_rate: Optional[int] = None
+    ) -> dict:
+        """
+        Pipeline hoàn chỉnh trên buffer trong RAM: không ghi/đọc file nào.
+
+        Args:
+            pcm: audio của người dùng (bytes int16 từ websocket, hoặc np.ndarray)
+            session_id: Session ID cho conversation tracking
+            sample_rate: sample rate của `pcm` (mặc định 16kHz như ESP32)
+
+        Returns:
+            dict: {
+                "input_text": str,
+                "response_text": str,
+                "audio": np.ndarray (float32),
+                "sample_rate": int,
+                "processing_time": float
+            }
+        """
+        start_time = time.time()
+        trace = metrics.start_turn(session_id)
+
+        with metrics.span("stt"):
+            input_text = self.stt_engine.transcribe_array(pcm, sample_rate)
+        trace.mark("stt_done")
+        logger.info("✓ Transcribed: %s", input_text)
+
+        audio_tag = self.tts_engine.cache_tag
+        cached = self.llm_engine.lookup_cache(input_text, session_id)
+        if cached is not None and cached.has_audio(audio_tag):
+            # Câu hỏi lặp lại: không gọi Gemini, không tổng hợp lại
+            self.llm_engine.commit_cached_reply(input_text, cached, session_id)
+            response_text = cached.reply
+            audio, audio_sr = cached.full_audio()
+        else:
+            with metrics.span("llm"):
+                response_text = self.llm_engine.chat(
+                    input_text, session_id=session_id, use_cache=cached is not None
+                )
+            trace.mark("llm_done")
+            audio, audio_sr = self.tts_engine.synthesize_array(response_text)
+            self.llm_engine.remember_audio(input_text, response_text, [(response_text, audio, audio_sr)], audio_tag)
+
+        trace.mark("tts_done")
+        processing_time = time.time() - start_time
+        trace.finish()
+        logger.info("✅ PIPELINE (in-memory) COMPLETED in %.2fs", processing_time)
+
+        return {
+            "input_text": input_text,
+            "response_text": response_text,
+            "audio": audio,
+            "sample_rate": audio_sr,
+            "processing_time": processing_time
+        }
+
+    def process_pcm_stream(
+        self,
+        pcm: Union[bytes, np.ndarray],
+        session_id: str = "default",
+        sample_rate: Optional[int] = None
+    ) -> Iterator[dict]:
+        """Giống process_stream nhưng nhận audio trực tiếp từ buffer trong RAM"""
+        start_time = time.time()
+
+        logger.info("📍 STEP 1: Speech to Text")
+        with metrics.span("stt"):
+            input_text = self.stt_engine.transcribe_array(pcm, sample_rate)
+        metrics.mark("stt_done")
+        logger.info("✓ Transcribed: %s", input_text)
+
+        yield from self.respond_stream(input_text, session_id=session_id, start_time=start_time)
+
+    def process_stream(
+        self,
+        audio_input_path: str,
+        session_id: str = "default"
+    ) -> Iterator[dict]:
+        """
+        Pipeline dạng streaming: LLM sinh text dạng stream, được cắt thành từng
+        câu/mệnh đề và yield audio của mỗi đoạn ngay khi tổng hợp xong (đoạn sau
+        được tổng hợp song song trong lúc đoạn trước đang được gửi).
+
+        Yields:
+            dict: {
+                "input_text": str,
+                "segment": str,
+                "audio": np.ndarray (float32),
+                "sample_rate": int,
+                "index": int
+            }
+        """
+        start_time = time.time()
+
+        logger.info("📍 STEP 1: Speech to Text")
+        with metrics.span("stt"):
+            input_text = self.stt_engine.transcribe(audio_input_path)
+        metrics.mark("stt_done")
+        logger.info("✓ Transcribed: %s", input_text)
+
+        yield from self.respond_stream(input_text, session_id=session_id, start_time=start_time)
+
+    def respond_stream(
+        self,
+        input_text: str,
+        session_id: str = "default",
+        start_time: Optional[float] = None,
+        cancel: Optional[CancelToken] = None
+    ) -> Iterator[dict]:
+        """
+        Phần LLM -> TTS của process_stream, bắt đầu từ text đã nhận dạng
+        (vd. kết quả của OnlineSTTSession ở mode STT online).
+        `cancel` dừng lượt giữa chừng; audio dở dang không được lưu vào cache.
+        """
+        start_time = start_time or time.time()
+
+        audio_tag = self.tts_engine.cache_tag
+        cached = self.llm_engine.lookup_cache(input_text, session_id)
+        if cached is not None and cached.has_audio(audio_tag):
+            # Câu hỏi lặp lại: phát lại audio đã lưu, không gọi Gemini/ZipVoice
+            self.llm_engine.commit_cached_reply(input_text, cached, session_id)
+            for index, (segment, wav, sr) in enumerate(cached.iter_segments()):
+                metrics.mark("tts_first_audio")
+                yield {
+                    "input_text": input_text,
+                    "segment": segment,
+                    "audio": wav,
+                    "sample_rate": sr,
+                    "index": index
+                }
+            metrics.mark("tts_done")
+            logger.info("✅ CACHED RESPONSE served in %.2fs", time.time() - start_time)
+            return
+
+        logger.info("📍 STEP 2+3: Streaming LLM -> Text to Speech")
+        deltas = []
+        synthesized = []
+
+        def segments():
+            # TTS bắt đầu ngay khi LLM sinh xong câu đầu tiên
+            segmenter = SentenceSegmenter()
+            # Miss đã tra ở trên; chỉ khi có câu trả lời text (chưa có audio) mới tra lại
+            for delta in self.llm_engine.chat_stream(
+                input_text, session_id=session_id, use_cache=cached is not None, cancel=cancel
+            ):
+                deltas.append(delta)
+                yield from segmenter.feed(delta)
+            yield from segmenter.flush()
+
+        try:
+            for index, (segment, wav, sr) in enumerate(
+                self.tts_engine.synthesize_stream(segments(), cancel=cancel)
+            ):
+                if is_cancelled(cancel):
+                    break
+                if index == 0:
+                    metrics.mark("tts_first_audio")
+                    logger.info("✓ First audio ready after %.2fs", time.time() - start_time)
+                synthesized.append((segment, wav, sr))
+                yield {
+                    "input_text": input_text,
+                    "segment": segment,
+                    "audio": wav,
+                    "sample_rate": sr,
+                    "index": index
+                }
+        except TurnCancelled:
+            pass
+        if is_cancelled(cancel):
+            logger.info("⏹️  Turn cancelled (%s)", cancel.reason)
+            return
+
+        # Chỉ lượt đã phát hết mới được lưu audio vào cache
+        metrics.mark("tts_done")
+        self.llm_engine.remember_audio(input_text, "".join(deltas), synthesized, audio_tag)
+        logger.info("✅ STREAMING PIPELINE COMPLETED in %.2fs", time.time() - start_time)
+
     def text_to_speech_only(self, text: str, output_path: Optional[str] = None) -> Path:
         """Chỉ chạy TTS"""
         return self.tts_engine.synthesize(text, output_path)
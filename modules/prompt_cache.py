@@ -0,0 +1,104 @@
+"""
+Prompt Cache cho giọng tham chiếu của ZipVoice
+Lưu fbank features + prompt tokens đã tính sẵn, trong RAM và (tuỳ chọn) file .npz
+"""
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PromptEntry:
+    """Kết quả tiền xử lý một cặp (ref_audio, prompt_text)"""
+    features: np.ndarray       # [T, feat_dim], đã nhân FEAT_SCALE
+    tokens: List[str]          # prompt tokens dạng chuỗi (chưa đổi sang id)
+    duration: float            # độ dài prompt wav (giây)
+    rms: float                 # RMS gốc của prompt wav
+    tensor: object = None      # features đã chuyển lên device, backend tự gán
+
+
+class PromptCache:
+    """Cache theo key (ref_audio path + mtime, prompt_text, tokenizer, lang)"""
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._memory: Dict[Tuple, PromptEntry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(ref_audio, prompt_text: str, tokenizer: str, lang: str) -> Tuple:
+        path = Path(ref_audio).resolve()
+        # mtime thay đổi khi file ref bị ghi đè -> key mới, entry cũ tự hết hiệu lực
+        return (str(path), path.stat().st_mtime_ns, prompt_text, tokenizer, lang)
+
+    def _disk_path(self, key: Tuple) -> Path:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{digest}.npz"
+
+    def _load_from_disk(self, key: Tuple) -> Optional[PromptEntry]:
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return PromptEntry(
+                    features=data["features"],
+                    tokens=data["tokens"].tolist(),
+                    duration=float(data["duration"]),
+                    rms=float(data["rms"]),
+                )
+        except Exception as e:
+            print(f"⚠️  Failed to load prompt cache {path.name}: {e}")
+            return None
+
+    def _save_to_disk(self, key: Tuple, entry: PromptEntry):
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix(".tmp.npz")
+        try:
+            np.savez(
+                tmp_path,
+                features=entry.features.astype(np.float32),
+                tokens=np.array(entry.tokens, dtype=str),
+                duration=np.float64(entry.duration),
+                rms=np.float64(entry.rms),
+            )
+            tmp_path.replace(path)
+        except Exception as e:
+            print(f"⚠️  Failed to save prompt cache {path.name}: {e}")
+
+    def get(self, key: Tuple, compute: Callable[[], PromptEntry]) -> PromptEntry:
+        """Trả về entry từ RAM -> đĩa -> tính mới (theo thứ tự)"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                return entry
+
+            if self.cache_dir:
+                entry = self._load_from_disk(key)
+                if entry is not None:
+                    logger.debug("Prompt cache hit on disk for %s", Path(key[0]).name)
+
+            if entry is None:
+                logger.debug("Prompt cache miss for %s, computing features", Path(key[0]).name)
+                entry = compute()
+                if self.cache_dir:
+                    self._save_to_disk(key, entry)
+
+            self._memory[key] = entry
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def __len__(self):
+        return len(self._memory)
@@ -0,0 +1,208 @@
+"""
+Dense-vector RAG: tìm kiếm ngữ nghĩa bằng embedding model ONNX chạy CPU, hoàn toàn offline
+Bắt được câu hỏi diễn đạt khác ("cộng" vs "thêm vào") mà BM25 bỏ sót.
+
+  - OnnxEmbedder: tokenizer.json + model.onnx (vd. multilingual-e5-small đã export)
+  - DenseRAG:     ma trận vector float16 (memory-mapped) cho các chunk của SimpleRAG,
+                  truy vấn = một phép nhân ma trận-vector + argpartition
+  - HybridRAG:    trộn điểm BM25 và cosine (đã chuẩn hoá) theo trọng số RAG_HYBRID_ALPHA
+"""
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from settings import llm_settings as cfg
+
+
+class OnnxEmbedder:
+    """Sentence embedding bằng onnxruntime: mean pooling + L2 normalize"""
+
+    def __init__(self, model_dir: Path = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_dir = Path(model_dir or cfg.EMBEDDING_MODEL_DIR)
+        model_path = self.model_dir / cfg.EMBEDDING_MODEL_FILE
+        if not model_path.exists():
+            raise FileNotFoundError(f"Embedding model not found: {model_path}")
+
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=cfg.EMBEDDING_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = cfg.EMBEDDING_NUM_THREADS
+        self.session = ort.InferenceSession(
+            str(model_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self.model_id = f"{self.model_dir.name}/{model_path.stat().st_mtime_ns}"
+
+    def embed(self, texts: List[str], prefix: str = "") -> np.ndarray:
+        """Trả về ma trận [len(texts), dim] float32 đã chuẩn hoá L2"""
+        vectors = []
+        for start in range(0, len(texts), cfg.EMBEDDING_BATCH_SIZE):
+            batch = [prefix + t for t in texts[start:start + cfg.EMBEDDING_BATCH_SIZE]]
+            encodings = self.tokenizer.encode_batch(batch)
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+            hidden = self.session.run(None, feeds)[0]  # [B, T, H]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            vectors.append(pooled.astype(np.float32))
+
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(vectors, axis=0)
+
+
+def _chunk_key(source: str, text: str) -> str:
+    return hashlib.sha1(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+
+class DenseRAG:
+    """
+    Vector store cho các chunk của một SimpleRAG.
+    Vector lưu ở cfg.RAG_EMBEDDING_PATH (float16 .npy, mở bằng mmap), kèm danh sách
+    hash của chunk để lần sau chỉ embed chunk mới/đã sửa.
+    """
+
+    def __init__(self, keyword_rag, embedder: OnnxEmbedder = None, vectors_path: Path = None):
+        self.keyword_rag = keyword_rag
+        self.embedder = embedder or OnnxEmbedder()
+        self.vectors_path = Path(vectors_path or cfg.RAG_EMBEDDING_PATH)
+        self.meta_path = self.vectors_path.with_suffix(".json")
+        self._matrix: Optional[np.ndarray] = None
+        self._synced_index = None
+        self._lock = threading.Lock()
+
+    def _load_store(self):
+        """Đọc vector đã lưu: trả về {chunk_key: row} và ma trận (mmap) hoặc (None, None)"""
+        if not self.vectors_path.exists() or not self.meta_path.exists():
+            return None, None
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model_id") != self.embedder.model_id:
+                print("  ⚠️  Embedding model changed, re-embedding all chunks")
+                return None, None
+            matrix = np.load(self.vectors_path, mmap_mode="r")
+            return {key: row for row, key in enumerate(meta["keys"])}, matrix
+        except Exception as e:
+            print(f"  ⚠️  Failed to read dense index: {e}")
+            return None, None
+
+    def _save_store(self, keys: List[str], matrix: np.ndarray):
+        self.vectors_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_vectors = self.vectors_path.with_suffix(".tmp.npy")
+        tmp_meta = self.meta_path.with_suffix(".tmp.json")
+        np.save(tmp_vectors, matrix)
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"model_id": self.embedder.model_id, "keys": keys}, f)
+        tmp_vectors.replace(self.vectors_path)
+        tmp_meta.replace(self.meta_path)
+
+    def _sync(self, index):
+        """Đảm bảo ma trận vector khớp (theo thứ tự chunk_id) với snapshot index của SimpleRAG"""
+        if self._synced_index is index:
+            return
+        with self._lock:
+            if self._synced_index is index:
+                return
+
+            keys = [_chunk_key(src, text) for src, text in index.chunks]
+            old_rows, old_matrix = self._load_store()
+            old_rows = old_rows or {}
+
+            missing = [i for i, key in enumerate(keys) if key not in old_rows]
+            if missing or old_matrix is None or len(old_rows) != len(keys):
+                print(f"📐 Embedding {len(missing)} new chunks ({len(keys)} total)...")
+                new_vectors = self.embedder.embed(
+                    [index.chunks[i][1] for i in missing], prefix=cfg.EMBEDDING_PASSAGE_PREFIX
+                )
+                dim = new_vectors.shape[1] if len(missing) else (old_matrix.shape[1] if old_matrix is not None else 0)
+                matrix = np.zeros((len(keys), dim), dtype=np.float16)
+                new_pos = {i: n for n, i in enumerate(missing)}
+                for i, key in enumerate(keys):
+                    if i in new_pos:
+                        matrix[i] = new_vectors[new_pos[i]]
+                    else:
+                        matrix[i] = old_matrix[old_rows[key]]
+                self._save_store(keys, matrix)
+                del old_matrix
+                matrix = np.load(self.vectors_path, mmap_mode="r")
+            else:
+                # Cùng tập chunk nhưng có thể khác thứ tự -> sắp lại theo chunk_id hiện tại
+                order = np.fromiter((old_rows[key] for key in keys), dtype=np.int64, count=len(keys))
+                matrix = old_matrix if np.array_equal(order, np.arange(len(keys))) else old_matrix[order]
+
+            self._matrix = matrix
+            self._synced_index = index
+
+    def score_chunks(self, query: str, index=None, top_n: int = None) -> Dict[int, float]:
+        """Cosine similarity của top_n chunk gần nhất: {chunk_id: score}"""
+        index = index or self.keyword_rag.index
+        if not index.chunks:
+            return {}
+        self._sync(index)
+
+        q = self.embedder.embed([query], prefix=cfg.EMBEDDING_QUERY_PREFIX)[0]
+        # Một phép nhân ma trận-vector trên toàn bộ chunk (float16 -> float32 khi tính)
+        scores = np.dot(self._matrix, q)
+        top_n = min(top_n or cfg.RAG_TOP_K, len(scores))
+        top = np.argpartition(-scores, top_n - 1)[:top_n]
+        return {int(i): float(scores[i]) for i in top}
+
+    def search(self, query: str, top_k: int = None) -> List[Dict[str, any]]:
+        """Cùng định dạng kết quả với SimpleRAG.search"""
+        self.keyword_rag.ensure_loaded()
+        index = self.keyword_rag.index
+        top_k = top_k or cfg.RAG_TOP_K
+        scores = self.score_chunks(query, index, top_k)
+        return self.keyword_rag.format_results(index, scores, top_k, min_score=cfg.RAG_DENSE_MIN_SCORE)
+
+
+class HybridRAG:
+    """Trộn BM25 và cosine: score = alpha * dense + (1 - alpha) * bm25 (min-max normalized)"""
+
+    def __init__(self, keyword_rag, dense_rag: DenseRAG = None, alpha: float = None):
+        self.keyword_rag = keyword_rag
+        self.dense_rag = dense_rag or DenseRAG(keyword_rag)
+        self.alpha = cfg.RAG_HYBRID_ALPHA if alpha is None else alpha
+
+    @staticmethod
+    def _normalize(scores: Dict[int, float]) -> Dict[int, float]:
+        if not scores:
+            return {}
+        lo, hi = min(scores.values()), max(scores.values())
+        if hi - lo < 1e-9:
+            return {k: 1.0 for k in scores}
+        return {k: (v - lo) / (hi - lo) for k, v in scores.items()}
+
+    def search(self, query: str, top_k: int = None) -> List[Dict[str, any]]:
+        self.keyword_rag.ensure_loaded()
+        index = self.keyword_rag.index
+        top_k = top_k or cfg.RAG_TOP_K
+        candidates = top_k * cfg.RAG_HYBRID_CANDIDATES
+
+        dense = self.dense_rag.score_chunks(query, index, candidates)
+        dense = {k: v for k, v in dense.items() if v >= cfg.RAG_DENSE_MIN_SCORE}
+        bm25 = self.keyword_rag.score_chunks(query, index)
+
+        dense_n = self._normalize(dense)
+        bm25_n = self._normalize(bm25)
+        fused = {
+            chunk_id: self.alpha * dense_n.get(chunk_id, 0.0) + (1.0 - self.alpha) * bm25_n.get(chunk_id, 0.0)
+            for chunk_id in set(dense_n) | set(bm25_n)
+        }
+        # Ứng viên thấp nhất của cả hai bên bị chuẩn hoá về 0 -> không đưa vào context
+        return self.keyword_rag.format_results(index, fused, top_k, min_score=1e-6)
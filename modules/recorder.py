@@ -0,0 +1,66 @@
+"""
+Audio Recorder: ghi câu nói của người dùng ra WAV ở thread nền
+Đường xử lý chính không bao giờ chờ ghi đĩa.
+"""
+import logging
+import os
+import queue
+import threading
+import wave
+from datetime import datetime
+from pathlib import Path
+
+from settings import server_settings as cfg
+
+logger = logging.getLogger(__name__)
+
+
+class AudioRecorder:
+    """Hàng đợi ghi WAV bất đồng bộ (side channel, tuỳ chọn qua cfg.RECORD_AUDIO)"""
+
+    def __init__(self, folder: Path = None, enabled: bool = None):
+        self.folder = Path(folder or cfg.RECORD_DIR)
+        self.enabled = cfg.RECORD_AUDIO if enabled is None else enabled
+        self._queue: queue.Queue = queue.Queue(maxsize=cfg.RECORD_QUEUE_SIZE)
+        self._thread = None
+        if self.enabled:
+            self._thread = threading.Thread(target=self._worker, name="audio-recorder", daemon=True)
+            self._thread.start()
+
+    def submit(self, pcm_bytes: bytes, prefix: str = "recording"):
+        """Đưa một câu nói (PCM int16) vào hàng đợi ghi; không chặn"""
+        if not self.enabled or not pcm_bytes:
+            return
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+        try:
+            self._queue.put_nowait((f"{prefix}_{timestamp}.wav", bytes(pcm_bytes)))
+        except queue.Full:
+            logger.warning("⚠️  Recorder queue full, dropping recording")
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            filename, pcm_bytes = item
+            self._write(filename, pcm_bytes)
+
+    def _write(self, filename: str, pcm_bytes: bytes):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.folder / filename
+        try:
+            with wave.open(str(path), 'wb') as wf:
+                wf.setnchannels(cfg.CHANNELS)
+                wf.setsampwidth(cfg.BIT_DEPTH_BYTES)
+                wf.setframerate(cfg.SAMPLE_RATE)
+                wf.writeframes(pcm_bytes)
+            logger.debug("Recording saved to %s", path)
+        except Exception as e:
+            logger.warning("⚠️  Error saving WAV file: %s", e)
+
+    def close(self):
+        """Ghi nốt các bản ghi đang chờ rồi dừng thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
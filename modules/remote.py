@@ -0,0 +1,169 @@
+"""
+Proxy phía front-end cho model server (MODEL_SERVERS = True), cùng interface với engine thật:
+  - RemoteSTTEngine / RemoteOnlineSTTSession  ~ STTEngine / OnlineSTTSession
+  - RemoteVADModel                            ~ InferenceSession Silero mà BatchedVAD gọi
+  - RemoteTTSBackend                          ~ ResidentBackend (TTSEngine, audio store vẫn ở front-end)
+  - RemoteChatHistory                         ~ ChatHistory (một bản lịch sử cho mọi worker)
+Không import torch, sherpa_onnx hay ZipVoice: front-end chỉ giữ websocket, Gemini và cache.
+"""
+import logging
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from settings import stt_settings as stt_cfg
+from .audio import resample, to_float32
+from .ipc import ClientPool
+from .resampler import Resampler
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteOnlineSTTSession:
+    """Stream STT online nằm ở model server; partial/endpoint được cập nhật sau mỗi accept_pcm"""
+
+    def __init__(self, pool: ClientPool):
+        self.pool = pool
+        self.stream_id = None  # Mở ở lần nạp đầu tiên (chạy trên STT executor, không chặn event loop)
+        self.num_samples = 0
+        self._partial = ""
+        self._endpoint = False
+        self._text = None
+        self._resampler = None
+
+    def _send(self, samples):
+        if self.stream_id is None:
+            self.stream_id, _ = self.pool.call("stream_open")
+        (self._partial, self._endpoint), _ = self.pool.call("stream_accept", self.stream_id, arrays=[samples])
+
+    def accept_pcm(self, pcm, sample_rate=None):
+        samples = to_float32(pcm)
+        if sample_rate and sample_rate != stt_cfg.SAMPLE_RATE:
+            if self._resampler is None:
+                self._resampler = Resampler(sample_rate, stt_cfg.SAMPLE_RATE)
+            samples = self._resampler.process(samples)
+        self._send(samples)
+        self.num_samples += len(samples)
+
+    @property
+    def partial(self) -> str:
+        return self._partial
+
+    def is_endpoint(self) -> bool:
+        return self._endpoint
+
+    def finish(self) -> str:
+        if self._text is None:
+            if self._resampler is not None:
+                tail = self._resampler.flush()
+                if len(tail):
+                    self._send(tail)
+            self._text = ""
+            if self.stream_id is not None:
+                self._text, _ = self.pool.call("stream_finish", self.stream_id)
+        return self._text
+
+
+class RemoteSTTEngine:
+    def __init__(self):
+        self.pool = ClientPool("stt")
+        info, _ = self.pool.call("hello")
+        self.mode = info["mode"]
+        self.recognizer = None
+        print(f"✅ STT model server connected ({self.mode})")
+
+    @property
+    def is_online(self) -> bool:
+        return self.mode == "online"
+
+    def create_session(self) -> RemoteOnlineSTTSession:
+        if not self.is_online:
+            raise RuntimeError("create_session() requires STT_MODE = 'online'")
+        return RemoteOnlineSTTSession(self.pool)
+
+    def transcribe_from_file(self, audio_path):
+        import soundfile as sf
+        wav, sr = sf.read(str(audio_path), dtype='float32')
+        return self.transcribe_array(wav, sr)
+
+    def transcribe_array(self, pcm, sample_rate=None):
+        sr = sample_rate or stt_cfg.SAMPLE_RATE
+        wav = to_float32(pcm)
+        if sr != stt_cfg.SAMPLE_RATE:
+            wav = resample(wav, sr, stt_cfg.SAMPLE_RATE)
+        text, _ = self.pool.call("transcribe", arrays=[wav])
+        return text
+
+    def transcribe_batch(self, pcms):
+        texts, _ = self.pool.call("transcribe_batch", arrays=[to_float32(pcm) for pcm in pcms])
+        return texts
+
+    def transcribe(self, audio_input_path):
+        return self.transcribe_from_file(audio_input_path)
+
+
+class RemoteVADModel:
+    """Thay InferenceSession của Silero: batch frame do BatchedVAD gom được chấm ở VAD server"""
+
+    def __init__(self):
+        self.pool = ClientPool("vad")
+        info, _ = self.pool.call("hello")
+        self._inputs = [SimpleNamespace(name=name) for name in info["inputs"]]
+        print("✅ Silero VAD model server connected")
+
+    def get_inputs(self):
+        return self._inputs
+
+    def run(self, output_names, feeds: Dict):
+        _, outputs = self.pool.call("run", int(feeds["sr"]), arrays=[feeds["input"], feeds["state"]])
+        return outputs
+
+
+class RemoteTTSBackend:
+    def __init__(self):
+        self.pool = ClientPool("tts")
+        info, _ = self.pool.call("hello")
+        self.sampling_rate = info["sampling_rate"]
+        self.checkpoint_id = info["checkpoint_id"]
+
+    def generate(self, text, ref_audio, prompt_text, cancel=None):
+        """Waveform float32; `cancel` được báo sang server qua cờ trong shared memory"""
+        sampling_rate, (wav,) = self.pool.call("generate", text, str(ref_audio), prompt_text, cancel=cancel)
+        self.sampling_rate = sampling_rate
+        return wav
+
+    def synthesize(self, text, output_path, ref_audio, prompt_text):
+        import soundfile as sf
+        wav = self.generate(text, ref_audio, prompt_text)
+        sf.write(str(output_path), wav, self.sampling_rate, subtype="PCM_16")
+        return output_path
+
+
+class RemoteChatHistory:
+    """Lịch sử nằm ở history server: mọi worker thấy cùng một cuộc hội thoại của thiết bị"""
+
+    def __init__(self):
+        self.pool = ClientPool("history")
+
+    def add(self, session_id: str, role: str, text: str):
+        self.pool.call("add", session_id, role, text)
+
+    def get_history(self, session_id: str) -> List[Dict]:
+        messages, _ = self.pool.call("get_history", session_id)
+        return messages
+
+    def clear(self, session_id: str):
+        self.pool.call("clear", session_id)
+
+    def release(self, session_id: str):
+        self.pool.call("release", session_id)
+
+    def flush(self, timeout: Optional[float] = None):
+        self.pool.call("flush", timeout)
+
+    def stats(self) -> dict:
+        stats, _ = self.pool.call("stats")
+        return stats
+
+    def close(self):
+        # Server giữ file log/index; ở đây chỉ đóng kết nối
+        self.pool.close()
@@ -0,0 +1,127 @@
+"""
+Resampler polyphase (windowed-sinc, cửa sổ Kaiser) cho mọi chỗ audio đổi sample rate:
+ZipVoice 24kHz -> 16kHz cho ESP32/audio store, file WAV bất kỳ -> 16kHz cho STT...
+
+  - Bộ lọc được thiết kế một lần cho mỗi cặp (src_rate, dst_rate) rồi cache lại
+  - Resampler: stateful, nạp từng chunk (nối tiếp không bị méo ở biên chunk), flush() lấy phần đuôi
+  - resample(): một lần cho cả buffer, kết quả thẳng hàng với input (đã bù độ trễ của bộ lọc)
+float32 vào / float32 ra; mỗi output là tích vô hướng của một cửa sổ (view, không copy) với một pha của bộ lọc.
+"""
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+ZERO_CROSSINGS = 16   # Nửa độ dài bộ lọc, tính theo chu kỳ của sample rate thấp hơn
+ROLLOFF = 0.945       # Tần số cắt = ROLLOFF * Nyquist của sample rate thấp hơn
+KAISER_BETA = 8.6     # ~ -80dB chặn dải (hết alias khi 24kHz -> 16kHz)
+
+
+@lru_cache(maxsize=32)
+def polyphase_filter(src_rate: int, dst_rate: int):
+    """
+    (up, down, phases, delay): phases[r] là pha r của bộ lọc thông thấp (đã đảo ngược, float32,
+    shape [up, taps]); delay là độ trễ của bộ lọc tính theo sample ở tần số src_rate * up.
+    """
+    g = gcd(int(src_rate), int(dst_rate))
+    up, down = int(dst_rate) // g, int(src_rate) // g
+    factor = max(up, down)
+    half = ZERO_CROSSINGS * factor
+    n = np.arange(-half, half + 1, dtype=np.float64)
+    cutoff = ROLLOFF / factor  # Chuẩn hoá theo Nyquist của tần số đã upsample
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(len(n), KAISER_BETA) * up
+
+    taps = -(-len(h) // up)
+    padded = np.zeros(taps * up)
+    padded[:len(h)] = h
+    # phases[r][j] = h[r + up * j]; đảo ngược để nhân thẳng với cửa sổ input theo thứ tự thời gian
+    phases = np.ascontiguousarray(padded.reshape(taps, up).T[:, ::-1], dtype=np.float32)
+    phases.setflags(write=False)
+    return up, down, phases, half
+
+
+class Resampler:
+    """Resample stateful: nạp chunk bằng process(), cuối stream gọi flush()"""
+
+    def __init__(self, src_rate: int, dst_rate: int):
+        self.src_rate, self.dst_rate = int(src_rate), int(dst_rate)
+        self.up, self.down, self.phases, self.delay = polyphase_filter(self.src_rate, self.dst_rate)
+        self.taps = self.phases.shape[1]
+        self.reset()
+
+    def reset(self):
+        # Lịch sử input: taps - 1 sample 0 đứng trước sample đầu tiên
+        self._buf = np.zeros(self.taps - 1, dtype=np.float32)
+        self._buf_start = -(self.taps - 1)   # Chỉ số tuyệt đối của _buf[0]
+        self._consumed = 0                   # Tổng số sample input đã nạp
+        self._produced = 0                   # Tổng số sample output đã trả
+
+    def _source_index(self, k):
+        """Output k lấy input tới chỉ số q (tuyệt đối) với pha r"""
+        u = k * self.down + self.delay
+        return u // self.up, u % self.up
+
+    def _run(self, stop: int) -> np.ndarray:
+        """Tính output [_produced, stop) từ _buf"""
+        count = stop - self._produced
+        out = np.empty(max(count, 0), dtype=np.float32)
+        if count <= 0:
+            return out
+        windows = sliding_window_view(self._buf, self.taps)
+        for c in range(min(self.up, count)):
+            k = self._produced + c
+            q, r = self._source_index(k)
+            # Các output k, k + up, k + 2*up... cùng pha r, input tiến thêm `down` sample mỗi bước
+            start = q - self.taps + 1 - self._buf_start
+            n = len(range(c, count, self.up))
+            np.matmul(windows[start:start + (n - 1) * self.down + 1:self.down], self.phases[r], out=out[c::self.up])
+        self._produced = stop
+        return out
+
+    def _trim(self):
+        """Bỏ phần input không còn output nào cần tới"""
+        q, _ = self._source_index(self._produced)
+        keep_from = q - self.taps + 1
+        if keep_from > self._buf_start:
+            self._buf = self._buf[keep_from - self._buf_start:]
+            self._buf_start = keep_from
+
+    def process(self, chunk) -> np.ndarray:
+        """Nạp chunk float32; trả về mọi output đã đủ input để tính"""
+        if self.src_rate == self.dst_rate:
+            return np.asarray(chunk, dtype=np.float32)
+        chunk = np.asarray(chunk, dtype=np.float32)
+        self._buf = np.concatenate([self._buf, chunk])
+        self._consumed += len(chunk)
+        # Output k tính được khi q_k <= chỉ số input cuối cùng đã có
+        last = self._consumed - 1
+        stop = max(0, ((last + 1) * self.up - self.delay - 1) // self.down + 1) if last >= 0 else 0
+        out = self._run(max(stop, self._produced))
+        self._trim()
+        return out
+
+    def flush(self) -> np.ndarray:
+        """Đệm 0 sau sample cuối để lấy nốt phần đuôi; tổng output = ceil(input * dst / src)"""
+        if self.src_rate == self.dst_rate:
+            return np.zeros(0, dtype=np.float32)
+        total = -(-self._consumed * self.up // self.down)
+        if total <= self._produced:
+            return np.zeros(0, dtype=np.float32)
+        q, _ = self._source_index(total - 1)
+        missing = q + 1 - (self._buf_start + len(self._buf))
+        if missing > 0:
+            self._buf = np.concatenate([self._buf, np.zeros(missing, dtype=np.float32)])
+        out = self._run(total)
+        self.reset()
+        return out
+
+
+def resample(wav: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """Resample cả buffer float32 một lần; len(output) = ceil(len(wav) * dst_rate / src_rate)"""
+    if src_rate == dst_rate or len(wav) == 0:
+        return wav
+    resampler = Resampler(src_rate, dst_rate)
+    head = resampler.process(wav)
+    tail = resampler.flush()
+    return np.concatenate([head, tail]) if len(head) else tail
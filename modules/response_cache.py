@@ -0,0 +1,354 @@
+"""
+Response Cache: trả lời ngay các câu hỏi lặp lại ("1 cộng 1 bằng mấy?")
+mà không gọi lại Gemini và không tổng hợp lại ZipVoice.
+
+  - Key: transcript đã chuẩn hoá (chữ thường, bỏ dấu câu, bỏ từ đệm "ơi", "ạ"...)
+  - Khớp gần đúng (tuỳ chọn): Jaccard giữa tập từ, số/số đếm phải giống hệt
+  - Lưu câu trả lời + PCM int16 của từng đoạn TTS, LRU + TTL + giới hạn bytes
+  - Mỗi entry là một file .npz trong RESPONSE_CACHE_DIR, ghi ở thread nền
+  - Lượt phụ thuộc ngữ cảnh hội thoại ("còn cái kia thì sao?") không dùng cache
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from settings import llm_settings as cfg
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Số đếm tiếng Việt: "một cộng hai" khác "hai cộng một", không được khớp gần đúng
+NUMBER_WORDS = {
+    "không", "một", "mốt", "hai", "ba", "bốn", "tư", "năm", "lăm", "sáu", "bảy",
+    "tám", "chín", "mười", "mươi", "trăm", "nghìn", "ngàn", "triệu", "linh", "lẻ",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Chữ thường, Unicode NFC, chỉ giữ các từ (bỏ dấu câu)"""
+    text = unicodedata.normalize("NFC", text).lower()
+    return _TOKEN_RE.findall(text)
+
+
+def normalize_text(text: str) -> str:
+    """Key của cache: các từ nội dung, bỏ từ đệm ở cuối/đầu câu"""
+    return " ".join(t for t in tokenize(text) if t not in cfg.RESPONSE_CACHE_FILLER_WORDS)
+
+
+def _number_signature(tokens: List[str]) -> Tuple[str, ...]:
+    return tuple(t for t in tokens if t.isdigit() or t in NUMBER_WORDS)
+
+
+@dataclass
+class CachedResponse:
+    """Một câu trả lời đã lưu; audio (nếu có) là PCM int16 nối liền các đoạn TTS"""
+    key: str
+    reply: str
+    created: float
+    segments: List[str] = field(default_factory=list)
+    audio: Optional[np.ndarray] = None
+    offsets: Optional[np.ndarray] = None  # [len(segments) + 1] ranh giới từng đoạn trong audio
+    sample_rate: int = 0
+    audio_tag: str = ""
+
+    @property
+    def nbytes(self) -> int:
+        size = len(self.reply.encode("utf-8")) + len(self.key.encode("utf-8"))
+        if self.audio is not None:
+            size += self.audio.nbytes
+        return size
+
+    def has_audio(self, audio_tag: str) -> bool:
+        """True nếu audio được tổng hợp bằng đúng giọng/model hiện tại"""
+        return self.audio is not None and self.audio_tag == audio_tag
+
+    def iter_segments(self) -> Iterator[Tuple[str, np.ndarray, int]]:
+        """Yield (segment, waveform float32, sample_rate) như TTSEngine.synthesize_stream"""
+        for i, segment in enumerate(self.segments):
+            pcm = self.audio[self.offsets[i]:self.offsets[i + 1]]
+            yield segment, pcm.astype(np.float32) / 32768.0, self.sample_rate
+
+    def full_audio(self) -> Tuple[np.ndarray, int]:
+        return self.audio.astype(np.float32) / 32768.0, self.sample_rate
+
+
+class ResponseCache:
+    """
+    LRU cache (OrderedDict, cuối = dùng gần nhất) có TTL và giới hạn tổng bytes.
+    `namespace` (model, prompt...) đổi thì các entry cũ trên đĩa bị bỏ qua.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        namespace: str = "",
+        max_bytes: int = None,
+        max_entries: int = None,
+        ttl: Optional[float] = None,
+        fuzzy_threshold: Optional[float] = None
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.namespace = namespace
+        self.max_bytes = max_bytes or cfg.RESPONSE_CACHE_MAX_BYTES
+        self.max_entries = max_entries or cfg.RESPONSE_CACHE_MAX_ENTRIES
+        self.ttl = cfg.RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.fuzzy_threshold = (
+            cfg.RESPONSE_CACHE_FUZZY_THRESHOLD if fuzzy_threshold is None else fuzzy_threshold
+        )
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        # Chỉ mục cho khớp gần đúng: chữ ký số -> các key
+        self._by_numbers: Dict[Tuple[str, ...], Set[str]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._writer = None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache")
+            self._load()
+
+    # ----- Ngữ cảnh hội thoại -----
+
+    def has_recent_context(self, history: List[Dict]) -> bool:
+        """History còn "nóng": câu trả lời của Gemini có thể đã dựa vào các lượt trước"""
+        if not history:
+            return False
+        return time.time() - history[-1].get("timestamp", 0) < cfg.RESPONSE_CACHE_CONTEXT_WINDOW
+
+    def is_context_dependent(self, text: str, history: List[Dict]) -> bool:
+        """Câu quá ngắn ("ừ", "có") hoặc nhắc tới lượt trước ("còn cái đó?") khi history còn nóng"""
+        tokens = tokenize(text)
+        content = [t for t in tokens if t not in cfg.RESPONSE_CACHE_FILLER_WORDS]
+        if len(content) < cfg.RESPONSE_CACHE_MIN_WORDS:
+            return True
+        if self.has_recent_context(history):
+            return any(t in cfg.RESPONSE_CACHE_CONTEXT_WORDS for t in tokens)
+        return False
+
+    # ----- Tra cứu -----
+
+    def _expired(self, entry: CachedResponse, now: float) -> bool:
+        return self.ttl is not None and now - entry.created > self.ttl
+
+    def _find(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None or not self.fuzzy_threshold:
+            return entry
+
+        tokens = key.split()
+        words = set(tokens)
+        best, best_score = None, self.fuzzy_threshold
+        for candidate in self._by_numbers.get(_number_signature(tokens), ()):
+            other = set(candidate.split())
+            score = len(words & other) / len(words | other)
+            if score >= best_score:
+                best, best_score = self._entries[candidate], score
+        return best
+
+    def get(self, text: str) -> Optional[CachedResponse]:
+        key = normalize_text(text)
+        if not key:
+            return None
+        with self._lock:
+            entry = self._find(key)
+            if entry is not None and self._expired(entry, time.time()):
+                self._remove(entry.key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry.key)
+            self.hits += 1
+        self._touch(entry.key)
+        return entry
+
+    # ----- Ghi -----
+
+    def put_reply(self, text: str, reply: str):
+        """Lưu câu trả lời text (audio được gắn sau bằng attach_audio)"""
+        key = normalize_text(text)
+        if not key or not reply.strip():
+            return
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None and old.reply == reply:
+                return
+            entry = CachedResponse(key=key, reply=reply, created=time.time())
+            self._insert(entry)
+        self._persist(entry)
+
+    def attach_audio(
+        self,
+        text: str,
+        reply: str,
+        segments: List[Tuple[str, np.ndarray, int]],
+        audio_tag: str
+    ):
+        """
+        Gắn audio đã tổng hợp (list (segment, waveform float32, sr)) vào entry của `text`.
+        Bỏ qua nếu entry không tồn tại (lượt không được cache) hoặc reply đã khác.
+        """
+        if not segments:
+            return
+        key = normalize_text(text)
+        with self._lock:
+            entry = self._find(key) if key else None
+            if entry is None or entry.reply != reply or entry.has_audio(audio_tag):
+                return
+
+            sample_rate = segments[0][2]
+            if any(sr != sample_rate for _, _, sr in segments):
+                return
+            pcms = [
+                (np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0) * 32767).astype(np.int16)
+                for _, wav, _ in segments
+            ]
+            updated = CachedResponse(
+                key=entry.key,
+                reply=entry.reply,
+                created=entry.created,
+                segments=[segment for segment, _, _ in segments],
+                audio=np.concatenate(pcms),
+                offsets=np.cumsum([0] + [len(p) for p in pcms]).astype(np.int64),
+                sample_rate=sample_rate,
+                audio_tag=audio_tag,
+            )
+            self._insert(updated)
+        self._persist(updated)
+
+    def _insert(self, entry: CachedResponse):
+        """Thêm/thay entry rồi evict LRU cho tới khi nằm trong giới hạn (gọi khi đang giữ lock)"""
+        if entry.key in self._entries:
+            self._remove(entry.key, delete_file=False)
+        self._entries[entry.key] = entry
+        self._by_numbers.setdefault(_number_signature(entry.key.split()), set()).add(entry.key)
+        self._bytes += entry.nbytes
+
+        while self._entries and (
+            self._bytes > self.max_bytes or len(self._entries) > self.max_entries
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: str, delete_file: bool = True):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.nbytes
+        signature = _number_signature(key.split())
+        keys = self._by_numbers.get(signature)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_numbers[signature]
+        if delete_file and self._writer is not None:
+            self._writer.submit(self._delete_file, key)
+
+    # ----- Lưu đĩa (thread nền) -----
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.npz"
+
+    def _persist(self, entry: CachedResponse):
+        if self._writer is not None:
+            self._writer.submit(self._write_file, entry)
+
+    def _write_file(self, entry: CachedResponse):
+        path = self._disk_path(entry.key)
+        meta = {
+            "namespace": self.namespace,
+            "key": entry.key,
+            "reply": entry.reply,
+            "created": entry.created,
+            "segments": entry.segments,
+            "sample_rate": entry.sample_rate,
+            "audio_tag": entry.audio_tag,
+        }
+        arrays = {"meta": np.array(json.dumps(meta, ensure_ascii=False))}
+        if entry.audio is not None:
+            arrays["audio"] = entry.audio
+            arrays["offsets"] = entry.offsets
+        tmp_path = path.with_suffix(".tmp.npz")
+        try:
+            np.savez(tmp_path, **arrays)
+            tmp_path.replace(path)
+        except Exception as e:
+            print(f"⚠️  Failed to save response cache entry: {e}")
+
+    def _delete_file(self, key: str):
+        try:
+            self._disk_path(key).unlink(missing_ok=True)
+        except Exception as e:
+            print(f"⚠️  Failed to delete response cache entry: {e}")
+
+    def _touch(self, key: str):
+        # mtime của file = lần dùng gần nhất, để khôi phục thứ tự LRU khi khởi động lại
+        if self._writer is not None:
+            self._writer.submit(self._touch_file, key)
+
+    def _touch_file(self, key: str):
+        try:
+            os.utime(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _load(self):
+        files = sorted(self.cache_dir.glob("*.npz"), key=lambda p: p.stat().st_mtime)
+        now = time.time()
+        loaded = 0
+        for path in files:
+            if path.name.endswith(".tmp.npz"):
+                path.unlink(missing_ok=True)
+                continue
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    meta = json.loads(str(data["meta"]))
+                    entry = CachedResponse(
+                        key=meta["key"],
+                        reply=meta["reply"],
+                        created=meta["created"],
+                        segments=meta["segments"],
+                        audio=data["audio"] if "audio" in data else None,
+                        offsets=data["offsets"] if "offsets" in data else None,
+                        sample_rate=meta["sample_rate"],
+                        audio_tag=meta["audio_tag"],
+                    )
+            except Exception as e:
+                print(f"⚠️  Failed to load response cache {path.name}: {e}")
+                continue
+            if meta["namespace"] != self.namespace or self._expired(entry, now):
+                path.unlink(missing_ok=True)
+                continue
+            # File cũ nhất nạp trước -> cuối OrderedDict là entry dùng gần nhất
+            self._insert(entry)
+            loaded += 1
+        if loaded:
+            print(f"  ✓ Response cache: {len(self._entries)} entries ({self._bytes / 1e6:.1f} MB)")
+
+    def stats(self) -> dict:
+        return {
+            "response_cache_entries": len(self._entries),
+            "response_cache_bytes": self._bytes,
+            "response_cache_hits": self.hits,
+            "response_cache_misses": self.misses,
+        }
+
+    def close(self):
+        """Chờ ghi xong các entry đang chờ"""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,124 @@
+"""
+Sentence Segmenter cho streaming TTS
+Cắt câu trả lời thành các câu/mệnh đề (nhận biết dấu câu tiếng Việt)
+để tổng hợp và gửi từng đoạn ngay khi sẵn sàng.
+"""
+import re
+from typing import List
+
+from settings import tts_settings as cfg
+
+# Dấu kết thúc câu và dấu ngắt mệnh đề
+SENTENCE_END = ".!?…"
+CLAUSE_END = ",;:"
+# Ký tự có thể đứng ngay sau dấu câu mà vẫn thuộc câu trước: ngoặc, nháy, emoji...
+TRAILING = "\"'”’)]}»"
+
+# Viết tắt hay gặp, không coi dấu chấm sau chúng là hết câu
+ABBREVIATIONS = {"v.v", "tp", "tr", "ths", "ts", "pgs", "gs", "bs", "ông", "bà", "st", "vd"}
+
+_WS_RE = re.compile(r"\s+")
+
+
+class SentenceSegmenter:
+    """
+    Segmenter tăng dần: feed() từng mẩu text (vd. delta từ LLM streaming),
+    nhận lại các đoạn đã hoàn chỉnh; flush() để lấy phần còn lại.
+
+    - Luôn cắt ở dấu kết thúc câu (nếu đoạn đủ dài >= min_chars)
+    - Cắt ở dấu phẩy/chấm phẩy khi đoạn đã dài hơn clause_chars
+      (đoạn đầu tiên dùng first_clause_chars nhỏ hơn để giảm time-to-first-audio)
+    - Cắt cứng ở khoảng trắng khi vượt max_chars
+    """
+
+    def __init__(
+        self,
+        min_chars: int = None,
+        clause_chars: int = None,
+        first_clause_chars: int = None,
+        max_chars: int = None
+    ):
+        self.min_chars = min_chars or cfg.SEGMENT_MIN_CHARS
+        self.clause_chars = clause_chars or cfg.SEGMENT_CLAUSE_CHARS
+        self.first_clause_chars = first_clause_chars or cfg.SEGMENT_FIRST_CLAUSE_CHARS
+        self.max_chars = max_chars or cfg.SEGMENT_MAX_CHARS
+        self._buffer = ""
+        self._emitted = 0
+
+    def _is_abbreviation(self, text: str, dot_index: int) -> bool:
+        start = dot_index
+        while start > 0 and not text[start - 1].isspace():
+            start -= 1
+        word = text[start:dot_index].lower()
+        return word in ABBREVIATIONS
+
+    def _find_cut(self, text: str, final: bool) -> int:
+        """Trả về vị trí cắt (exclusive) hoặc -1 nếu chưa có đoạn hoàn chỉnh"""
+        clause_limit = self.first_clause_chars if self._emitted == 0 else self.clause_chars
+        n = len(text)
+        i = 0
+        while i < n:
+            ch = text[i]
+            if ch in SENTENCE_END or ch in CLAUSE_END or ch == "\n":
+                # Gom cả chuỗi dấu câu liền nhau ("...", "?!") và ngoặc/nháy đóng
+                j = i + 1
+                while j < n and (text[j] in SENTENCE_END or text[j] in TRAILING):
+                    j += 1
+                if j >= n and not final:
+                    # Dấu câu ở cuối buffer: chưa biết có phải "3.5" hay "v.v." không
+                    return -1
+                followed_by_space = j >= n or text[j].isspace()
+                length = len(text[:j].strip())
+                if followed_by_space:
+                    if ch == "\n" and length > 0:
+                        return j
+                    if ch in SENTENCE_END:
+                        if ch == "." and self._is_abbreviation(text, i):
+                            pass
+                        elif length >= self.min_chars:
+                            return j
+                    elif ch in CLAUSE_END and length >= clause_limit:
+                        return j
+                i = j
+                continue
+            i += 1
+
+        if len(text) > self.max_chars:
+            # Không có dấu câu phù hợp: cắt ở khoảng trắng gần max_chars nhất
+            space = text.rfind(" ", 0, self.max_chars)
+            return space if space > 0 else self.max_chars
+        return -1
+
+    def feed(self, delta: str) -> List[str]:
+        """Thêm text, trả về các đoạn đã hoàn chỉnh"""
+        self._buffer += delta
+        return self._drain(final=False)
+
+    def flush(self) -> List[str]:
+        """Trả về tất cả phần còn lại (gọi khi đã nhận hết text)"""
+        segments = self._drain(final=True)
+        tail = _WS_RE.sub(" ", self._buffer).strip()
+        self._buffer = ""
+        if tail:
+            segments.append(tail)
+            self._emitted += 1
+        return segments
+
+    def _drain(self, final: bool) -> List[str]:
+        segments = []
+        while True:
+            cut = self._find_cut(self._buffer, final)
+            if cut < 0:
+                break
+            segment = _WS_RE.sub(" ", self._buffer[:cut]).strip()
+            self._buffer = self._buffer[cut:]
+            if segment and any(c.isalnum() for c in segment):
+                segments.append(segment)
+                self._emitted += 1
+        return segments
+
+
+def split_sentences(text: str) -> List[str]:
+    """Cắt toàn bộ một câu trả lời thành các đoạn cho TTS"""
+    segmenter = SentenceSegmenter()
+    return segmenter.feed(text) + segmenter.flush()
@@ -0,0 +1,259 @@
+"""
+Session theo thiết bị: mỗi ESP32 (device ID) có một DeviceSession sống qua các lần kết nối lại
+  - Định danh: query param ?device=<id> hoặc tin nhắn text đầu tiên "HELLO <id>";
+    không có thì dùng host:port của kết nối (mỗi kết nối một session riêng, như trước)
+  - DeviceSession giữ trạng thái VAD, STT online và lượt đang trả lời (task + CancelToken)
+    của thiết bị; lịch sử hội thoại nằm trong ChatHistory với session_id = device ID
+  - Thiết bị kết nối lại khi kết nối cũ chưa đóng hẳn: kết nối mới thay thế kết nối cũ
+  - Session đã ngắt kết nối quá SESSION_IDLE_TIMEOUT giây bị dọn bởi timer nền
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from settings import server_settings as cfg
+from .cancel import CancelToken, SpeculativeToken
+
+logger = logging.getLogger(__name__)
+
+DEVICE_ID_PATTERN = re.compile(r"[A-Za-z0-9_.:\-]{1,64}")
+HELLO = "HELLO"
+
+
+def valid_device_id(value: Optional[str]) -> Optional[str]:
+    """Device ID hợp lệ (chữ, số, _ . : -; tối đa 64 ký tự) hoặc None"""
+    value = (value or "").strip()
+    return value if DEVICE_ID_PATTERN.fullmatch(value) else None
+
+
+class DeviceSession:
+    """Trạng thái của một thiết bị; chỉ vòng nhận của kết nối hiện tại (websocket) được sửa nó"""
+
+    def __init__(self, device_id: str, identified: bool = True):
+        self.device_id = device_id
+        self.identified = identified  # False: ID tạm (host:port), không sống qua lần kết nối lại
+        self.last_seen = time.monotonic()
+        self.websocket = None
+        self.connections = 0
+        self.turns = 0
+        # VADSession của kết nối hiện tại (ring buffer vài MB), tạo khi cần, thả khi ngắt kết nối
+        self.vad = None
+        # Lượt đang trả lời chạy song song với vòng nhận, để VAD vẫn nghe được barge-in
+        self.turn: Optional[asyncio.Task] = None
+        self.turn_cancel: Optional[CancelToken] = None
+        self.reset_utterance()
+
+    @property
+    def session_id(self) -> str:
+        """Khoá của lịch sử hội thoại, response cache, trace"""
+        return self.device_id
+
+    @property
+    def connected(self) -> bool:
+        return self.websocket is not None
+
+    @property
+    def file_tag(self) -> str:
+        """Device ID an toàn cho tên file (vd. bản ghi audio)"""
+        return re.sub(r"[^A-Za-z0-9_-]", "-", self.device_id)
+
+    def owned_by(self, websocket) -> bool:
+        """False nếu kết nối này đã bị một kết nối mới của cùng thiết bị thay thế"""
+        return self.websocket is websocket
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def reset_utterance(self):
+        """Bỏ trạng thái của câu đang nói dở"""
+        self.stt_session = None
+        self.stt_fed = 0         # Vị trí (sample) trong ring buffer đã nạp cho stt_session
+        self.last_partial = ""
+        self.speech_onset = 0    # Vị trí VAD bắt đầu nhận ra tiếng nói của câu hiện tại
+
+    def start_turn(self, respond: Callable[[CancelToken], Awaitable], speculative: bool = False) -> asyncio.Task:
+        """Chạy respond(cancel) thành task của lượt mới; `speculative`: cancel là SpeculativeToken"""
+        self.turn_cancel = SpeculativeToken() if speculative else CancelToken()
+        self.turn = asyncio.create_task(respond(self.turn_cancel))
+        if not speculative:
+            self.turns += 1
+        return self.turn
+
+    @property
+    def speculating(self) -> bool:
+        """Lượt đang chạy là lượt speculative chưa được commit (người dùng có thể còn nói tiếp)"""
+        return isinstance(self.turn_cancel, SpeculativeToken) and self.turn_cancel.pending
+
+    def commit_turn(self):
+        """VAD xác nhận hết câu: lượt speculative thành lượt thật"""
+        if self.speculating:
+            self.turn_cancel.commit()
+            self.turns += 1
+
+    def pop_finished_turn(self) -> Optional[bool]:
+        """Lượt đã xong thì dọn handle và trả về client còn kết nối không; chưa xong / không có -> None"""
+        if self.turn is None or not self.turn.done():
+            return None
+        turn = self.turn
+        self.turn = self.turn_cancel = None
+        return not turn.cancelled() and turn.result()
+
+    async def cancel_turn(self, reason: str):
+        if self.turn is None:
+            return
+        turn, cancel = self.turn, self.turn_cancel
+        self.turn = self.turn_cancel = None
+        cancel.cancel(reason)
+        turn.cancel()
+        await asyncio.wait([turn])
+
+    def release(self):
+        """Thả trạng thái audio của kết nối (ring buffer VAD, stream STT)"""
+        self.vad = None
+        self.reset_utterance()
+
+
+class SessionManager:
+    """
+    device ID -> DeviceSession.
+    Session đã ngắt kết nối được giữ SESSION_IDLE_TIMEOUT giây (thiết bị mất Wi-Fi rồi kết nối lại
+    vẫn tiếp tục cuộc hội thoại), sau đó bị dọn; `on_evict(session_id)` để thả các trạng thái
+    khác theo session (vd. lịch sử trong RAM). Hook chạy trên thread (có thể là round trip
+    tới model server), không trên event loop.
+    """
+
+    def __init__(
+        self,
+        on_evict: Callable[[str], None] = None,
+        idle_timeout: float = None,
+        sweep_interval: float = None,
+        max_sessions: int = None
+    ):
+        self.on_evict = on_evict
+        self.idle_timeout = cfg.SESSION_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.sweep_interval = sweep_interval or cfg.SESSION_SWEEP_INTERVAL
+        self.max_sessions = max_sessions or cfg.MAX_SESSIONS
+        self._sessions: Dict[str, DeviceSession] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        self.evicted = 0
+        self.takeovers = 0
+
+    def get(self, device_id: str) -> Optional[DeviceSession]:
+        return self._sessions.get(device_id)
+
+    async def identify(self, websocket) -> Tuple[str, bool, Optional[dict]]:
+        """
+        (device_id, identified, message): ID từ query param hoặc handshake "HELLO <id>".
+        Client cũ gửi audio ngay thì message đầu tiên đó được trả lại để vòng nhận xử lý.
+        """
+        device_id = valid_device_id(websocket.query_params.get(cfg.SESSION_QUERY_PARAM))
+        if device_id is not None:
+            return device_id, True, None
+        fallback = f"{websocket.client.host}:{websocket.client.port}"
+        message = await websocket.receive()
+        text = message.get("text")
+        if text is None or not text.startswith(HELLO):
+            return fallback, False, message
+        device_id = valid_device_id(text[len(HELLO):])
+        if device_id is None:
+            logger.warning("Invalid device handshake %r, using %s", text, fallback)
+            return fallback, False, None
+        return device_id, True, None
+
+    async def attach(self, device_id: str, websocket, identified: bool = True) -> DeviceSession:
+        """Gắn kết nối vào session của thiết bị (tạo mới nếu chưa có)"""
+        self._ensure_reaper()
+        session = self._sessions.get(device_id)
+        if session is None:
+            session = self._sessions[device_id] = DeviceSession(device_id, identified)
+            self._enforce_limit()
+        elif session.websocket is not None:
+            # Kết nối cũ chưa đóng hẳn (thiết bị reset, mất Wi-Fi): kết nối mới thắng
+            self.takeovers += 1
+            old = session.websocket
+            session.websocket = None
+            logger.info("🔁 Device %s reconnected, closing previous connection", device_id)
+            await session.cancel_turn("reconnected")
+            try:
+                await old.close(code=1000, reason="superseded")
+            except Exception:
+                pass
+        session.release()
+        session.websocket = websocket
+        session.connections += 1
+        session.touch()
+        return session
+
+    async def detach(self, session: DeviceSession, websocket):
+        """Kết nối đóng: huỷ lượt đang chạy, thả trạng thái audio; lịch sử giữ tới khi session bị dọn"""
+        if not session.owned_by(websocket):
+            return
+        # Client đi rồi thì không cần tổng hợp tiếp câu trả lời cho nó
+        await session.cancel_turn("client disconnected")
+        session.websocket = None
+        session.release()
+        session.touch()
+        if not session.identified:
+            # ID tạm không bao giờ được dùng lại
+            self._evict(session)
+
+    def sweep(self, now: float = None) -> int:
+        """Dọn các session đã ngắt kết nối quá idle_timeout; trả về số session bị dọn"""
+        now = time.monotonic() if now is None else now
+        idle = [
+            s for s in self._sessions.values()
+            if not s.connected and now - s.last_seen > self.idle_timeout
+        ]
+        for session in idle:
+            self._evict(session)
+        if idle:
+            logger.info("🧹 Evicted %d idle sessions (%d left)", len(idle), len(self._sessions))
+        return len(idle)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "sessions_connected": sum(1 for s in self._sessions.values() if s.connected),
+            "sessions_evicted": self.evicted,
+            "sessions_takeovers": self.takeovers,
+        }
+
+    def _enforce_limit(self):
+        """Quá max_sessions: dọn sớm các session ngắt kết nối lâu nhất"""
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        idle = sorted((s for s in self._sessions.values() if not s.connected), key=lambda s: s.last_seen)
+        for session in idle[:excess]:
+            self._evict(session)
+
+    def _evict(self, session: DeviceSession):
+        if self._sessions.get(session.device_id) is not session:
+            return
+        del self._sessions[session.device_id]
+        session.release()
+        self.evicted += 1
+        if self.on_evict is not None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._run_evict_hook(session)
+            else:
+                loop.run_in_executor(None, self._run_evict_hook, session)
+
+    def _run_evict_hook(self, session: DeviceSession):
+        try:
+            self.on_evict(session.session_id)
+        except Exception as e:
+            logger.warning("Session evict hook failed for %s: %s", session.device_id, e)
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap())
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
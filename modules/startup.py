@@ -0,0 +1,157 @@
+"""
+Khởi động server: nạp các thành phần độc lập (STT, LLM, TTS, VAD...) song song
+
+  - Startup.add(name, fn, after=(...)): fn() nạp một thành phần; `after` là các thành phần phải xong trước
+  - start(): nạp trên thread nền, server nhận kết nối ngay (GET /ready trả 503 tới khi nạp xong)
+  - run():   start() rồi chờ xong, cho script/CLI (lỗi của thành phần được raise lại)
+
+onnxruntime, sherpa-onnx và torch nhả GIL khi đọc/khởi tạo model nên các thread chạy song song thật.
+Thời gian từ lúc process được tạo tới lúc sẵn sàng (cold start) được log, có trong /ready và /metrics.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from settings import server_settings as cfg
+
+logger = logging.getLogger(__name__)
+
+_IMPORTED = time.monotonic()
+
+
+def process_age() -> float:
+    """Số giây kể từ lúc process được tạo (Linux, /proc); nơi khác tính từ lúc import module này"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Trường 22 (starttime, tính bằng clock tick từ lúc boot); tên process có thể chứa dấu cách
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED
+
+
+class Startup:
+    """Đồ thị nạp các thành phần: thành phần nào đủ điều kiện thì chạy ngay trên thread pool"""
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or cfg.STARTUP_WORKERS
+        self._steps: Dict[str, Tuple[Callable[[], object], Tuple[str, ...]]] = {}
+        self.state: Dict[str, str] = {}        # pending | loading | ready | failed
+        self.durations: Dict[str, float] = {}
+        self.errors: Dict[str, BaseException] = {}
+        self.ready_after: Optional[float] = None  # Cold start: giây từ lúc tạo process tới lúc sẵn sàng
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, name: str, fn: Callable[[], object], after: Sequence[str] = ()):
+        if self._thread is not None:
+            raise RuntimeError("Startup already started")
+        self._steps[name] = (fn, tuple(after))
+        self.state[name] = "pending"
+
+    def start(self) -> "Startup":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="startup", daemon=True)
+            self._thread.start()
+        return self
+
+    def run(self) -> "Startup":
+        """Nạp xong mới trả về; thành phần đầu tiên bị lỗi được raise lại"""
+        self.start()
+        self._done.wait()
+        if self.errors:
+            raise next(iter(self.errors.values()))
+        return self
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and not self.errors
+
+    def wait(self, timeout: float = None) -> bool:
+        self._done.wait(timeout)
+        return self.ready
+
+    async def wait_ready(self, timeout: float = None) -> bool:
+        """Cho handler async (websocket đến trong lúc model còn đang nạp); không giữ thread nào"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._done.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return self.ready
+
+    def _load(self, name: str, fn: Callable[[], object]):
+        self.state[name] = "loading"
+        start = time.monotonic()
+        fn()
+        self.durations[name] = time.monotonic() - start
+
+    def _fail(self, name: str, error: BaseException):
+        self.state[name] = "failed"
+        self.errors[name] = error
+
+    def _run(self):
+        remaining = dict(self._steps)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="startup") as pool:
+            running = {}
+            while remaining or running:
+                for name, (fn, after) in list(remaining.items()):
+                    failed = [dep for dep in after if self.state.get(dep) == "failed"]
+                    if failed:
+                        del remaining[name]
+                        self._fail(name, RuntimeError(f"{name} needs {', '.join(failed)}, which failed to load"))
+                    elif all(self.state.get(dep) == "ready" for dep in after):
+                        del remaining[name]
+                        running[pool.submit(self._load, name, fn)] = name
+                if not running:
+                    # Phụ thuộc vòng hoặc tên không tồn tại
+                    for name, (_, after) in remaining.items():
+                        self._fail(name, RuntimeError(f"{name}: unresolved dependencies {after}"))
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        self.state[name] = "ready"
+                        logger.info("✅ %s loaded in %.2fs", name, self.durations[name])
+                    else:
+                        self._fail(name, error)
+                        logger.error("❌ %s failed to load: %r", name, error, exc_info=error)
+
+        self.ready_after = process_age()
+        timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.durations.items())
+        if self.errors:
+            logger.error("❌ Startup failed after %.2fs (%s): %s",
+                         self.ready_after, timings, ", ".join(self.errors))
+        else:
+            logger.info("🚀 Ready %.2fs after process start (%s)", self.ready_after, timings)
+        self._done.set()
+
+    def status(self) -> dict:
+        """GET /ready"""
+        return {
+            "ready": self.ready,
+            "components": dict(self.state),
+            "load_seconds": {name: round(seconds, 3) for name, seconds in self.durations.items()},
+            "errors": {name: f"{type(e).__name__}: {e}" for name, e in self.errors.items()},
+            "cold_start_seconds": None if self.ready_after is None else round(self.ready_after, 3),
+        }
+
+    def stats(self) -> dict:
+        stats = {"startup_ready": int(self.ready)}
+        if self.ready_after is not None:
+            stats["startup_cold_start_seconds"] = round(self.ready_after, 3)
+        for name, seconds in self.durations.items():
+            stats[f"startup_{name}_load_seconds"] = round(seconds, 3)
+        return stats
@@ -1,35 +1,115 @@
 """
 Speech-to-Text Module with Debug Logging
 Model: ZipFormer with sherpa_onnx
+
+Modes (chọn trong settings/stt_settings.py -> STT_MODE):
+  - "offline": OfflineRecognizer, giải mã cả file/câu một lần
+  - "online":  OnlineRecognizer (streaming Zipformer), nhận PCM từng chunk qua OnlineSTTSession
 """
+import logging
+
 import numpy as np
 import soundfile as sf
-import sherpa_onnx
 from pathlib import Path
 from settings import stt_settings as cfg
+from .audio import to_float32, resample
+from .resampler import Resampler
+
+logger = logging.getLogger(__name__)
+
+
+class OnlineSTTSession:
+    """Một stream nhận dạng trực tuyến cho một câu nói, được nạp PCM trong lúc người dùng nói"""
+
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self.stream = recognizer.create_stream()
+        self.num_samples = 0
+        self._finished = False
+        self._resampler = None
+
+    def accept_pcm(self, pcm, sample_rate=None):
+        """
+        Nạp một chunk PCM (bytes int16 hoặc np.ndarray int16/float32), mặc định @ cfg.SAMPLE_RATE.
+        Nguồn khác sample rate được resample theo stream (state giữ giữa các chunk).
+        """
+        samples = to_float32(pcm)
+        if sample_rate and sample_rate != cfg.SAMPLE_RATE:
+            if self._resampler is None:
+                self._resampler = Resampler(sample_rate, cfg.SAMPLE_RATE)
+            samples = self._resampler.process(samples)
+        self.stream.accept_waveform(cfg.SAMPLE_RATE, samples)
+        self.num_samples += len(samples)
+        self._decode_ready()
+
+    def _decode_ready(self):
+        while self.recognizer.is_ready(self.stream):
+            self.recognizer.decode_stream(self.stream)
+
+    def _result_text(self) -> str:
+        result = self.recognizer.get_result(self.stream)
+        # sherpa-onnx cũ trả về object có .text, bản mới trả về str
+        return result if isinstance(result, str) else result.text
+
+    @property
+    def partial(self) -> str:
+        """Giả thuyết tạm thời (partial hypothesis) tính đến chunk hiện tại"""
+        return self._result_text().strip()
+
+    def is_endpoint(self) -> bool:
+        """True nếu endpoint rules của sherpa-onnx đã phát hiện hết câu"""
+        return cfg.ENABLE_ENDPOINT and self.recognizer.is_endpoint(self.stream)
+
+    def finish(self) -> str:
+        """Kết thúc stream, giải mã các frame còn lại và trả về text cuối cùng"""
+        if not self._finished:
+            if self._resampler is not None:
+                self.stream.accept_waveform(cfg.SAMPLE_RATE, self._resampler.flush())
+            tail = np.zeros(int(cfg.ONLINE_TAIL_PADDING_SEC * cfg.SAMPLE_RATE), dtype=np.float32)
+            self.stream.accept_waveform(cfg.SAMPLE_RATE, tail)
+            self.stream.input_finished()
+            self._decode_ready()
+            self._finished = True
+        text = self._result_text().strip()
+        logger.debug("Online recognition result: %s", text)
+        return text
+
 
 class STTEngine:
-    def __init__(self):
+    def __init__(self, mode=None):
         self.recognizer = None
+        self.mode = mode or cfg.STT_MODE
         self._initialize_model()
 
-    def _find_model_file(self, patterns):
+    def _find_model_file(self, patterns, model_dir=None):
+        model_dir = model_dir or cfg.MODEL_DIR
         for pattern in patterns:
             if '*' in pattern:
-                files = list(cfg.MODEL_DIR.glob(pattern))
+                files = list(model_dir.glob(pattern))
                 if files:
-                    print(f"DEBUG: Found model file {files[0]}")
+                    logger.debug("Found model file %s", files[0])
                     return str(files[0])
             else:
-                file_path = cfg.MODEL_DIR / pattern
+                file_path = model_dir / pattern
                 if file_path.exists():
-                    print(f"DEBUG: Found model file {file_path}")
+                    logger.debug("Found model file %s", file_path)
                     return str(file_path)
         raise FileNotFoundError(f"Model file not found for patterns: {patterns}")
 
     def _initialize_model(self):
-        print("🔧 Initializing STT model...")
-        print(f"DEBUG: MODEL_DIR = {cfg.MODEL_DIR}")
+        print(f"🔧 Initializing STT model ({self.mode})...")
+        if self.mode == "online":
+            self._initialize_online_model()
+        elif self.mode == "offline":
+            self._initialize_offline_model()
+        else:
+            raise ValueError(f"Unknown STT_MODE: {self.mode}")
+        print("✅ STT model initialized successfully")
+
+    def _initialize_offline_model(self):
+        # Import lúc nạp model (không phải lúc import module): front-end dùng STT server không cần sherpa-onnx
+        import sherpa_onnx
+        logger.debug("MODEL_DIR = %s", cfg.MODEL_DIR)
         tokens = self._find_model_file(cfg.TOKENS_FILE_PATTERNS)
         encoder = self._find_model_file(cfg.ENCODER_FILE_PATTERNS)
         decoder = self._find_model_file(cfg.DECODER_FILE_PATTERNS)
@@ -46,42 +126,98 @@ class STTEngine:
             decoding_method=cfg.DECODING_METHOD,
             provider=cfg.PROVIDER,
         )
-        print("✅ STT model initialized successfully")
+
+    def _initialize_online_model(self):
+        import sherpa_onnx
+        model_dir = cfg.ONLINE_MODEL_DIR
+        logger.debug("ONLINE_MODEL_DIR = %s", model_dir)
+        tokens = self._find_model_file(cfg.TOKENS_FILE_PATTERNS, model_dir)
+        encoder = self._find_model_file(cfg.ENCODER_FILE_PATTERNS, model_dir)
+        decoder = self._find_model_file(cfg.DECODER_FILE_PATTERNS, model_dir)
+        joiner = self._find_model_file(cfg.JOINER_FILE_PATTERNS, model_dir)
+
+        self.recognizer = sherpa_onnx.OnlineRecognizer.from_transducer(
+            tokens=tokens,
+            encoder=encoder,
+            decoder=decoder,
+            joiner=joiner,
+            num_threads=cfg.NUM_THREADS,
+            sample_rate=cfg.SAMPLE_RATE,
+            feature_dim=cfg.FEATURE_DIM,
+            enable_endpoint_detection=cfg.ENABLE_ENDPOINT,
+            rule1_min_trailing_silence=cfg.RULE1_MIN_TRAILING_SILENCE,
+            rule2_min_trailing_silence=cfg.RULE2_MIN_TRAILING_SILENCE,
+            rule3_min_utterance_length=cfg.RULE3_MIN_UTTERANCE_LENGTH,
+            decoding_method=cfg.ONLINE_DECODING_METHOD,
+            provider=cfg.PROVIDER,
+        )
+
+    @property
+    def is_online(self) -> bool:
+        return self.mode == "online"
+
+    def create_session(self) -> OnlineSTTSession:
+        """Tạo stream nhận dạng trực tuyến mới (chỉ dùng ở mode online)"""
+        if not self.is_online:
+            raise RuntimeError("create_session() requires STT_MODE = 'online'")
+        return OnlineSTTSession(self.recognizer)
 
     def transcribe_from_file(self, audio_path):
         path = Path(audio_path)
-        print(f"DEBUG: Checking audio path {path}")
-        print("DEBUG: Exists?", path.exists())
+        logger.debug("Checking audio path %s (exists: %s)", path, path.exists())
         if not path.exists():
             raise FileNotFoundError(f"Audio file not found: {path}")
 
         try:
             wav, sr = sf.read(str(path), dtype='float32')
-            print(f"DEBUG: Loaded audio, shape={wav.shape}, sr={sr}")
+            logger.debug("Loaded audio, shape=%s, sr=%s", wav.shape, sr)
         except Exception as e:
-            print("ERROR reading audio:", e)
+            logger.error("Error reading audio: %s", e)
             raise
 
-        if wav.ndim > 1:
-            wav = wav[:, 0]
+        return self.transcribe_array(wav, sr)
+
+    def transcribe_array(self, pcm, sample_rate=None):
+        """
+        Nhận dạng trực tiếp từ buffer trong RAM (không qua file).
+        `pcm`: bytes int16, np.int16 hoặc np.float32; `sample_rate` mặc định cfg.SAMPLE_RATE
+        """
+        sr = sample_rate or cfg.SAMPLE_RATE
+        wav = to_float32(pcm)
         if sr != cfg.SAMPLE_RATE:
-            print(f"DEBUG: Resampling from {sr} to {cfg.SAMPLE_RATE}")
-            new_len = int(len(wav) * cfg.SAMPLE_RATE / sr)
-            wav = np.interp(
-                np.linspace(0,1,new_len),
-                np.linspace(0,1,len(wav)),
-                wav
-            ).astype('float32')
+            logger.debug("Resampling from %s to %s", sr, cfg.SAMPLE_RATE)
+            wav = resample(wav, sr, cfg.SAMPLE_RATE)
             sr = cfg.SAMPLE_RATE
 
+        if self.is_online:
+            session = self.create_session()
+            session.accept_pcm(wav)
+            return session.finish()
+
         stream = self.recognizer.create_stream()
         stream.accept_waveform(sr, wav)
         self.recognizer.decode_stream(stream)
 
         res = stream.result
-        print(f"DEBUG: Recognition result: {res}")
+        logger.debug("Recognition result: %s", res)
         return res.text
 
+    def transcribe_batch(self, pcms):
+        """
+        Nhận dạng nhiều câu trong một lần gọi decode_streams (offline mode).
+        `pcms`: list các buffer float32 @ cfg.SAMPLE_RATE. Trả về list text cùng thứ tự.
+        """
+        if self.is_online:
+            return [self.transcribe_array(pcm) for pcm in pcms]
+
+        streams = []
+        for pcm in pcms:
+            stream = self.recognizer.create_stream()
+            stream.accept_waveform(cfg.SAMPLE_RATE, to_float32(pcm))
+            streams.append(stream)
+        self.recognizer.decode_streams(streams)
+        return [stream.result.text for stream in streams]
+
     def transcribe(self, audio_input_path):
         """Alias kept for compatibility with pipeline.py"""
         return self.transcribe_from_file(audio_input_path)
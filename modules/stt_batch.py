@@ -0,0 +1,97 @@
+"""
+Micro-batching STT scheduler
+Khi nhiều thiết bị kết thúc câu nói gần như cùng lúc, gom các câu trong
+một cửa sổ ngắn (BATCH_WINDOW_MS) hoặc tới BATCH_MAX_SIZE câu, rồi giải mã
+một lần bằng recognizer.decode_streams trên recognizer dùng chung.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from settings import stt_settings as cfg
+from .audio import to_float32, resample
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingSTTScheduler:
+    """Gom request STT thành batch, mỗi request nhận kết quả qua Future riêng"""
+
+    def __init__(self, engine, window_ms: float = None, max_batch: int = None):
+        self.engine = engine
+        self.window_sec = (cfg.BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000.0
+        self.max_batch = max_batch or cfg.BATCH_MAX_SIZE
+        self._queue: queue.Queue = queue.Queue()
+        self._stopped = False
+        self.batches = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._worker, name="stt-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, pcm, sample_rate: Optional[int] = None) -> Future:
+        """Đưa một câu vào hàng đợi, trả về concurrent.futures.Future[str]"""
+        if self._stopped:
+            raise RuntimeError("BatchingSTTScheduler is closed")
+        sr = sample_rate or cfg.SAMPLE_RATE
+        wav = to_float32(pcm)
+        if sr != cfg.SAMPLE_RATE:
+            wav = resample(wav, sr, cfg.SAMPLE_RATE)
+        future: Future = Future()
+        self._queue.put((wav, future))
+        return future
+
+    async def transcribe(self, pcm, sample_rate: Optional[int] = None) -> str:
+        return await asyncio.wrap_future(self.submit(pcm, sample_rate))
+
+    def _collect(self) -> List:
+        """Chờ request đầu tiên, sau đó gom thêm cho tới khi hết cửa sổ hoặc đủ batch"""
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.window_sec
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                break
+            # Bỏ qua request đã bị huỷ trước khi kịp giải mã
+            batch = [(wav, fut) for wav, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                texts = self.engine.transcribe_batch([wav for wav, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            logger.debug("STT batch of %d decoded", len(batch))
+            for (_, future), text in zip(batch, texts):
+                future.set_result(text)
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.requests / self.batches if self.batches else 0.0
+
+    def close(self):
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
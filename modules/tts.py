@@ -1,51 +1,46 @@
 """
 Text-to-Speech Module with Debug Logging
 Model: ZipVoice
+
+Backends (chọn trong settings/tts_settings.py -> TTS_BACKEND):
+  - "resident":   nạp model, tokenizer, vocoder MỘT LẦN và tổng hợp ngay trong process
+  - "subprocess": gọi `python -m zipvoice.bin.infer_zipvoice` cho mỗi câu (fallback)
+  - "fake":       giả lập offline với độ trễ cấu hình được (modules/fake_tts.py), cho benchmark/test
+  - "remote":     model nằm ở TTS model server (modules/model_server.py), dùng khi MODEL_SERVERS = True
 """
+import os
 import sys
+import json
+import hashlib
+import logging
+import queue
+import tempfile
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from settings import tts_settings as cfg
+from . import metrics
+from .audio import to_float32, to_pcm16
+from .audio_store import AudioStore
+from .cancel import is_cancelled
+from .prompt_cache import PromptCache, PromptEntry
 
-class TTSEngine:
-    def __init__(self):
-        self._validate_setup()
-        print(f"DEBUG: Ensuring output dir {cfg.OUTPUT_AUDIO_DIR}")
-        cfg.OUTPUT_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
-
-    def _validate_setup(self):
-        print("🔧 Validating TTS setup...")
-        if not cfg.ZIPVOICE_CODE_DIR.exists():
-            raise FileNotFoundError(f"Code dir not found: {cfg.ZIPVOICE_CODE_DIR}")
-        if not cfg.MODEL_DIR.exists():
-            raise FileNotFoundError(f"Model dir not found: {cfg.MODEL_DIR}")
-        print("✅ TTS setup validated")
+logger = logging.getLogger(__name__)
 
-    def _find_checkpoint(self):
-        for ext in cfg.CHECKPOINT_EXTENSIONS:
-            files = list(cfg.MODEL_DIR.glob(f"*{ext}"))
-            if files:
-                print(f"DEBUG: Found checkpoint {files[0].name}")
-                return files[0].name
-        print("DEBUG: No checkpoint found")
-        return None
 
-    def synthesize(self, text, output_path=None, ref_audio=None, prompt_text=None):
-        print(f"🔊 Synthesizing: {text[:30]}...")
-        checkpoint = self._find_checkpoint()
-        if not checkpoint:
-            raise FileNotFoundError(f"Checkpoint missing in {cfg.MODEL_DIR}")
+class SubprocessBackend:
+    """Fallback: mỗi lần tổng hợp chạy một process infer_zipvoice riêng"""
 
-        ref_audio = ref_audio or cfg.DEFAULT_REF_AUDIO
-        prompt_text = prompt_text or cfg.DEFAULT_PROMPT_TEXT
-        output_path = Path(output_path) if output_path else cfg.OUTPUT_AUDIO_DIR / "output.wav"
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
 
+    def synthesize(self, text, output_path, ref_audio, prompt_text):
         cmd = [
             sys.executable, "-m", "zipvoice.bin.infer_zipvoice",
             "--model-name", cfg.MODEL_NAME,
             "--model-dir", str(cfg.MODEL_DIR),
-            "--checkpoint-name", checkpoint,
+            "--checkpoint-name", self.checkpoint,
             "--prompt-wav", str(ref_audio),
             "--prompt-text", prompt_text,
             "--text", text,
@@ -56,20 +51,445 @@ class TTSEngine:
             "--lang", cfg.LANG,
         ]
 
-        print("DEBUG: Command:", cmd)
+        logger.debug("Command: %s", cmd)
         result = subprocess.run(cmd, cwd=str(cfg.ZIPVOICE_CODE_DIR), capture_output=True, text=True)
-        print("DEBUG: returncode", result.returncode)
-        print("DEBUG: stdout", result.stdout)
-        print("DEBUG: stderr", result.stderr)
+        logger.debug("returncode %s", result.returncode)
+        logger.debug("stdout %s", result.stdout)
+        logger.debug("stderr %s", result.stderr)
 
         if result.returncode != 0:
             raise RuntimeError(f"TTS failed, code {result.returncode}")
+        return output_path
+
+    def generate(self, text, ref_audio, prompt_text, cancel=None):
+        """Tổng hợp qua file tạm, trả về (waveform float32, sample_rate)"""
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        import soundfile as sf
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = Path(tmp_dir) / "segment.wav"
+            self.synthesize(text, tmp_path, ref_audio, prompt_text)
+            wav, sr = sf.read(str(tmp_path), dtype="float32")
+        if wav.ndim > 1:
+            wav = wav[:, 0]
+        self.sampling_rate = sr
+        return wav
+
+
+class ResidentBackend:
+    """Giữ ZipVoice model, tokenizer và vocoder thường trú trong bộ nhớ"""
+
+    def __init__(self, checkpoint):
+        # ZipVoice không được cài như package, import trực tiếp từ source tree
+        code_dir = str(cfg.ZIPVOICE_CODE_DIR)
+        if code_dir not in sys.path:
+            sys.path.insert(0, code_dir)
+
+        import torch
+        from zipvoice.models.zipvoice import ZipVoice
+        from zipvoice.models.zipvoice_distill import ZipVoiceDistill
+        from zipvoice.tokenizer.tokenizer import (
+            EmiliaTokenizer, EspeakTokenizer, LibriTTSTokenizer, SimpleTokenizer
+        )
+        from zipvoice.utils.checkpoint import load_checkpoint
+        from zipvoice.utils.feature import VocosFbank
+        from zipvoice.utils import infer as zv_infer
+
+        self.torch = torch
+        self.zv_infer = zv_infer
+        self.device = torch.device(cfg.DEVICE)
+        # Model không an toàn khi nhiều thread gọi cùng lúc
+        self._lock = threading.Lock()
+
+        if cfg.NUM_THREADS:
+            torch.set_num_threads(cfg.NUM_THREADS)
+
+        token_file = cfg.MODEL_DIR / cfg.TOKENS_FILE
+        if cfg.TOKENIZER == "emilia":
+            self.tokenizer = EmiliaTokenizer(token_file=token_file)
+        elif cfg.TOKENIZER == "libritts":
+            self.tokenizer = LibriTTSTokenizer(token_file=token_file)
+        elif cfg.TOKENIZER == "espeak":
+            self.tokenizer = EspeakTokenizer(token_file=token_file, lang=cfg.LANG)
+        else:
+            self.tokenizer = SimpleTokenizer(token_file=token_file)
+        tokenizer_config = {
+            "vocab_size": self.tokenizer.vocab_size,
+            "pad_id": self.tokenizer.pad_id,
+        }
+
+        with open(cfg.MODEL_DIR / cfg.MODEL_CONFIG_FILE, "r") as f:
+            model_config = json.load(f)
+
+        logger.debug("Loading %s from %s", cfg.MODEL_NAME, checkpoint)
+        if cfg.MODEL_NAME == "zipvoice":
+            model = ZipVoice(**model_config["model"], **tokenizer_config)
+        else:
+            model = ZipVoiceDistill(**model_config["model"], **tokenizer_config)
+
+        ckpt_path = cfg.MODEL_DIR / checkpoint
+        if ckpt_path.suffix == ".safetensors":
+            import safetensors.torch
+            safetensors.torch.load_model(model, str(ckpt_path))
+        else:
+            load_checkpoint(filename=ckpt_path, model=model, strict=True)
+        self.model = model.to(self.device).eval()
+
+        self.vocoder = self._load_vocoder().to(self.device).eval()
+        self.feature_extractor = VocosFbank()
+        self.sampling_rate = model_config["feature"]["sampling_rate"]
+        self.prompt_cache = PromptCache(cfg.PROMPT_CACHE_DIR)
+
+    def _load_vocoder(self):
+        from vocos import Vocos
+        if cfg.VOCODER_PATH:
+            logger.debug("Loading vocoder from %s", cfg.VOCODER_PATH)
+            vocoder = Vocos.from_hparams(str(Path(cfg.VOCODER_PATH) / "config.yaml"))
+            state_dict = self.torch.load(
+                str(Path(cfg.VOCODER_PATH) / "pytorch_model.bin"),
+                weights_only=True,
+                map_location="cpu",
+            )
+            vocoder.load_state_dict(state_dict)
+            return vocoder
+        return Vocos.from_pretrained("charactr/vocos-mel-24khz")
+
+    def _compute_prompt(self, ref_audio, prompt_text):
+        """Đọc prompt wav, chuẩn hoá RMS, trích fbank và tokenize prompt text"""
+        zv = self.zv_infer
+        prompt_wav = zv.load_prompt_wav(str(ref_audio), sampling_rate=self.sampling_rate)
+        prompt_wav, prompt_rms = zv.rms_norm(prompt_wav, cfg.TARGET_RMS)
+        prompt_features = self.feature_extractor.extract(prompt_wav, sampling_rate=self.sampling_rate)
+        return PromptEntry(
+            features=(prompt_features * cfg.FEAT_SCALE).cpu().numpy(),
+            tokens=self.tokenizer.texts_to_tokens([zv.add_punctuation(prompt_text)])[0],
+            duration=prompt_wav.shape[-1] / self.sampling_rate,
+            rms=float(prompt_rms),
+        )
+
+    def _prepare_prompt(self, ref_audio, prompt_text):
+        """Lấy prompt đã tiền xử lý từ cache (tính một lần cho mỗi giọng)"""
+        key = PromptCache.make_key(ref_audio, prompt_text, cfg.TOKENIZER, cfg.LANG)
+        entry = self.prompt_cache.get(key, lambda: self._compute_prompt(ref_audio, prompt_text))
+        if entry.tensor is None:
+            entry.tensor = self.torch.from_numpy(entry.features).to(self.device).unsqueeze(0)
+        return entry.tensor, entry.tokens, entry.duration, entry.rms
+
+    def preload_voices(self, voices):
+        """Tính sẵn prompt cho các giọng khai báo trong cfg.VOICES"""
+        with self._lock, self.torch.inference_mode():
+            for name, voice in voices.items():
+                self._prepare_prompt(voice["ref_audio"], voice["prompt_text"])
+                logger.debug("Voice '%s' preloaded", name)
+
+    def generate(self, text, ref_audio, prompt_text, cancel=None):
+        """
+        Tổng hợp `text`, trả về waveform float32 (numpy 1-D) ở self.sampling_rate.
+        `cancel` (CancelToken) được kiểm tra giữa các batch: lượt bị huỷ giải phóng model sớm.
+        """
+        torch = self.torch
+        zv = self.zv_infer
+
+        with self._lock, torch.inference_mode():
+            prompt_features, prompt_tokens_str, prompt_duration, prompt_rms = \
+                self._prepare_prompt(ref_audio, prompt_text)
+
+            tokens_str = self.tokenizer.texts_to_tokens([zv.add_punctuation(text)])[0]
+
+            # Chia câu dài thành các đoạn vừa với cửa sổ ~25s của model
+            token_duration = prompt_duration / len(prompt_tokens_str)
+            max_tokens = int((25 - prompt_duration) / token_duration)
+            chunked_tokens_str = zv.chunk_tokens_punctuation(tokens_str, max_tokens=max_tokens)
+            chunked_tokens = self.tokenizer.tokens_to_token_ids(chunked_tokens_str)
+            prompt_tokens = self.tokenizer.tokens_to_token_ids([prompt_tokens_str])
+
+            tokens_batches, chunked_index = zv.batchify_tokens(
+                chunked_tokens, cfg.MAX_DURATION, prompt_duration, token_duration
+            )
+
+            chunked_wavs = []
+            for batch_tokens in tokens_batches:
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                batch_size = len(batch_tokens)
+                (pred_features, pred_features_lens, _, _) = self.model.sample(
+                    tokens=batch_tokens,
+                    prompt_tokens=prompt_tokens * batch_size,
+                    prompt_features=prompt_features.repeat(batch_size, 1, 1),
+                    prompt_features_lens=torch.full(
+                        (batch_size,), prompt_features.size(1), device=self.device
+                    ),
+                    speed=cfg.SPEED,
+                    t_shift=cfg.T_SHIFT,
+                    duration="predict",
+                    num_step=cfg.NUM_STEP,
+                    guidance_scale=cfg.GUIDANCE_SCALE,
+                )
+                pred_features = pred_features.permute(0, 2, 1) / cfg.FEAT_SCALE
+                for i in range(batch_size):
+                    wav = self.vocoder.decode(
+                        pred_features[i][None, :, : pred_features_lens[i]]
+                    ).squeeze(1).clamp(-1, 1)
+                    if prompt_rms < cfg.TARGET_RMS:
+                        wav = wav * prompt_rms / cfg.TARGET_RMS
+                    chunked_wavs.append(wav)
+
+            ordered = [wav for _, wav in sorted(zip(chunked_index, chunked_wavs), key=lambda x: x[0])]
+            final_wav = zv.cross_fade_concat(ordered, fade_duration=0.1, sample_rate=self.sampling_rate)
+            final_wav = zv.remove_silence(
+                final_wav, self.sampling_rate, only_edge=(not cfg.REMOVE_LONG_SIL), trail_sil=0
+            )
+
+        return final_wav.squeeze(0).cpu().numpy().astype("float32")
+
+    def synthesize(self, text, output_path, ref_audio, prompt_text):
+        import soundfile as sf
+        wav = self.generate(text, ref_audio, prompt_text)
+        sf.write(str(output_path), wav, self.sampling_rate, subtype="PCM_16")
+        return output_path
+
+
+class TTSEngine:
+    def __init__(self, backend=None):
+        self.backend_name = backend or cfg.TTS_BACKEND
+        logger.debug("Ensuring output dir %s", cfg.OUTPUT_AUDIO_DIR)
+        cfg.OUTPUT_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+
+        if self.backend_name == "fake":
+            # Không cần ZipVoice/checkpoint; audio giả không lẫn với audio thật trong store
+            from .fake_tts import FakeBackend
+            print("🔧 Loading TTS backend: fake (offline)")
+            self.checkpoint = None
+            self.backend = FakeBackend()
+            self._checkpoint_id = f"fake:{self.backend.sampling_rate}:{self.backend.seconds_per_char}"
+        elif self.backend_name == "remote":
+            # Server báo checkpoint đang chạy: audio store của front-end vẫn phân biệt được model
+            from .remote import RemoteTTSBackend
+            print("🔧 Connecting to TTS model server")
+            self.checkpoint = None
+            self.backend = RemoteTTSBackend()
+            self._checkpoint_id = self.backend.checkpoint_id
+        else:
+            self._validate_setup()
+            checkpoint = self._find_checkpoint()
+            if not checkpoint:
+                raise FileNotFoundError(f"Checkpoint missing in {cfg.MODEL_DIR}")
+
+            self.checkpoint = checkpoint
+            print(f"🔧 Loading TTS backend: {self.backend_name}")
+            if self.backend_name == "resident":
+                self.backend = ResidentBackend(checkpoint)
+            elif self.backend_name == "subprocess":
+                self.backend = SubprocessBackend(checkpoint)
+            else:
+                raise ValueError(f"Unknown TTS_BACKEND: {self.backend_name}")
+            if cfg.PRELOAD_VOICES and hasattr(self.backend, "preload_voices"):
+                self.backend.preload_voices(cfg.VOICES)
+
+            ckpt_stat = (cfg.MODEL_DIR / checkpoint).stat()
+            self._checkpoint_id = f"{checkpoint}:{ckpt_stat.st_size}:{ckpt_stat.st_mtime_ns}"
+        self._voice_ids = {}
+        self.audio_store = None
+        if cfg.AUDIO_STORE_DIR:
+            self.audio_store = AudioStore()
+            self.audio_store.prune()
+        print(f"✅ TTS backend ready: {self.backend_name}")
+
+    @property
+    def checkpoint_id(self):
+        return self._checkpoint_id
+
+    def _validate_setup(self):
+        print("🔧 Validating TTS setup...")
+        if not cfg.ZIPVOICE_CODE_DIR.exists():
+            raise FileNotFoundError(f"Code dir not found: {cfg.ZIPVOICE_CODE_DIR}")
+        if not cfg.MODEL_DIR.exists():
+            raise FileNotFoundError(f"Model dir not found: {cfg.MODEL_DIR}")
+        print("✅ TTS setup validated")
+
+    def _find_checkpoint(self):
+        for ext in cfg.CHECKPOINT_EXTENSIONS:
+            files = list(cfg.MODEL_DIR.glob(f"*{ext}"))
+            if files:
+                logger.debug("Found checkpoint %s", files[0].name)
+                return files[0].name
+        logger.debug("No checkpoint found")
+        return None
+
+    def _voice_id(self, ref_audio, prompt_text):
+        """Hash nội dung file giọng tham chiếu + prompt text (tính lại khi file bị ghi đè)"""
+        path = Path(ref_audio)
+        memo_key = (str(path.resolve()), path.stat().st_mtime_ns, prompt_text)
+        voice_id = self._voice_ids.get(memo_key)
+        if voice_id is None:
+            digest = hashlib.sha1(path.read_bytes())
+            digest.update(prompt_text.encode("utf-8"))
+            voice_id = self._voice_ids[memo_key] = digest.hexdigest()
+        return voice_id
+
+    def audio_key(self, text, ref_audio, prompt_text):
+        """Key nội dung của audio: đổi text, giọng, checkpoint hay tham số sampling đều ra key khác"""
+        return AudioStore.make_key(
+            " ".join(text.split()),
+            self._voice_id(ref_audio, prompt_text),
+            self._checkpoint_id,
+            cfg.NUM_STEP, cfg.SPEED, cfg.GUIDANCE_SCALE, cfg.T_SHIFT, cfg.TARGET_RMS,
+            cfg.REMOVE_LONG_SIL, cfg.AUDIO_STORE_SAMPLE_RATE,
+        )
+
+    def has_audio(self, text, voice=None):
+        """True nếu audio của `text` (giọng `voice`) đã có sẵn trong audio store"""
+        if self.audio_store is None:
+            return False
+        ref_audio, prompt_text = self._resolve_voice(voice)
+        return self.audio_key(text, ref_audio, prompt_text) in self.audio_store
+
+    @property
+    def cache_tag(self):
+        """Định danh model + giọng mặc định: audio đã cache của giọng/model khác không được dùng lại"""
+        ref_audio, prompt_text = self._resolve_voice()
+        return AudioStore.make_key(self._voice_id(ref_audio, prompt_text), self._checkpoint_id,
+                                   cfg.NUM_STEP, cfg.SPEED, cfg.GUIDANCE_SCALE, cfg.T_SHIFT)
+
+    def _resolve_voice(self, voice=None, ref_audio=None, prompt_text=None):
+        """Chọn (ref_audio, prompt_text): tham số truyền vào > cfg.VOICES[voice] > mặc định"""
+        preset = cfg.VOICES.get(voice or cfg.DEFAULT_VOICE, {})
+        ref_audio = ref_audio or preset.get("ref_audio") or cfg.DEFAULT_REF_AUDIO
+        prompt_text = prompt_text or preset.get("prompt_text") or cfg.DEFAULT_PROMPT_TEXT
+        return ref_audio, prompt_text
+
+    def synthesize(self, text, output_path=None, ref_audio=None, prompt_text=None, voice=None):
+        """
+        Tổng hợp ra file WAV. Không truyền output_path thì trả về file trong audio store
+        (tên theo hash nội dung), nên hai request cùng lúc không ghi đè file của nhau.
+        """
+        logger.info("🔊 Synthesizing: %s...", text[:30])
+        ref_audio, prompt_text = self._resolve_voice(voice, ref_audio, prompt_text)
+        if output_path is None and self.audio_store is not None:
+            self._generate_pcm16(text, ref_audio, prompt_text, save=True)
+            output_path = self.audio_store.wav_path(self.audio_key(text, ref_audio, prompt_text))
+            logger.info("✅ Audio generated: %s", output_path)
+            return output_path
+
+        if output_path is None:
+            fd, output_path = tempfile.mkstemp(prefix="output_", suffix=".wav", dir=cfg.OUTPUT_AUDIO_DIR)
+            os.close(fd)
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.backend.synthesize(text, output_path, ref_audio, prompt_text)
+
         if not output_path.exists():
             raise RuntimeError(f"Output missing: {output_path}")
 
-        print(f"✅ Audio generated: {output_path}")
+        logger.info("✅ Audio generated: %s", output_path)
         return output_path
 
+    def _generate(self, text, ref_audio, prompt_text, cancel=None):
+        """
+        (waveform float32, sample_rate). Khi bật audio store, audio luôn ở
+        AUDIO_STORE_SAMPLE_RATE: lấy thẳng từ store nếu đã có, không thì tổng hợp rồi lưu.
+        """
+        if self.audio_store is None:
+            with metrics.span("tts_synth"):
+                wav = self.backend.generate(text, ref_audio, prompt_text, cancel)
+            return wav, self.backend.sampling_rate
+
+        pcm = self._generate_pcm16(text, ref_audio, prompt_text, cancel=cancel)
+        return to_float32(pcm), self.audio_store.sample_rate
+
+    def _generate_pcm16(self, text, ref_audio, prompt_text, save=None, cancel=None):
+        key = self.audio_key(text, ref_audio, prompt_text)
+        pcm = self.audio_store.get(key)
+        if pcm is not None:
+            logger.info("⚡ Audio store hit: %s", text[:30])
+            return pcm
+        with metrics.span("tts_synth"):
+            wav = self.backend.generate(text, ref_audio, prompt_text, cancel)
+        pcm = to_pcm16(wav, self.backend.sampling_rate, self.audio_store.sample_rate).tobytes()
+        if cfg.AUDIO_STORE_ALL if save is None else save:
+            self.audio_store.put(key, pcm)
+        return pcm
+
+    def synthesize_pcm16(self, text, ref_audio=None, prompt_text=None, voice=None, pin=False):
+        """
+        PCM int16 mono @ AUDIO_STORE_SAMPLE_RATE, sẵn sàng gửi cho ESP32.
+        pin=True: lưu vào phrase bank (luôn được lưu, không bao giờ bị prune).
+        """
+        if self.audio_store is None:
+            raise RuntimeError("synthesize_pcm16() requires AUDIO_STORE_DIR")
+        ref_audio, prompt_text = self._resolve_voice(voice, ref_audio, prompt_text)
+        pcm = self._generate_pcm16(text, ref_audio, prompt_text, save=True if pin else None)
+        if pin:
+            self.audio_store.pin(self.audio_key(text, ref_audio, prompt_text), text, voice or cfg.DEFAULT_VOICE)
+        return pcm
+
+    def synthesize_array(self, text, ref_audio=None, prompt_text=None, voice=None, cancel=None):
+        """Tổng hợp và trả về (waveform float32, sample_rate) trong RAM, không ghi file"""
+        logger.info("🔊 Synthesizing: %s...", text[:30])
+        ref_audio, prompt_text = self._resolve_voice(voice, ref_audio, prompt_text)
+        return self._generate(text, ref_audio, prompt_text, cancel)
+
+    def synthesize_stream(self, segments, ref_audio=None, prompt_text=None, voice=None, cancel=None):
+        """
+        Tổng hợp lần lượt từng đoạn text, yield (segment, waveform float32, sample_rate).
+        Trong lúc đoạn hiện tại đang được gửi đi, tối đa STREAM_PREFETCH đoạn kế tiếp
+        được tổng hợp song song ở thread nền.
+        `segments` có thể là list hoặc generator (vd. câu cắt dần từ LLM streaming);
+        generator được đọc ở thread riêng nên đoạn đầu không phải chờ đoạn sau.
+        """
+        ref_audio, prompt_text = self._resolve_voice(voice, ref_audio, prompt_text)
+        pending = queue.Queue(maxsize=1 + max(cfg.STREAM_PREFETCH, 0))
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # Chặn khi đã đủ số đoạn tổng hợp trước, bỏ cuộc nếu consumer đã dừng
+            while not stop.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def feeder():
+            try:
+                for segment in segments:
+                    if stop.is_set() or is_cancelled(cancel):
+                        break
+                    logger.info("🔊 Synthesizing segment: %s...", segment[:30])
+                    future = executor.submit(self._generate, segment, ref_audio, prompt_text, cancel)
+                    if not put((segment, future)):
+                        future.cancel()
+            except Exception as e:
+                put((None, e))
+            finally:
+                put((done, None))
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-stream") as executor:
+            feeder_thread = threading.Thread(target=feeder, name="tts-feeder", daemon=True)
+            feeder_thread.start()
+            try:
+                while True:
+                    segment, future = pending.get()
+                    if segment is done:
+                        break
+                    if segment is None:
+                        raise future
+                    wav, sr = future.result()
+                    yield segment, wav, sr
+            finally:
+                stop.set()
+                # Huỷ các đoạn chưa bắt đầu tổng hợp
+                while True:
+                    try:
+                        _, future = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if hasattr(future, "cancel"):
+                        future.cancel()
+
 if __name__ == '__main__':
     print("\n=== TTS Debug Run ===")
     engine = TTSEngine()
@@ -0,0 +1,354 @@
+"""
+VAD subsystem: Silero VAD (ONNX) chấm điểm frame của mọi kết nối theo batch
+
+  - RingBuffer:    float32 cấp phát một lần cho mỗi kết nối; PCM int16 được đổi
+                   thẳng vào buffer, pre-roll và cả câu nói đọc lại từ đây
+  - VADSession:    state RNN của Silero (tường minh, [2, 128]) + hysteresis của một kết nối;
+                   ngưỡng im lặng kết thúc câu thay đổi theo độ dài câu, "pause"/"resume"
+                   cho speculative endpoint (settings/vad_settings.py, Endpointing)
+  - BatchedVAD:    thread nền gom frame từ mọi kết nối đang chờ trong BATCH_WINDOW_MS
+                   và chấm điểm bằng một lần gọi onnxruntime (input [B, 64 + 512])
+
+Không phụ thuộc kích thước chunk: websocket gửi bao nhiêu bytes cũng được,
+frame 512 sample được cắt ra từ ring buffer.
+"""
+import asyncio
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from settings import vad_settings as cfg
+
+STATE_SHAPE = (2, 128)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VADEvent:
+    """Sự kiện của một kết nối; start/end là vị trí sample tuyệt đối trong ring buffer"""
+    kind: str  # "start" | "pause" | "resume" | "end"
+    start: int
+    end: int
+    silence: int = 0  # "pause"/"end": số sample im lặng ở cuối câu mà VAD đã chờ
+
+
+def endpoint_silence(speech_sec: float, longest: float = None, shortest: float = None) -> float:
+    """
+    Giây im lặng cần chờ trước khi kết thúc một câu đã nói được `speech_sec` giây: giảm tuyến tính
+    từ `longest` (câu <= ENDPOINT_SHORT_SEC) xuống `shortest` (câu >= ENDPOINT_LONG_SEC)
+    """
+    longest = cfg.SILENCE_END_MAX_MS / 1000.0 if longest is None else longest
+    shortest = cfg.SILENCE_END_MIN_MS / 1000.0 if shortest is None else shortest
+    span = cfg.ENDPOINT_LONG_SEC - cfg.ENDPOINT_SHORT_SEC
+    progress = (speech_sec - cfg.ENDPOINT_SHORT_SEC) / span if span > 0 else 1.0
+    return longest + (shortest - longest) * min(max(progress, 0.0), 1.0)
+
+
+def _ms_to_frames(ms: float) -> int:
+    return max(1, int(math.ceil(ms / 1000.0 * cfg.SAMPLE_RATE / cfg.FRAME_SAMPLES)))
+
+
+class RingBuffer:
+    """Ring buffer float32; vị trí là chỉ số tuyệt đối (tổng số sample đã ghi từ đầu)"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buf = np.zeros(capacity, dtype=np.float32)
+        self.end = 0
+
+    @property
+    def start(self) -> int:
+        """Vị trí cũ nhất còn trong buffer"""
+        return max(0, self.end - self.capacity)
+
+    def write_pcm16(self, data: bytes):
+        """Ghi PCM int16 (đổi sang float32 ngay trong buffer, không tạo mảng trung gian)"""
+        pcm = np.frombuffer(data, dtype=np.int16)
+        if len(pcm) > self.capacity:
+            self.end += len(pcm) - self.capacity
+            pcm = pcm[-self.capacity:]
+        offset = self.end % self.capacity
+        first = min(len(pcm), self.capacity - offset)
+        np.multiply(pcm[:first], 1.0 / 32768.0, out=self._buf[offset:offset + first], casting="unsafe")
+        if first < len(pcm):
+            np.multiply(pcm[first:], 1.0 / 32768.0, out=self._buf[:len(pcm) - first], casting="unsafe")
+        self.end += len(pcm)
+
+    def read(self, start: int, end: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Đọc [start, end); phần đã bị ghi đè hoặc trước vị trí 0 được điền 0"""
+        length = end - start
+        if out is None:
+            out = np.empty(length, dtype=np.float32)
+        valid_from = max(start, self.start)
+        missing = min(valid_from - start, length)
+        if missing > 0:
+            out[:missing] = 0.0
+        pos = valid_from
+        while pos < end:
+            offset = pos % self.capacity
+            n = min(end - pos, self.capacity - offset)
+            out[pos - start:pos - start + n] = self._buf[offset:offset + n]
+            pos += n
+        return out
+
+
+class VADSession:
+    """Trạng thái VAD của một kết nối: ring buffer, state của Silero và hysteresis"""
+
+    def __init__(self):
+        frame = cfg.FRAME_SAMPLES
+        max_samples = int(cfg.MAX_UTTERANCE_SEC * cfg.SAMPLE_RATE)
+        # Đủ chứa câu dài nhất + pre-roll + vài frame chưa chấm điểm
+        self.ring = RingBuffer(max_samples + (cfg.PREROLL_FRAMES + 8) * frame)
+        self.max_utterance = max_samples
+        self.state = np.zeros(STATE_SHAPE, dtype=np.float32)
+        self.scored = 0          # Các sample trước vị trí này đã được chấm điểm
+        self.last_prob = 0.0
+        self.is_speaking = False
+        self.speech_start = 0
+        self.silence_frames = 0
+        self.paused = False      # Đã báo "pause" cho khoảng lặng hiện tại (speculative endpoint)
+        self._trigger_frames = 0
+        self._carry = b""        # Byte lẻ của sample int16 bị cắt ngang giữa hai chunk
+        self._pause_frames = _ms_to_frames(cfg.SPECULATIVE_PAUSE_MS) if cfg.SPECULATIVE_ENDPOINT else None
+
+    def feed(self, data: bytes):
+        if self._carry:
+            data = self._carry + data
+            self._carry = b""
+        if len(data) % 2:
+            data, self._carry = data[:-1], data[-1:]
+        if data:
+            self.ring.write_pcm16(data)
+
+    @property
+    def pending_frames(self) -> int:
+        return (self.ring.end - self.scored) // cfg.FRAME_SAMPLES
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """Audio float32 @16kHz của đoạn [start, end)"""
+        return self.ring.read(start, end)
+
+    def end_utterance(self) -> VADEvent:
+        """Kết thúc câu ngay (vd. khi ASR endpoint đến trước VAD)"""
+        event = VADEvent("end", self.speech_start, self.scored, self.silence_frames * cfg.FRAME_SAMPLES)
+        self.is_speaking = False
+        self.silence_frames = 0
+        self.paused = False
+        self._trigger_frames = 0
+        return event
+
+    @property
+    def silence_end_frames(self) -> int:
+        """Số frame im lặng để kết thúc câu hiện tại (adaptive theo độ dài phần đã nói)"""
+        speech = self.scored - self.speech_start - self.silence_frames * cfg.FRAME_SAMPLES
+        return _ms_to_frames(1000.0 * endpoint_silence(speech / cfg.SAMPLE_RATE))
+
+    def _update(self, prob: float) -> Optional[VADEvent]:
+        """Hysteresis sau khi frame [scored - FRAME_SAMPLES, scored) được chấm điểm"""
+        frame = cfg.FRAME_SAMPLES
+        self.last_prob = prob
+        if prob >= cfg.SPEECH_THRESHOLD:
+            self.silence_frames = 0
+            if self.paused:
+                # Nói tiếp sau khoảng lặng đã báo "pause": lượt speculative bị bỏ
+                self.paused = False
+                return VADEvent("resume", self.speech_start, self.scored)
+            if not self.is_speaking:
+                self._trigger_frames += 1
+                if self._trigger_frames >= cfg.SPEECH_START_FRAMES:
+                    self.is_speaking = True
+                    first_speech = self.scored - self._trigger_frames * frame
+                    self.speech_start = max(self.ring.start, first_speech - cfg.PREROLL_FRAMES * frame, 0)
+                    return VADEvent("start", self.speech_start, self.scored)
+        elif prob < cfg.SILENCE_THRESHOLD:
+            self._trigger_frames = 0
+            if self.is_speaking:
+                self.silence_frames += 1
+                if self.silence_frames >= self.silence_end_frames:
+                    return self.end_utterance()
+                if self.silence_frames == self._pause_frames:
+                    self.paused = True
+                    return VADEvent("pause", self.speech_start, self.scored, self.silence_frames * frame)
+        elif not self.is_speaking:
+            self._trigger_frames = 0
+
+        if self.is_speaking and self.scored - self.speech_start >= self.max_utterance:
+            logger.warning("⚠️  Utterance too long, cutting")
+            return self.end_utterance()
+        return None
+
+
+class BatchedVAD:
+    """Chấm điểm frame của mọi kết nối bằng một model Silero dùng chung, theo batch"""
+
+    def __init__(self, session=None, window_ms: float = None, max_batch: int = None):
+        self.session = session or self._load_model()
+        input_names = {i.name for i in self.session.get_inputs()}
+        if "state" not in input_names:
+            raise RuntimeError(f"Unsupported Silero VAD model (inputs: {sorted(input_names)}), need v5")
+        self.window_sec = (cfg.BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000.0
+        self.max_batch = max_batch or cfg.BATCH_MAX_SIZE
+        width = cfg.CONTEXT_SAMPLES + cfg.FRAME_SAMPLES
+        self._input = np.zeros((self.max_batch, width), dtype=np.float32)
+        self._sr = np.array(cfg.SAMPLE_RATE, dtype=np.int64)
+        self._queue: queue.Queue = queue.Queue()
+        self._stopped = False
+        self.frames = 0
+        self.calls = 0
+        self._thread = threading.Thread(target=self._worker, name="vad-batcher", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _load_model():
+        import onnxruntime as ort
+        if not cfg.VAD_MODEL_PATH.exists():
+            raise FileNotFoundError(
+                f"Silero VAD model not found at {cfg.VAD_MODEL_PATH}; "
+                f"download it once with: python -m modules.vad --fetch"
+            )
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = cfg.VAD_NUM_THREADS
+        options.inter_op_num_threads = 1
+        session = ort.InferenceSession(
+            str(cfg.VAD_MODEL_PATH), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        print("✅ Silero VAD (ONNX) loaded")
+        return session
+
+    def create_session(self) -> VADSession:
+        return VADSession()
+
+    def submit(self, vad_session: VADSession, data: bytes = b"") -> Future:
+        """Nạp PCM vào session, trả về Future[List[VADEvent]] của các frame mới đủ"""
+        if self._stopped:
+            raise RuntimeError("BatchedVAD is closed")
+        vad_session.feed(data)
+        future: Future = Future()
+        if vad_session.pending_frames == 0:
+            future.set_result([])
+            return future
+        self._queue.put((vad_session, future))
+        return future
+
+    async def process(self, vad_session: VADSession, data: bytes) -> List[VADEvent]:
+        return await asyncio.wrap_future(self.submit(vad_session, data))
+
+    def _collect(self) -> List:
+        """Chờ kết nối đầu tiên có frame, sau đó gom thêm cho tới khi hết cửa sổ hoặc đủ batch"""
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.window_sec
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _infer(self, sessions: List[VADSession]) -> np.ndarray:
+        """Một lần gọi model cho frame kế tiếp của mỗi session; cập nhật state tại chỗ"""
+        batch = len(sessions)
+        context, frame = cfg.CONTEXT_SAMPLES, cfg.FRAME_SAMPLES
+        rows = self._input[:batch]
+        for row, s in zip(rows, sessions):
+            s.ring.read(s.scored - context, s.scored + frame, out=row)
+        state = np.stack([s.state for s in sessions], axis=1)  # [2, B, 128]
+        probs, new_state = self.session.run(None, {"input": rows, "state": state, "sr": self._sr})
+        for i, s in enumerate(sessions):
+            s.state[...] = new_state[:, i]
+            s.scored += frame
+        self.calls += 1
+        self.frames += batch
+        return probs.reshape(batch)
+
+    def _score(self, sessions: List[VADSession]) -> Dict[int, List[VADEvent]]:
+        """Chấm hết các frame đang chờ; frame của cùng một session phải chấm tuần tự (state RNN)"""
+        events: Dict[int, List[VADEvent]] = {id(s): [] for s in sessions}
+        while True:
+            ready = [s for s in sessions if s.pending_frames > 0]
+            if not ready:
+                return events
+            for start in range(0, len(ready), self.max_batch):
+                chunk = ready[start:start + self.max_batch]
+                for s, prob in zip(chunk, self._infer(chunk)):
+                    event = s._update(float(prob))
+                    if event is not None:
+                        events[id(s)].append(event)
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                break
+            batch = [(s, fut) for s, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            # Một kết nối có thể có nhiều request trong cùng batch: chỉ chấm một lần
+            sessions = list({id(s): s for s, _ in batch}.values())
+            try:
+                events = self._score(sessions)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for s, future in batch:
+                future.set_result(events.pop(id(s), []))
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.frames / self.calls if self.calls else 0.0
+
+    def stats(self) -> dict:
+        return {"vad_frames": self.frames, "vad_model_calls": self.calls,
+                "vad_mean_batch": round(self.mean_batch_size, 2)}
+
+    def close(self):
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+
+def fetch_model(url: str = None, path=None):
+    """Tải file ONNX của Silero về models/ (một lần, lúc cài đặt); server không truy cập mạng khi khởi động"""
+    import tempfile
+    import urllib.request
+    url = url or cfg.VAD_MODEL_URL
+    path = path or cfg.VAD_MODEL_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    print(f"⬇️  {url}")
+    with urllib.request.urlopen(url, timeout=60) as response:
+        data = response.read()
+    # Ghi file tạm rồi đổi tên: tải dở không để lại file ONNX hỏng
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as tmp:
+        tmp.write(data)
+    Path(tmp.name).replace(path)
+    print(f"✅ Saved {path} ({len(data) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Silero VAD model")
+    parser.add_argument("--fetch", action="store_true", help=f"Tải model về {cfg.VAD_MODEL_PATH}")
+    parser.add_argument("--url", default=None, help="Mặc định VAD_MODEL_URL trong settings/vad_settings.py")
+    args = parser.parse_args()
+    if args.fetch:
+        fetch_model(args.url)
+    else:
+        parser.print_help()
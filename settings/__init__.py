@@ -1,5 +1,7 @@
 from . import stt_settings
 from . import tts_settings
 from . import llm_settings
+from . import server_settings
+from . import vad_settings
 
-__all__ = ['stt_settings', 'tts_settings', 'llm_settings']
\ No newline at end of file
+__all__ = ['stt_settings', 'tts_settings', 'llm_settings', 'server_settings', 'vad_settings']
\ No newline at end of file
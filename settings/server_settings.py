@@ -0,0 +1,84 @@
+import os
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# ===== Audio Format =====
+# Các thông số audio này PHẢI KHỚP với code ESP32
+SAMPLE_RATE = 16000
+BIT_DEPTH_BYTES = 2  # 16-bit = 2 bytes
+CHANNELS = 1
+
+# ===== Recording =====
+# Ghi lại câu nói của người dùng ra audio_files/ (chạy nền, không nằm trên đường xử lý)
+RECORD_AUDIO = True
+RECORD_DIR = ROOT_DIR / "audio_files"
+RECORD_QUEUE_SIZE = 64  # Số bản ghi chờ ghi đĩa tối đa; đầy thì bỏ bản ghi mới
+
+# ===== Startup =====
+# STT, LLM, TTS, VAD được nạp song song trên thread nền; server nhận kết nối ngay, GET /ready báo khi xong
+STARTUP_WORKERS = 4        # Số thành phần nạp cùng lúc
+STARTUP_WAIT_TIMEOUT = 30  # Giây websocket đến sớm chờ model; quá hạn thì đóng (1013) để ESP32 kết nối lại
+
+# ===== Concurrency / Admission Control =====
+# Mỗi stage có thread pool riêng; Gemini dùng async I/O nên không cần thread
+STT_WORKERS = 2
+TTS_WORKERS = 1            # Backend resident giữ một model, thêm worker không nhanh hơn
+MAX_CONCURRENT_TURNS = 4   # Số lượt STT+LLM+TTS chạy đồng thời
+MAX_QUEUED_TURNS = 32      # Vượt quá -> từ chối ngay (SERVER_BUSY) thay vì treo
+MAX_QUEUED_PER_DEVICE = 1  # Mỗi thiết bị chỉ có tối đa chừng này lượt đang chờ
+MAX_SPECULATIVE_TURNS = 2  # Lượt speculative (vad_settings, Endpointing) chạy ngoài MAX_CONCURRENT_TURNS;
+                           # hết budget thì lượt đó chờ VAD xác nhận rồi xếp hàng như lượt thường
+                           # Lượt speculative được commit vẫn chạy nốt trên budget này (không đổi slot giữa
+                           # chừng), nên tối đa MAX_CONCURRENT_TURNS + MAX_SPECULATIVE_TURNS lượt cùng tính toán
+
+# ===== Device Sessions =====
+# ESP32 tự giới thiệu khi kết nối: ws://host:8000/ws?device=<id> (vd. MAC) hoặc tin nhắn đầu tiên "HELLO <id>";
+# server xác nhận "SESSION <id>". Không có -> mỗi kết nối là một session riêng (host:port) như trước.
+SESSION_QUERY_PARAM = "device"
+SESSION_IDLE_TIMEOUT = 900    # Giây; session đã ngắt kết nối lâu hơn thì bị dọn (lịch sử vẫn còn trên đĩa)
+SESSION_SWEEP_INTERVAL = 60   # Chu kỳ timer dọn session
+MAX_SESSIONS = 4096           # Vượt quá -> dọn sớm session ngắt kết nối lâu nhất
+
+# ===== Downlink (server -> ESP32) =====
+# Gửi theo deadline đồng hồ thực; firmware đệm được ~256ms (PLAYBACK_BUFFER_SIZE 4KB + DMA 8x256 sample)
+DOWNLINK_CHUNK_SAMPLES = 512  # 512 samples = 1024 bytes ~ 32ms @16kHz
+DOWNLINK_LEAD_MS = 160        # Luôn gửi trước thời điểm phát chừng này (không vượt buffer của thiết bị)
+DOWNLINK_PRIME_MS = 128       # Gửi liền lúc bắt đầu phát / sau khi thiết bị phát cạn buffer
+DOWNLINK_WAIT_PLAYBACK = True # Chờ thiết bị phát xong rồi mới gửi TTS_END (mic không thu lại tiếng loa)
+
+# ===== Audio Codec (websocket /ws) =====
+# Client đề nghị codec khi kết nối: ws://host:8000/ws?codec=adpcm (hoặc "opus,adpcm" theo thứ tự ưu tiên).
+# Không có query param -> PCM 16-bit thô như cũ. Server báo lại "CODEC <tên>" trước khi gửi audio.
+AUDIO_CODECS = ["pcm", "adpcm", "opus"]  # Codec server chấp nhận (opus cần opuslib + libopus)
+OPUS_FRAME_MS = 20
+OPUS_BITRATE = 24000
+
+# ===== Logging / Metrics =====
+LOG_LEVEL = "INFO"  # "DEBUG" để xem chi tiết từng chunk/segment; "WARNING" khi chạy nhiều thiết bị
+LOG_FORMAT = "%(asctime)s %(levelname).1s %(name)s: %(message)s"
+TRACE_HISTORY = 20          # Số lượt gần nhất giữ lại cho mỗi session (GET /traces)
+TRACE_MAX_SESSIONS = 256
+
+# ===== Multi-worker Deployment =====
+# STT, VAD, TTS và lịch sử hội thoại chạy trong các model server dùng chung cho mọi worker uvicorn;
+# worker front-end chỉ giữ websocket, Gemini và cache (modules/model_server.py, IPC: modules/ipc.py)
+#   python -m modules.model_server --frontend vad_server:app --workers 4 --port 8000
+# Launcher tự bật MODEL_SERVERS cho các worker qua biến môi trường VOICE_MODEL_SERVERS=1
+MODEL_SERVERS_ENV = "VOICE_MODEL_SERVERS"
+MODEL_SERVERS = os.getenv(MODEL_SERVERS_ENV, "0") == "1"
+MODEL_SERVER_STAGES = ["stt", "vad", "tts", "history"]
+MODEL_SERVER_DIR = ROOT_DIR / "run"           # Unix socket của từng stage: run/<stage>.sock
+MODEL_SERVER_AUTHKEY = b"esp32-voice-assistant"
+MODEL_CONNECT_TIMEOUT = 300  # Giây front-end chờ model server nạp model xong
+SHM_INITIAL_BYTES = 1 << 20  # Shared memory ban đầu mỗi chiều của một kết nối; tự nới khi audio dài hơn
+FRONTEND_WORKERS = 2
+# Core CPU cho từng stage (Linux, os.sched_setaffinity); số thread của model = số core được giao.
+# None = không ghim, dùng NUM_THREADS / VAD_NUM_THREADS trong settings của stage đó.
+STAGE_CORES = {
+    "stt": None,       # vd. [0, 1, 2, 3]
+    "tts": None,       # vd. [4, 5, 6]
+    "vad": None,       # vd. [7]
+    "history": None,
+    "frontend": None,  # Các worker uvicorn, vd. [8, 9]
+}
@@ -22,4 +22,24 @@ DECODING_METHOD = "greedy_search"  # Options: greedy_search, modified_beam_searc
 PROVIDER = "cpu"  # Options: cpu, cuda, coreml
 
 # ===== Input/Output =====
-DEFAULT_INPUT_AUDIO = ROOT_DIR / "data" / "ref1.wav"
\ No newline at end of file
+DEFAULT_INPUT_AUDIO = ROOT_DIR / "data" / "ref1.wav"
+
+# ===== Recognition Mode =====
+# "offline": OfflineRecognizer, giải mã cả câu sau khi VAD báo hết câu
+# "online":  OnlineRecognizer (streaming Zipformer), giải mã dần trong lúc người dùng nói
+STT_MODE = "offline"
+ONLINE_MODEL_DIR = ROOT_DIR / "models" / "Zipformer-streaming"
+ONLINE_DECODING_METHOD = "greedy_search"
+ONLINE_TAIL_PADDING_SEC = 0.66  # Đệm im lặng khi kết thúc stream để flush các frame cuối
+
+# ===== Online Endpointing (sherpa-onnx rules) =====
+ENABLE_ENDPOINT = True
+RULE1_MIN_TRAILING_SILENCE = 2.4   # giây im lặng, khi chưa nhận ra chữ nào
+RULE2_MIN_TRAILING_SILENCE = 0.8   # giây im lặng, sau khi đã có chữ
+RULE3_MIN_UTTERANCE_LENGTH = 20.0  # giây, cắt câu quá dài
+
+# ===== Batched Decoding (offline mode) =====
+# Gom các câu kết thúc gần nhau từ nhiều thiết bị để giải mã chung bằng decode_streams
+BATCH_DECODING = True
+BATCH_WINDOW_MS = 30   # Thời gian tối đa chờ gom thêm câu sau câu đầu tiên
+BATCH_MAX_SIZE = 8     # Số câu tối đa trong một batch
@@ -25,4 +25,66 @@ TOKENIZER = "espeak"
 LANG = "vi"  # Vietnamese
 
 # ===== Checkpoint Settings =====
-CHECKPOINT_EXTENSIONS = ['.pt', '.safetensors']
\ No newline at end of file
+CHECKPOINT_EXTENSIONS = ['.pt', '.safetensors']
+
+# ===== Backend =====
+# "resident":   nạp model/tokenizer/vocoder một lần trong TTSEngine.__init__ (khuyên dùng)
+# "subprocess": gọi zipvoice.bin.infer_zipvoice cho mỗi câu (chậm, chỉ dùng khi debug)
+# "fake":       giả lập offline (modules/fake_tts.py), đo overhead của server không cần model
+TTS_BACKEND = "resident"
+DEVICE = "cpu"  # Options: cpu, cuda
+NUM_THREADS = 4  # torch intra-op threads cho backend resident (0 = mặc định của torch)
+MODEL_CONFIG_FILE = "model.json"
+TOKENS_FILE = "tokens.txt"
+# Thư mục vocos local (config.yaml + pytorch_model.bin). None = tải charactr/vocos-mel-24khz
+VOCODER_PATH = None
+
+# ===== Sampling Settings (giống mặc định của infer_zipvoice) =====
+GUIDANCE_SCALE = 1.0
+SPEED = 1.0
+T_SHIFT = 0.5
+TARGET_RMS = 0.1
+FEAT_SCALE = 0.1
+MAX_DURATION = 100
+
+# ===== Voice Prompts =====
+# Các giọng được tiền xử lý (fbank + prompt tokens) và giữ trong cache
+DEFAULT_VOICE = "default"
+VOICES = {
+    "default": {"ref_audio": DEFAULT_REF_AUDIO, "prompt_text": DEFAULT_PROMPT_TEXT},
+}
+PRELOAD_VOICES = True  # Tính sẵn prompt cho tất cả VOICES khi khởi động
+# Nơi lưu prompt đã tính dưới dạng .npz; None = chỉ cache trong RAM
+PROMPT_CACHE_DIR = OUTPUT_AUDIO_DIR / "prompts"
+
+# ===== Streaming TTS =====
+# Cắt câu trả lời theo câu/mệnh đề, tổng hợp và gửi từng đoạn ngay khi xong
+STREAMING_TTS = True
+SEGMENT_MIN_CHARS = 12           # Đoạn ngắn hơn sẽ được gộp với đoạn sau
+SEGMENT_FIRST_CLAUSE_CHARS = 25  # Đoạn đầu cắt sớm ở dấu phẩy để giảm time-to-first-audio
+SEGMENT_CLAUSE_CHARS = 80        # Các đoạn sau chỉ cắt ở dấu phẩy khi dài hơn mức này
+SEGMENT_MAX_CHARS = 200          # Cắt cứng ở khoảng trắng nếu không gặp dấu câu
+STREAM_PREFETCH = 1              # Số đoạn được tổng hợp trước trong khi đoạn hiện tại đang gửi
+
+# ===== Audio Store (content-addressed) =====
+# audio_cache/store: PCM int16 @ 16kHz theo hash(text, giọng, NUM_STEP, checkpoint...)
+AUDIO_STORE_DIR = OUTPUT_AUDIO_DIR / "store"  # None = tắt, mỗi lần đều tổng hợp lại
+AUDIO_STORE_SAMPLE_RATE = 16000  # Đúng định dạng gửi cho ESP32
+AUDIO_STORE_ALL = True  # Lưu mọi đoạn đã tổng hợp; False = chỉ lưu phrase bank
+AUDIO_STORE_MAX_BYTES = 512 * 1024 * 1024  # Prune file ít dùng nhất khi khởi động (phrase bank giữ nguyên)
+
+# ===== Phrase Bank =====
+# Tổng hợp sẵn lúc deploy: python -m modules.phrase_bank
+GREETING_REPLY = "Chào cậu! Hôm nay cậu muốn học gì nào?"
+NOT_HEARD_REPLY = "Tớ chưa nghe rõ, cậu nói lại được không?"  # Phát khi STT không ra chữ nào; None = im lặng
+PHRASE_BANK = [
+    GREETING_REPLY,
+    NOT_HEARD_REPLY,
+    "Cậu giỏi quá!",
+]
+
+# ===== Fake TTS (TTS_BACKEND = "fake") =====
+FAKE_TTS_SAMPLE_RATE = 24000     # Như ZipVoice, để đường resample vẫn được đo
+FAKE_TTS_FIRST_DELAY = 0.15      # Giây cố định mỗi đoạn
+FAKE_TTS_RTF = 0.3               # Thời gian tổng hợp / độ dài audio sinh ra
+FAKE_TTS_SECONDS_PER_CHAR = 0.06 # Độ dài audio cho mỗi ký tự
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# ===== Model =====
+# Silero VAD bản ONNX (v5: input, state, sr), nằm cùng các model khác trong models/.
+# Tải một lần lúc cài đặt: python -m modules.vad --fetch (server không dùng torch.hub/mạng khi khởi động)
+VAD_MODEL_PATH = ROOT_DIR / "models" / "silero_vad.onnx"
+VAD_MODEL_URL = "https://github.com/snakers4/silero-vad/raw/v5.1.2/src/silero_vad/data/silero_vad.onnx"
+VAD_NUM_THREADS = 1  # onnxruntime intra-op threads; batch lớn vẫn chỉ cần 1 thread
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 512    # Silero @16kHz nhận đúng 512 sample mỗi frame (32ms)
+CONTEXT_SAMPLES = 64   # Silero v5 nối 64 sample cuối của frame trước vào đầu frame
+
+# ===== Batched Inference =====
+# Frame của mọi kết nối đến trong cùng một cửa sổ được chấm điểm bằng MỘT lần gọi model
+BATCH_WINDOW_MS = 8    # Thời gian tối đa chờ gom thêm frame sau frame đầu tiên
+BATCH_MAX_SIZE = 64    # Số kết nối tối đa trong một lần gọi model
+
+# ===== Hysteresis =====
+SPEECH_THRESHOLD = 0.5       # prob >= mức này: frame có tiếng nói
+SILENCE_THRESHOLD = 0.35     # prob < mức này: frame im lặng; ở giữa thì giữ nguyên trạng thái
+SPEECH_START_FRAMES = 1      # Số frame tiếng nói liên tiếp để bắt đầu câu
+PREROLL_FRAMES = 5           # Số frame trước điểm bắt đầu được giữ lại (không mất âm đầu)
+MAX_UTTERANCE_SEC = 30       # Câu dài hơn bị cắt; ring buffer mỗi kết nối chứa được chừng này audio
+
+# ===== Endpointing =====
+# Khoảng im lặng để kết thúc câu phụ thuộc độ dài câu đã nói: câu ngắn (trẻ nói chậm, ngập ngừng
+# "con muốn... hỏi là") được chờ lâu, câu dài thường đã trọn ý nên kết thúc sớm hơn.
+# Giảm tuyến tính từ SILENCE_END_MAX_MS (câu <= ENDPOINT_SHORT_SEC) xuống SILENCE_END_MIN_MS (>= ENDPOINT_LONG_SEC)
+SILENCE_END_MAX_MS = 1600
+SILENCE_END_MIN_MS = 800
+ENDPOINT_SHORT_SEC = 1.0
+ENDPOINT_LONG_SEC = 5.0
+
+# Speculative endpoint: ở khoảng lặng ngắn đầu tiên, STT -> LLM -> TTS bắt đầu chạy ngay trên phần đã nói.
+# VAD xác nhận hết câu -> lượt được commit (audio đã sẵn sàng, gửi ngay); người dùng nói tiếp -> lượt bị bỏ
+# (không gửi gì, không ghi lịch sử) và câu tiếp tục như thường. Lượt bị bỏ vẫn tốn một request Gemini.
+SPECULATIVE_ENDPOINT = True
+SPECULATIVE_PAUSE_MS = 320   # Khoảng lặng bắt đầu lượt speculative (~10 frame)
+
+# ===== Barge-in =====
+# VAD vẫn chấm điểm mic trong lúc server đang trả lời; người dùng nói chen vào thì huỷ
+# lượt đang chạy (stream audio, các đoạn TTS chưa tổng hợp, request Gemini) và xử lý câu mới.
+# Cần firmware tiếp tục gửi mic khi đang phát loa (BARGE_IN_ENABLED trong vad/vad.ino, mặc định tắt)
+BARGE_IN = True
+BARGE_IN_MIN_SPEECH_MS = 300  # Tiếng nói phải kéo dài chừng này mới huỷ lượt (lọc tiếng động, tiếng vọng ngắn)
@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from settings import llm_settings  # noqa: E402
+
+
+@pytest.fixture
+def llm_env(tmp_path, monkeypatch):
+    """LLMEngine offline: fake Gemini, RAG/lịch sử/cache trong thư mục tạm"""
+    monkeypatch.setattr(llm_settings, "LLM_BACKEND", "fake")
+    monkeypatch.setattr(llm_settings, "RAG_MODE", "bm25")
+    monkeypatch.setattr(llm_settings, "RAG_DIR", tmp_path / "rag_docs")
+    monkeypatch.setattr(llm_settings, "RAG_INDEX_PATH", tmp_path / "rag_index" / "bm25.npz")
+    monkeypatch.setattr(llm_settings, "HISTORY_DIR", tmp_path / "chat_history")
+    monkeypatch.setattr(llm_settings, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm_settings, "RESPONSE_CACHE_DIR", None)
+    return tmp_path
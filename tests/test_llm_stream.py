@@ -0,0 +1,172 @@
+"""
+LLMEngine.chat_stream / achat_stream chạy với FakeGeminiClient (offline, không cần API key):
+delta được yield dần, lịch sử và response cache chỉ được ghi khi stream kết thúc trọn vẹn.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from modules.cancel import CancelToken
+from modules.fake_llm import DEFAULT_REPLY, FakeGeminiClient
+from modules.llm import LLMEngine
+
+QUESTION = "Một cộng một bằng mấy vậy bạn"
+SESSION = "test-session"
+
+
+@pytest.fixture
+def make_engine(llm_env):
+    engines = []
+
+    def make(**client_options):
+        options = {"chunk_chars": 16, "first_chunk_delay": 0.0, "chunk_delay": 0.02}
+        options.update(client_options)
+        engine = LLMEngine(client=FakeGeminiClient(**options))
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.history.close()
+
+
+def cache_entries(engine) -> int:
+    return engine.response_cache.stats()["response_cache_entries"]
+
+
+def collect_sync(engine, on_delta=None, **kwargs):
+    deltas = []
+    for delta in engine.chat_stream(QUESTION, session_id=SESSION, use_rag=False, **kwargs):
+        deltas.append((time.monotonic(), delta))
+        if on_delta is not None:
+            on_delta(len(deltas))
+    return deltas
+
+
+def collect_async(engine, on_delta=None, **kwargs):
+    async def run():
+        deltas = []
+        async for delta in engine.achat_stream(QUESTION, session_id=SESSION, use_rag=False, **kwargs):
+            deltas.append((time.monotonic(), delta))
+            if on_delta is not None:
+                on_delta(len(deltas))
+        return deltas
+
+    return asyncio.run(run())
+
+
+COLLECTORS = [pytest.param(collect_sync, id="sync"), pytest.param(collect_async, id="async")]
+
+
+@pytest.mark.parametrize("collect", COLLECTORS)
+def test_deltas_are_yielded_incrementally(make_engine, collect):
+    engine = make_engine(chunk_delay=0.03)
+    seen_history = []
+
+    def on_delta(count):
+        seen_history.append(len(engine.history.get_history(SESSION)))
+
+    deltas = collect(engine, on_delta)
+
+    assert "".join(delta for _, delta in deltas) == DEFAULT_REPLY
+    assert len(deltas) == -(-len(DEFAULT_REPLY) // 16)
+    # Chunk đến dần theo độ trễ của client, không phải gom một lần ở cuối
+    assert deltas[-1][0] - deltas[0][0] >= 0.03 * (len(deltas) - 1) * 0.8
+    # Trong lúc stream, lượt này chưa có trong lịch sử
+    assert seen_history and all(count == 0 for count in seen_history)
+
+
+@pytest.mark.parametrize("collect", COLLECTORS)
+def test_history_and_cache_written_when_stream_completes(make_engine, collect):
+    engine = make_engine()
+    seen_cache = []
+
+    collect(engine, lambda count: seen_cache.append(cache_entries(engine)))
+
+    assert all(count == 0 for count in seen_cache)
+    history = engine.history.get_history(SESSION)
+    assert [(m["role"], m["content"]) for m in history] == [("user", QUESTION), ("assistant", DEFAULT_REPLY)]
+    cached = engine.response_cache.get(QUESTION)
+    assert cached is not None and cached.reply == DEFAULT_REPLY
+
+
+@pytest.mark.parametrize("collect", COLLECTORS)
+def test_mid_stream_error_commits_nothing(make_engine, collect):
+    engine = make_engine(fail_after=2)
+
+    deltas = collect(engine)
+
+    # Phần đã nhận vẫn được yield, nhưng lượt dở dang không vào lịch sử/cache
+    assert "".join(delta for _, delta in deltas) == DEFAULT_REPLY[:32]
+    assert engine.history.get_history(SESSION) == []
+    assert cache_entries(engine) == 0
+
+
+@pytest.mark.parametrize("collect", COLLECTORS)
+def test_error_before_first_chunk_yields_error_reply(make_engine, collect):
+    engine = make_engine(fail_after=0)
+
+    deltas = collect(engine)
+
+    assert [delta for _, delta in deltas] == [engine._error_reply(RuntimeError("test"))]
+    assert engine.history.get_history(SESSION) == []
+    assert cache_entries(engine) == 0
+
+
+@pytest.mark.parametrize("collect", COLLECTORS)
+def test_cancel_mid_stream_commits_nothing(make_engine, collect):
+    engine = make_engine()
+    cancel = CancelToken()
+
+    def on_delta(count):
+        if count == 2:
+            cancel.cancel("barge-in")
+
+    deltas = collect(engine, on_delta, cancel=cancel)
+
+    assert len(deltas) == 2
+    assert engine.history.get_history(SESSION) == []
+    assert cache_entries(engine) == 0
+
+
+def test_closing_async_stream_early_commits_nothing(make_engine):
+    engine = make_engine()
+
+    async def run():
+        stream = engine.achat_stream(QUESTION, session_id=SESSION, use_rag=False)
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(run()) == DEFAULT_REPLY[:16]
+    assert engine.history.get_history(SESSION) == []
+    assert cache_entries(engine) == 0
+
+
+def test_async_stream_keeps_history_calls_off_the_event_loop(make_engine):
+    # Với MODEL_SERVERS, history là RemoteChatHistory: mỗi lời gọi là một round trip qua socket
+    engine = make_engine()
+    history = engine.history
+    loop_threads = []
+
+    class RecordingHistory:
+        def __getattr__(self, name):
+            method = getattr(history, name)
+
+            def call(*args, **kwargs):
+                if threading.get_ident() == loop_thread:
+                    loop_threads.append(name)
+                return method(*args, **kwargs)
+
+            return call
+
+    engine.history = RecordingHistory()
+    loop_thread = threading.get_ident()
+    collect_async(engine)
+    collect_async(engine)  # lượt thứ hai trúng response cache
+
+    engine.history = history
+    assert [m["content"] for m in history.get_history(SESSION)] == [QUESTION, DEFAULT_REPLY] * 2
+    assert loop_threads == []
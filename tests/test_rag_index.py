@@ -0,0 +1,80 @@
+"""
+SimpleRAG lưu index (postings, idf, độ dài chunk) ra .npz: khởi động lại không build lại,
+file chỉ bị "touch" được ghi lại stat, file sửa/xoá được cập nhật tăng dần.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from modules.llm import SimpleRAG
+
+DOCS = {
+    "a.txt": "Trạm sạc nằm ở tầng hầm B2, mở cửa từ 6 giờ sáng.",
+    "b.txt": "Wifi khách: mật khẩu là xinchao2024, hỏi lễ tân nếu không kết nối được.",
+}
+
+
+@pytest.fixture
+def docs(llm_env):
+    folder = llm_env / "rag_docs"
+    folder.mkdir()
+    for name, text in DOCS.items():
+        (folder / name).write_text(text, encoding="utf-8")
+    return folder
+
+
+def load_rag(folder) -> SimpleRAG:
+    rag = SimpleRAG(folder)
+    rag.ensure_loaded()
+    return rag
+
+
+def test_restart_loads_index_without_rebuilding(docs, monkeypatch):
+    first = load_rag(docs)
+    expected = first.search("mật khẩu wifi")
+    assert expected[0]["source"] == "b.txt"
+    assert first.index_path.suffix == ".npz"
+    np.load(first.index_path, allow_pickle=False).close()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("index should be loaded from disk")
+
+    monkeypatch.setattr(SimpleRAG, "_build_index", fail)
+    second = load_rag(docs)
+    assert len(second.chunks) == len(first.chunks)
+    assert second.search("mật khẩu wifi") == expected
+
+
+def test_touch_only_change_is_written_back(docs, monkeypatch):
+    load_rag(docs)
+    path = docs / "a.txt"
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+    load_rag(docs)
+
+    hashed = []
+    sha1 = hashlib.sha1
+    monkeypatch.setattr(hashlib, "sha1", lambda raw: hashed.append(raw) or sha1(raw))
+    rag = load_rag(docs)
+    # Stat mới đã được lưu ở lần trước -> không đọc/hash lại file
+    assert hashed == []
+    assert len(rag.chunks) == 2
+
+
+def test_changed_and_removed_files_update_index(docs):
+    load_rag(docs)
+    (docs / "a.txt").write_text("Bãi đỗ xe máy ở cổng sau, miễn phí cho khách.", encoding="utf-8")
+    (docs / "b.txt").unlink()
+
+    rag = load_rag(docs)
+    assert [src for src, _ in rag.chunks] == [str(docs / "a.txt")]
+    assert rag.search("bãi đỗ xe")[0]["source"] == "a.txt"
+    assert rag.search("mật khẩu wifi") == []
+
+    (docs / "c.txt").write_text("Hồ bơi mở cửa đến 22 giờ.", encoding="utf-8")
+    assert rag.refresh(force=True)
+    assert rag.search("hồ bơi")[0]["source"] == "c.txt"
+    assert rag.search("bãi đỗ xe")[0]["source"] == "a.txt"
+    assert load_rag(docs).search("hồ bơi")[0]["source"] == "c.txt"
@@ -14,7 +14,16 @@ const char* ssid = "iPhone của hành";         // <-- THAY ĐỔI TÊN WIFI
 const char* password = "123456780"; // <-- THAY ĐỔI MẬT KHẨU WIFI
 const char* websocket_server_host = "172.20.10.4"; // <-- THAY ĐỔI IP CỦA SERVER
 const uint16_t websocket_server_port = 8000;
+// Codec audio hai chiều: 0 = PCM 16-bit thô (256 kbit/s), 1 = IMA-ADPCM (64 kbit/s, cho Wi-Fi đông máy)
+#define AUDIO_CODEC_ADPCM       0
+#if AUDIO_CODEC_ADPCM
+const char* websocket_server_path = "/ws?codec=adpcm";
+#else
 const char* websocket_server_path = "/ws";
+#endif
+// Đường dẫn thật = websocket_server_path + "device=<MAC>" (ghép trong setup() khi đã có Wi-Fi):
+// server giữ lịch sử hội thoại theo device ID nên kết nối lại vẫn tiếp tục cuộc trò chuyện cũ
+String websocket_path;
 
 // --- Chân cắm I2S ---
 #define I2S_MIC_SERIAL_CLOCK    14
@@ -31,12 +40,19 @@ const char* websocket_server_path = "/ws";
 #define I2S_MIC_PORT            I2S_NUM_0
 #define I2S_SPEAKER_PORT        I2S_NUM_1
 
-// Kích thước buffer đọc I2S, PHẢI KHỚP VỚI VAD_CHUNK_SIZE CỦA SERVER
+// Kích thước buffer đọc I2S (server nhận chunk bất kỳ; 1024 bytes = đúng 1 frame VAD 512 sample)
 #define I2S_READ_CHUNK_SIZE     1024
 
 // --- Cấu hình Âm thanh Loa ---
 #define SPEAKER_GAIN            8.0f
 #define PLAYBACK_BUFFER_SIZE    4096  // Small buffer to smooth playback jitter
+#define PLAYBACK_ACK_BYTES      4096  // Báo "ACK <n>" cho server sau mỗi chừng này byte đưa vào I2S (0 = tắt)
+
+// --- Barge-in ---
+// 1: vẫn gửi mic trong lúc chờ/phát câu trả lời, server (VAD) tự phát hiện người dùng nói chen vào.
+// Mặc định tắt: firmware chưa có khử tiếng vọng, mic thu lại tiếng loa và VAD coi đó là người
+// dùng nói chen -> câu trả lời tự ngắt. Chỉ bật khi loa đặt xa mic / âm lượng nhỏ, hoặc dùng tai nghe.
+#define BARGE_IN_ENABLED        0
 
 // ===============================================================
 // 2. BIẾN TOÀN CỤC
@@ -47,13 +63,92 @@ WebsocketsClient client;
 enum State {
   STATE_STREAMING,         // Đọc mic và gửi đi
   STATE_WAITING,           // Đã gửi xong, chờ server xử lý
-  STATE_PLAYING_RESPONSE   // Tạm dừng mic, chỉ phát loa
+  STATE_PLAYING_RESPONSE   // Phát loa (mic tạm dừng, trừ khi BARGE_IN_ENABLED)
 };
 volatile State currentState = STATE_STREAMING;
 
 byte i2s_read_buffer[I2S_READ_CHUNK_SIZE];
 byte playback_buffer[PLAYBACK_BUFFER_SIZE];
 size_t playback_buffer_fill = 0;
+size_t playback_bytes_total = 0;  // Số byte đã đưa vào I2S trong lượt trả lời hiện tại
+size_t playback_bytes_acked = 0;
+
+// Server xác nhận codec bằng "CODEC <tên>"; server không hỗ trợ ADPCM thì quay về PCM
+volatile bool use_adpcm = AUDIO_CODEC_ADPCM;
+
+// ===============================================================
+// IMA-ADPCM (khớp modules/codec.py): mỗi message là một block
+// [int16 predictor][uint8 step index][uint8 0] + nibble (nibble thấp trước)
+// ===============================================================
+#define ADPCM_HEADER_BYTES 4
+
+static const int8_t adpcm_index_table[16] = {-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8};
+static const int16_t adpcm_step_table[89] = {
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+};
+
+// Cập nhật predictor/index theo một code, dùng chung cho encoder và decoder
+static inline void adpcm_step(uint8_t code, int32_t &predictor, int &index) {
+    int32_t step = adpcm_step_table[index];
+    int32_t diff = step >> 3;
+    if (code & 4) diff += step;
+    if (code & 2) diff += step >> 1;
+    if (code & 1) diff += step >> 2;
+    predictor += (code & 8) ? -diff : diff;
+    if (predictor > 32767) predictor = 32767;
+    if (predictor < -32768) predictor = -32768;
+    index += adpcm_index_table[code];
+    if (index < 0) index = 0;
+    if (index > 88) index = 88;
+}
+
+// Encoder giữ state giữa các block (chỉ dùng trong audio_processing_task)
+int32_t adpcm_enc_predictor = 0;
+int adpcm_enc_index = 0;
+byte adpcm_tx_buffer[ADPCM_HEADER_BYTES + I2S_READ_CHUNK_SIZE / 4];
+
+size_t adpcm_encode_block(const int16_t *in, size_t n_samples, uint8_t *out) {
+    out[0] = adpcm_enc_predictor & 0xFF;
+    out[1] = (adpcm_enc_predictor >> 8) & 0xFF;
+    out[2] = adpcm_enc_index;
+    out[3] = 0;
+    for (size_t i = 0; i < n_samples; i++) {
+        int32_t delta = in[i] - adpcm_enc_predictor;
+        uint8_t code = 0;
+        if (delta < 0) { code = 8; delta = -delta; }
+        int32_t step = adpcm_step_table[adpcm_enc_index];
+        if (delta >= step) { code |= 4; delta -= step; }
+        step >>= 1;
+        if (delta >= step) { code |= 2; delta -= step; }
+        step >>= 1;
+        if (delta >= step) { code |= 1; }
+        adpcm_step(code, adpcm_enc_predictor, adpcm_enc_index);
+        if (i & 1) out[ADPCM_HEADER_BYTES + i / 2] |= code << 4;
+        else out[ADPCM_HEADER_BYTES + i / 2] = code;
+    }
+    return ADPCM_HEADER_BYTES + n_samples / 2;
+}
+
+// Block độc lập: state lấy từ header, trả về số sample đã giải mã
+size_t adpcm_decode_block(const uint8_t *in, size_t len, int16_t *out) {
+    if (len < ADPCM_HEADER_BYTES) return 0;
+    int32_t predictor = (int16_t)(in[0] | (in[1] << 8));
+    int index = in[2] > 88 ? 88 : in[2];
+    size_t n = 0;
+    for (size_t i = ADPCM_HEADER_BYTES; i < len; i++) {
+        adpcm_step(in[i] & 0x0F, predictor, index);
+        out[n++] = predictor;
+        adpcm_step(in[i] >> 4, predictor, index);
+        out[n++] = predictor;
+    }
+    return n;
+}
 
 // ===============================================================
 // 3. CÁC HÀM CÀI ĐẶT I2S
@@ -116,15 +211,34 @@ void onWebsocketEvent(WebsocketsEvent event, String data) {
     }
 }
 
+// Server dùng ACK để pace downlink theo tốc độ phát thực của loa
+void count_played_bytes(size_t n) {
+    playback_bytes_total += n;
+    if (PLAYBACK_ACK_BYTES > 0 && playback_bytes_total - playback_bytes_acked >= PLAYBACK_ACK_BYTES) {
+        client.send("ACK " + String((unsigned long)playback_bytes_total));
+        playback_bytes_acked = playback_bytes_total;
+    }
+}
+
 void onWebsocketMessage(WebsocketsMessage message) {
     if (message.isText()) {
         String text_msg = String(message.c_str());
         Serial.printf("Server sent text: %s\n", text_msg.c_str());
 
-        if (text_msg == "PROCESSING_START") {
+        if (text_msg.startsWith("CODEC ")) {
+            use_adpcm = (text_msg == "CODEC adpcm");
+            Serial.printf("Audio codec: %s\n", use_adpcm ? "IMA-ADPCM" : "PCM");
+        }
+        else if (text_msg == "PROCESSING_START") {
             Serial.println("Server is processing. Pausing microphone.");
             currentState = STATE_WAITING;
         }
+        else if (text_msg == "TTS_ABORT") {
+            // Barge-in: bỏ phần audio còn lại, server sẽ gửi TTS_END ngay sau đó
+            Serial.println("Response aborted by server. Dropping buffered audio.");
+            playback_buffer_fill = 0;
+            i2s_zero_dma_buffer(I2S_SPEAKER_PORT);
+        }
         else if (text_msg == "TTS_END") {
             Serial.println("End of TTS. Flushing playback buffer and returning to streaming mode.");
             // Flush any remaining buffered audio
@@ -133,6 +247,8 @@ void onWebsocketMessage(WebsocketsMessage message) {
                 i2s_write(I2S_SPEAKER_PORT, playback_buffer, playback_buffer_fill, &bytes_written, portMAX_DELAY);
                 playback_buffer_fill = 0;
             }
+            playback_bytes_total = 0;
+            playback_bytes_acked = 0;
             currentState = STATE_STREAMING;
         }
     }
@@ -142,11 +258,20 @@ void onWebsocketMessage(WebsocketsMessage message) {
             currentState = STATE_PLAYING_RESPONSE;
             i2s_zero_dma_buffer(I2S_SPEAKER_PORT);
             playback_buffer_fill = 0; // Reset buffer
+            playback_bytes_total = 0;
+            playback_bytes_acked = 0;
         }
         
         size_t len = message.length();
-        int16_t temp_write_buffer[len / sizeof(int16_t)];
-        memcpy(temp_write_buffer, message.c_str(), len);
+        size_t n_samples = use_adpcm ? (len > ADPCM_HEADER_BYTES ? (len - ADPCM_HEADER_BYTES) * 2 : 0)
+                                     : len / sizeof(int16_t);
+        int16_t temp_write_buffer[n_samples];
+        if (use_adpcm) {
+            adpcm_decode_block((const uint8_t*)message.c_str(), len, temp_write_buffer);
+            len = n_samples * sizeof(int16_t);
+        } else {
+            memcpy(temp_write_buffer, message.c_str(), len);
+        }
         
         // Apply gain
         for (int i = 0; i < len / sizeof(int16_t); i++) {
@@ -169,6 +294,7 @@ void onWebsocketMessage(WebsocketsMessage message) {
             size_t bytes_written = 0;
             i2s_write(I2S_SPEAKER_PORT, playback_buffer, playback_buffer_fill, &bytes_written, portMAX_DELAY);
             playback_buffer_fill = 0;
+            count_played_bytes(bytes_written);
         }
     }
 }
@@ -176,10 +302,15 @@ void onWebsocketMessage(WebsocketsMessage message) {
 void audio_processing_task(void *pvParameters) {
   size_t bytes_read;
   while (true) {
-    if (currentState == STATE_STREAMING) {
+    if (currentState == STATE_STREAMING || BARGE_IN_ENABLED) {
         i2s_read(I2S_MIC_PORT, i2s_read_buffer, I2S_READ_CHUNK_SIZE, &bytes_read, portMAX_DELAY);
         if (bytes_read == I2S_READ_CHUNK_SIZE && client.available()) {
-            client.sendBinary((const char*)i2s_read_buffer, bytes_read);
+            if (use_adpcm) {
+                size_t n = adpcm_encode_block((const int16_t*)i2s_read_buffer, bytes_read / sizeof(int16_t), adpcm_tx_buffer);
+                client.sendBinary((const char*)adpcm_tx_buffer, n);
+            } else {
+                client.sendBinary((const char*)i2s_read_buffer, bytes_read);
+            }
         }
     } else {
         vTaskDelay(pdMS_TO_TICKS(20));
@@ -207,14 +338,18 @@ void setup() {
   Serial.print("IP Address: ");
   Serial.println(WiFi.localIP());
 
+  websocket_path = String(websocket_server_path)
+      + (strchr(websocket_server_path, '?') ? "&" : "?")
+      + "device=" + WiFi.macAddress();
+
   setup_i2s_input();
   setup_i2s_output();
 
   client.onEvent(onWebsocketEvent);
   client.onMessage(onWebsocketMessage);
   
-  Serial.printf("Connecting to WebSocket server: %s:%d%s\n", websocket_server_host, websocket_server_port, websocket_server_path);
-  client.connect(websocket_server_host, websocket_server_port, websocket_server_path);
+  Serial.printf("Connecting to WebSocket server: %s:%d%s\n", websocket_server_host, websocket_server_port, websocket_path.c_str());
+  client.connect(websocket_server_host, websocket_server_port, websocket_path);
 
   xTaskCreatePinnedToCore(
       audio_processing_task, "Audio Processing Task",
@@ -234,7 +369,7 @@ void loop() {
   if (!client.available() && currentState != STATE_PLAYING_RESPONSE && currentState != STATE_WAITING) {
     Serial.println("WebSocket disconnected. Reconnecting...");
     currentState = STATE_STREAMING; // Reset state before reconnect
-    if (!client.connect(websocket_server_host, websocket_server_port, websocket_server_path)) {
+    if (!client.connect(websocket_server_host, websocket_server_port, websocket_path)) {
       Serial.println("Reconnect attempt failed.");
       delay(2000);
     } else {
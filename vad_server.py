@@ -1,224 +1,387 @@
 import asyncio
-import wave
-from datetime import datetime
+import logging
+import time
+from contextlib import aclosing
+from typing import Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-import os
-import torch
-from collections import deque
+from fastapi.responses import JSONResponse, PlainTextResponse
 import numpy as np
-from pathlib import Path # Import Path để kiểm tra kiểu dữ liệu
-import soundfile as sf
 
 # --- IMPORT PIPELINE TỪ THƯ MỤC MODULES ---
-from modules.pipeline import VoiceAssistantPipeline
+from modules.async_pipeline import AsyncVoiceAssistantPipeline, ServerBusyError
+from modules.audio import PCM16Stream, float_to_pcm16
+from modules.cancel import CancelToken, SpeculativeToken, TurnCancelled
+from modules.codec import negotiate
+from modules.downlink import DownlinkStats, PacedSender
+from modules import metrics
+from modules.recorder import AudioRecorder
+from modules.session import DeviceSession, SessionManager
+from modules.startup import Startup
+from modules.vad import BatchedVAD
+from settings import tts_settings as tts_cfg
+from settings import server_settings as server_cfg
+from settings import vad_settings as vad_cfg
 
 # --- Cấu hình ---
-SAMPLE_RATE = 16000
-BIT_DEPTH_BYTES = 2
-CHANNELS = 1
-# --- Cấu hình VAD ---
-VAD_CHUNK_SIZE = 1024
-VAD_SPEECH_THRESHOLD = 0.5
-VAD_SILENCE_FRAMES_TRIGGER = 1
-VAD_SILENCE_FRAMES_END = 50
-VAD_BUFFER_FRAMES = 5
+SAMPLE_RATE = server_cfg.SAMPLE_RATE
+BIT_DEPTH_BYTES = server_cfg.BIT_DEPTH_BYTES
+CHANNELS = server_cfg.CHANNELS
+# Cấu hình VAD (ngưỡng, hysteresis, batch): settings/vad_settings.py
+
+metrics.setup_logging()
+logger = logging.getLogger("vad_server")
 
 app = FastAPI()
 
-print("\n... (các dòng print khởi tạo pipeline) ...\n")
-pipeline = VoiceAssistantPipeline()
-print("\n... (các dòng print pipeline ready) ...\n")
-
-try:
-    torch.set_num_threads(1)
-    vad_model, utils = torch.hub.load(
-        repo_or_dir='snakers4/silero-vad',
-        model='silero_vad',
-        force_reload=False,
-        onnx=False
-    )
-    (get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks) = utils
-    print("Silero VAD model loaded successfully.")
-except Exception as e:
-    print(f"Error loading Silero VAD model: {e}")
+# Model được nạp song song trên thread nền (modules/startup.py): uvicorn nhận kết nối ngay,
+# GET /ready trả 503 tới khi STT, LLM, TTS và VAD đều sẵn sàng
+startup = Startup()
+pipeline = AsyncVoiceAssistantPipeline(startup=startup)
+recorder = AudioRecorder()
+downlink_stats = DownlinkStats()
+# Session theo thiết bị; session bị dọn thì lịch sử của nó cũng rời RAM (vẫn còn trên đĩa)
+sessions = SessionManager(on_evict=lambda session_id: pipeline.llm_engine.history.release(session_id))
+vad: Optional[BatchedVAD] = None
+
+
+def load_vad():
+    """Một model Silero dùng chung; frame của mọi kết nối được chấm điểm theo batch
+    (MODEL_SERVERS: model chạy ở VAD server, ở đây chỉ gom batch)"""
+    global vad
     vad_model = None
+    if server_cfg.MODEL_SERVERS:
+        from modules.remote import RemoteVADModel
+        vad_model = RemoteVADModel()
+    vad = BatchedVAD(session=vad_model)
+    metrics.REGISTRY.add_collector(vad.stats)
+
+
+startup.add("vad", load_vad)
+startup.start()
+
+# GET /metrics: histogram độ trễ từng stage + số liệu cộng dồn của pipeline/VAD/downlink/startup
+metrics.REGISTRY.add_collector(startup.stats)
+metrics.REGISTRY.add_collector(pipeline.stats)
+metrics.REGISTRY.add_collector(downlink_stats.stats)
+metrics.REGISTRY.add_collector(sessions.stats)
+
+async def _whole_response(process):
+    """process_pcm (không streaming) dưới dạng một item, gửi chung đường với bản streaming"""
+    yield await process()
+
+async def respond_to_utterance(
+    websocket: WebSocket, sender: PacedSender, session: DeviceSession, utterance: np.ndarray,
+    stt_session=None, cancel: Optional[CancelToken] = None,
+    vad_end: Optional[float] = None, endpoint_delay: float = 0.0
+) -> bool:
+    """
+    Xử lý một câu nói đã kết thúc (float32 @16kHz, đọc từ ring buffer của VAD):
+    STT -> LLM -> TTS và stream audio về ESP32.
+    Lịch sử hội thoại, trace, bản ghi audio theo `session` của thiết bị (modules/session.py).
+    Chạy như một task riêng để vòng nhận vẫn chấm VAD; barge-in set `cancel` rồi huỷ task,
+    client nhận TTS_ABORT (bỏ phần audio còn trong buffer) và TTS_END như thường.
+    `cancel` là SpeculativeToken (speculative endpoint): pipeline chạy ngay tới đoạn audio đầu tiên
+    nhưng chưa gửi gì; VAD xác nhận hết câu (commit) thì gửi như thường, người dùng nói tiếp thì
+    lượt kết thúc lặng lẽ (client không nhận gì).
+    Audio được gửi qua `sender` (pace theo deadline, xem modules/downlink.py).
+    Mốc thời gian của lượt (modules/metrics.py) tính từ `vad_end` (monotonic, lúc VAD kết thúc câu);
+    `endpoint_delay` là khoảng im lặng VAD đã chờ trước đó.
+    Trả về False nếu client đã ngắt kết nối trong lúc gửi.
+    """
+    device_id, session_id = session.device_id, session.session_id
+    trace = metrics.start_turn(session_id, start=vad_end)
+    trace.add_span("vad_endpoint", endpoint_delay)
+    speculative = isinstance(cancel, SpeculativeToken)
+    outcome = "ok"
+    started = False  # Đã gửi PROCESSING_START: client chờ TTS_END
+    ahead = None     # Lượt speculative: task lấy trước item đầu tiên
+    # Audio trả lời (float32, sr bất kỳ) -> PCM 16-bit mono 16kHz cho ESP32; resampler giữ state
+    # giữa các câu của cùng một lượt
+    pcm_stream = PCM16Stream(SAMPLE_RATE)
+    client_alive = True
+
+    async def begin():
+        nonlocal started
+        started = True
+        await websocket.send_text("PROCESSING_START")
+        sender.begin()
+        # Ghi file chỉ là side channel chạy nền, pipeline làm việc trực tiếp trên buffer
+        recorder.submit(float_to_pcm16(utterance).tobytes(), prefix=f"recording_{session.file_tag}")
 
-def save_audio_to_wav(audio_data: bytes, folder: str = "audio_files") -> str:
-    os.makedirs(folder, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
-    filename = os.path.join(folder, f"recording_{timestamp}.wav")
     try:
-        with wave.open(filename, 'wb') as wf:
-            wf.setnchannels(CHANNELS)
-            wf.setsampwidth(BIT_DEPTH_BYTES)
-            wf.setframerate(SAMPLE_RATE)
-            wf.writeframes(audio_data)
-        print(f"\nAudio received and saved to: {filename}")
-        return filename
+        if not speculative:
+            await begin()
+        if stt_session is not None:
+            # STT online: text đã được giải mã dần trong lúc nói, chỉ còn flush phần cuối
+            with metrics.span("stt"):
+                input_text = await pipeline.run_stt(stt_session.finish)
+            metrics.mark("stt_done")
+            logger.info("Online transcript: %s", input_text)
+            items = pipeline.respond_text_stream(
+                input_text, session_id=session_id, device_id=device_id, cancel=cancel
+            )
+        elif tts_cfg.STREAMING_TTS:
+            # Gửi từng câu ngay khi TTS xong, câu sau tổng hợp song song
+            items = pipeline.process_pcm_stream(
+                utterance, session_id=session_id, device_id=device_id, cancel=cancel
+            )
+        else:
+            items = _whole_response(lambda: pipeline.process_pcm(
+                utterance, session_id=session_id, device_id=device_id, cancel=cancel
+            ))
+
+        # aclosing: task bị huỷ giữa chừng thì generator được đóng ngay (huỷ TTS/Gemini còn dở)
+        async with aclosing(items):
+            try:
+                if speculative:
+                    # STT -> LLM -> đoạn TTS đầu chạy trong lúc VAD còn chờ xem người dùng nói xong chưa
+                    # (budget speculative riêng, không chiếm slot của lượt đã xác nhận)
+                    ahead = asyncio.ensure_future(anext(items, None))
+                    if not await cancel.wait_committed():
+                        raise TurnCancelled(cancel.reason or "speculation discarded")
+                    metrics.mark("endpoint_committed")
+                    await begin()
+                while True:
+                    item = await (ahead if ahead is not None else anext(items, None))
+                    ahead = None
+                    if item is None:
+                        client_alive = await sender.send(pcm_stream.flush())
+                        break
+                    if not await sender.send(pcm_stream.convert(item["audio"], item["sample_rate"])):
+                        client_alive = False
+                        break
+            finally:
+                if ahead is not None:
+                    # Generator đang chạy trong task lấy trước: dừng nó trước khi aclosing đóng generator
+                    ahead.cancel()
+                    await asyncio.wait([ahead])
+                    if not ahead.cancelled():
+                        ahead.exception()
+        if client_alive:
+            metrics.mark("last_byte_sent")
+        if client_alive and server_cfg.DOWNLINK_WAIT_PLAYBACK:
+            await sender.drain()
+    except (asyncio.CancelledError, TurnCancelled) as e:
+        if started:
+            outcome = "aborted"
+            logger.info("⏹️  Response aborted")
+            try:
+                # Client bỏ phần audio đang chờ phát; TTS_END vẫn được gửi ở finally
+                await websocket.send_text("TTS_ABORT")
+            except Exception:
+                client_alive = False
+        else:
+            # Lượt speculative bị bỏ (người dùng nói tiếp): client chưa biết gì về lượt này
+            outcome = "discarded"
+            logger.info("↩️  Speculative response discarded (%s)", cancel.reason if cancel else "")
+        if isinstance(e, asyncio.CancelledError):
+            raise
+    except ServerBusyError as e:
+        # Quá tải: báo cho client và trả về trạng thái lắng nghe ngay
+        outcome = "busy"
+        logger.warning("%s", e)
+        try:
+            await websocket.send_text("SERVER_BUSY")
+        except Exception:
+            pass
     except Exception as e:
-        print(f"\nError saving WAV file: {e}")
-        return ""
+        outcome = "error"
+        logger.exception("An error occurred during pipeline processing: %s", e)
+    finally:
+        if started:
+            # Chỉ gửi TTS_END nếu kết nối còn mở
+            try:
+                await websocket.send_text("TTS_END")
+                logger.info("Finished streaming response.")
+            except Exception:
+                logger.info("Client disconnected before TTS_END could be sent.")
+                client_alive = False
+        if not client_alive and outcome == "ok":
+            outcome = "disconnected"
+        trace.finish(outcome)
+    return client_alive
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    print(f"Client connected from: {websocket.client.host}")
-    if vad_model is None:
-        await websocket.close(code=1011, reason="VAD model not loaded")
+    logger.info("Client connected from: %s", websocket.client.host)
+    if not await startup.wait_ready(server_cfg.STARTUP_WAIT_TIMEOUT):
+        # Còn đang nạp: 1013 (try again later), ESP32 kết nối lại; nạp lỗi: 1011
+        if startup.done:
+            await websocket.close(code=1011, reason="Models failed to load")
+        else:
+            await websocket.close(code=1013, reason="Server starting")
         return
     
-    is_speaking = False
-    silence_counter = 0
-    speech_trigger_counter = 0
-    is_processing = False
-    connection_closed = False
-    
-    pre_buffer = deque(maxlen=VAD_BUFFER_FRAMES) 
-    speech_buffer = []
+    # Codec audio của kết nối (?codec=adpcm|opus), mặc định PCM thô
+    codec_offer = websocket.query_params.get("codec")
+    codec = negotiate(codec_offer)
+    if codec_offer is not None:
+        await websocket.send_text(f"CODEC {codec.name}")
+        logger.info("Audio codec: %s (client offered %s)", codec.name, codec_offer)
+
+    # Thiết bị tự giới thiệu (?device=<id> hoặc "HELLO <id>"); client cũ gửi audio ngay thì
+    # message đầu tiên được xử lý như thường ở vòng nhận
+    try:
+        device_id, identified, pending = await sessions.identify(websocket)
+    except (WebSocketDisconnect, RuntimeError):
+        return
+    session = await sessions.attach(device_id, websocket, identified)
+    if identified:
+        await websocket.send_text(f"SESSION {session.session_id}")
+    logger.info("Session %s (connection #%d)", session.session_id, session.connections)
+
+    session.vad = vad.create_session()
+    sender = PacedSender(websocket.send_bytes, downlink_stats, codec=codec)
+    # STT online: stream nhận dạng được nạp PCM ngay trong lúc người dùng nói
+    use_online_stt = pipeline.stt_engine.is_online
+    min_barge_in = int(vad_cfg.BARGE_IN_MIN_SPEECH_MS * SAMPLE_RATE / 1000)
 
     try:
         while True:
+            client_alive = session.pop_finished_turn()
+            if client_alive is False:
+                return
+
             try:
-                data = await websocket.receive_bytes()
+                if pending is not None:
+                    message, pending = pending, None
+                else:
+                    message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
             except WebSocketDisconnect:
-                print(f"\nClient {websocket.client.host} disconnected during receive.")
+                logger.info("Client %s disconnected during receive.", session.device_id)
                 return
             except RuntimeError as e:
                 # e.g., "WebSocket is not connected. Need to call accept first." after client closes
-                print(f"\nWebSocket runtime error during receive: {e}")
+                logger.warning("WebSocket runtime error during receive: %s", e)
                 return
-
-            if is_processing:
+            if not session.owned_by(websocket):
+                # Thiết bị đã kết nối lại bằng kết nối khác
+                return
+            session.touch()
+            if message.get("text") is not None:
+                # Tin nhắn điều khiển của client (vd. "ACK <bytes>" cho downlink)
+                sender.handle_message(message["text"])
                 continue
-
-            if len(data) != VAD_CHUNK_SIZE:
-                print(f"\nWarning: Received chunk of size {len(data)}, expected {VAD_CHUNK_SIZE}. Ignoring.")
+            data = message.get("bytes")
+            if not data:
                 continue
+            data = codec.decode(data)
 
-            # copy() để tránh cảnh báo NumPy non-writable khi chuyển sang torch tensor
-            audio_numpy = np.frombuffer(data, dtype=np.int16).copy()
-            audio_tensor = torch.from_numpy(audio_numpy).float() / 32768.0
-            
-            with torch.no_grad():
-                speech_prob = vad_model(audio_tensor, SAMPLE_RATE).item()
-
-            bar_length = 50
-            filled_len = int(bar_length * speech_prob)
-            bar = '█' * filled_len + '-' * (bar_length - filled_len)
-            print(f'\rVAD |{bar}| Prob: {speech_prob:.2f}', end="")
-
-            if speech_prob > VAD_SPEECH_THRESHOLD:
-                silence_counter = 0
-                if not is_speaking:
-                    speech_trigger_counter += 1
-                    if speech_trigger_counter >= VAD_SILENCE_FRAMES_TRIGGER:
-                        print("\n==> Voice activity detected. Start recording.")
-                        is_speaking = True
-                        speech_buffer.extend(list(pre_buffer))
-                if is_speaking:
-                    speech_buffer.append(data)
-            else:
-                speech_trigger_counter = 0
-                if is_speaking:
-                    silence_counter += 1
-                    speech_buffer.append(data)
-                    if silence_counter >= VAD_SILENCE_FRAMES_END:
-                        print("\n==> Silence detected. End of utterance.")
-                        is_processing = True
-                        await websocket.send_text("PROCESSING_START")
-                        full_audio_data = b"".join(speech_buffer)
-                        input_audio_path = save_audio_to_wav(full_audio_data)
-                        if input_audio_path:
-                            try:
-                                result = await asyncio.to_thread(pipeline.process, audio_input_path=input_audio_path)
-                                output_audio_path = result.get("output_audio") if isinstance(result, dict) else None
-                                
-                                if output_audio_path and os.path.exists(output_audio_path):
-                                    # Robust streaming: decode WAV, convert to 16k mono int16 PCM, and stream in paced chunks
-                                    try:
-                                        # Đọc WAV bằng soundfile để xử lý chuẩn
-                                        wav, sr = sf.read(str(output_audio_path), dtype='float32', always_2d=True)
-                                        # Chọn kênh mono (trung bình 2 kênh nếu stereo)
-                                        if wav.shape[1] > 1:
-                                            wav = wav.mean(axis=1)
-                                        else:
-                                            wav = wav[:, 0]
-
-                                        target_sr = SAMPLE_RATE  # 16k để khớp ESP32
-                                        if sr != target_sr:
-                                            # Nội suy tuyến tính đơn giản để giảm phụ thuộc
-                                            new_len = int(len(wav) * target_sr / sr)
-                                            wav = np.interp(
-                                                np.linspace(0.0, 1.0, new_len, endpoint=False),
-                                                np.linspace(0.0, 1.0, len(wav), endpoint=False),
-                                                wav
-                                            ).astype('float32')
-                                            sr = target_sr
-
-                                        # Chuyển sang int16 PCM
-                                        wav = np.clip(wav, -1.0, 1.0)
-                                        pcm_int16 = (wav * 32767.0).astype(np.int16)
-                                        pcm_bytes = pcm_int16.tobytes()
-
-                                        # Stream theo từng chunk bytes
-                                        bytes_per_sample = 2  # int16
-                                        # Giữ chunk nhỏ để tránh tràn buffer client (ESP32)
-                                        samples_per_chunk = 512  # 512 samples = 1024 bytes ~ 32ms @16kHz
-                                        chunk_size_to_send = samples_per_chunk * bytes_per_sample
-                                        chunk_duration_sec = samples_per_chunk / float(target_sr)
-
-                                        # Tùy chọn: báo hiệu bắt đầu TTS
-                                        # await websocket.send_text("TTS_START")
-                                        client_alive = True
-                                        for i in range(0, len(pcm_bytes), chunk_size_to_send):
-                                            chunk = pcm_bytes[i:i+chunk_size_to_send]
-                                            if not chunk or not client_alive:
-                                                break
-                                            try:
-                                                await websocket.send_bytes(chunk)
-                                            except Exception as e:
-                                                # Client đã đóng kết nối (ví dụ: reset hoặc reconnect)
-                                                print("\nClient disconnected during streaming; aborting send loop.")
-                                                client_alive = False
-                                                connection_closed = True
-                                                break
-                                            # Pace streaming để gần real-time, giúp client xử lý kịp
-                                            await asyncio.sleep(chunk_duration_sec)
-
-                                    except Exception as e:
-                                        import traceback
-                                        print("\nFailed to stream WAV frames:")
-                                        traceback.print_exc()
-                                        
-                                else:
-                                    print("\nPipeline did not return a valid audio output path.")
-                            except Exception as e:
-                                print(f"\nAn error occurred during pipeline processing: {e}")
-                            finally:
-                                # Chỉ gửi TTS_END nếu kết nối còn mở
-                                try:
-                                    await websocket.send_text("TTS_END")
-                                    print("\nFinished streaming response.")
-                                except Exception:
-                                    print("\nClient disconnected before TTS_END could be sent.")
-                                # Nếu client đã đóng kết nối, kết thúc handler sớm
-                                if connection_closed:
-                                    return
-                        is_speaking = False
-                        silence_counter = 0
-                        speech_buffer.clear()
-                        pre_buffer.clear()
-                        is_processing = False
+            vad_session = session.vad
+            utterance_event = pause_event = None
+            for event in await vad.process(vad_session, data):
+                if event.kind == "start":
+                    logger.info("==> Voice activity detected. Start recording.")
+                    session.speech_onset = event.end
+                    if use_online_stt:
+                        session.stt_session = pipeline.stt_engine.create_session()
+                        session.stt_fed = event.start
+                elif event.kind == "pause":
+                    pause_event = event
+                elif event.kind == "resume":
+                    pause_event = None
+                    if session.speculating:
+                        logger.info("==> Speech resumed. Discarding speculative response.")
+                        await session.cancel_turn("speech resumed")
                 else:
-                    pre_buffer.append(data)
+                    logger.info("==> Silence detected. End of utterance.")
+                    utterance_event = event
+
+            stt_session = session.stt_session
+            if stt_session is not None:
+                # Nạp phần audio mới (kể cả pre-roll ở frame đầu) cho STT online
+                fed_to = utterance_event.end if utterance_event else vad_session.scored
+                if fed_to > session.stt_fed:
+                    await pipeline.run_stt(stt_session.accept_pcm, vad_session.read(session.stt_fed, fed_to))
+                    session.stt_fed = fed_to
+                partial = stt_session.partial
+                if partial and partial != session.last_partial:
+                    logger.debug("... %s", partial)
+                    session.last_partial = partial
+                # Endpoint của recognizer thường đến sớm hơn ngưỡng im lặng của VAD
+                if utterance_event is None and vad_session.silence_frames > 0 and stt_session.is_endpoint():
+                    logger.info("==> ASR endpoint detected. End of utterance.")
+                    utterance_event = vad_session.end_utterance()
+
+            if session.turn is not None and not session.speculating:
+                # Người dùng nói chen vào khi server đang trả lời
+                speech_end = utterance_event.end if utterance_event else vad_session.scored
+                speaking = vad_session.is_speaking or utterance_event
+                if speaking and speech_end - session.speech_onset >= min_barge_in:
+                    logger.info("==> Barge-in detected. Cancelling current response.")
+                    await session.cancel_turn("barge-in")
+                elif utterance_event is not None:
+                    # Quá ngắn (tiếng động, tiếng vọng của loa): bỏ qua, không cắt câu trả lời
+                    logger.info("==> Short sound during response ignored.")
+                    utterance_event = None
+                    session.reset_utterance()
+
+            if utterance_event is not None:
+                if session.speculating:
+                    # Từ khoảng lặng tới giờ không có tiếng nói: lượt speculative chính là câu trả lời,
+                    # audio của nó (thường đã sẵn sàng) được gửi ngay
+                    logger.info("==> End of utterance confirmed. Committing speculative response.")
+                    session.commit_turn()
+                else:
+                    vad_end = time.monotonic()
+                    utterance = vad_session.read(utterance_event.start, utterance_event.end)
+                    endpoint_delay = utterance_event.silence / SAMPLE_RATE
+                    session.start_turn(
+                        lambda cancel: respond_to_utterance(
+                            websocket, sender, session, utterance, stt_session, cancel,
+                            vad_end=vad_end, endpoint_delay=endpoint_delay
+                        )
+                    )
+                session.reset_utterance()
+                if not vad_cfg.BARGE_IN:
+                    # Không barge-in: chờ trả lời xong rồi mới nhận tiếp, như trước
+                    await asyncio.wait([session.turn])
+            elif pause_event is not None and session.turn is None:
+                # Khoảng lặng ngắn: bắt đầu STT -> LLM -> TTS ngay trên phần đã nói (STT online cũng
+                # nhận dạng lại từ audio, stream đang nạp vẫn chạy tiếp nếu người dùng nói tiếp)
+                logger.info("==> Pause detected. Starting speculative response.")
+                vad_end = time.monotonic()
+                utterance = vad_session.read(pause_event.start, pause_event.end)
+                endpoint_delay = pause_event.silence / SAMPLE_RATE
+                session.start_turn(
+                    lambda cancel: respond_to_utterance(
+                        websocket, sender, session, utterance, None, cancel,
+                        vad_end=vad_end, endpoint_delay=endpoint_delay
+                    ),
+                    speculative=True
+                )
 
     except WebSocketDisconnect:
-        print(f"\nClient {websocket.client.host} disconnected.")
-    except Exception as e:
-        import traceback
-        print(f"\nA critical error occurred in websocket connection:")
-        traceback.print_exc()
+        logger.info("Client %s disconnected.", session.device_id)
+    except Exception:
+        logger.exception("A critical error occurred in websocket connection")
+    finally:
+        # Huỷ lượt đang chạy, thả ring buffer VAD; lịch sử giữ tới khi session bị dọn
+        await sessions.detach(session, websocket)
 
 @app.get("/")
 def read_root():
-    return {"status": "Voice Assistant Server is running"}
\ No newline at end of file
+    stats = {"ready": startup.ready, **pipeline.stats()}
+    if vad is not None:
+        stats.update(vad.stats())
+    stats.update(downlink_stats.stats())
+    stats.update(sessions.stats())
+    return {"status": "Voice Assistant Server is running", **stats}
+
+@app.get("/ready")
+def read_ready():
+    """200 khi mọi model đã nạp xong, 503 khi còn đang nạp hoặc nạp lỗi (kèm thời gian nạp từng thành phần)"""
+    return JSONResponse(startup.status(), status_code=200 if startup.ready else 503)
+
+@app.get("/metrics")
+def read_metrics():
+    """Prometheus text format"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+def read_traces(session: Optional[str] = None):
+    """Các lượt gần nhất (mốc + span từng stage) của một session, hoặc của mọi session"""
+    return metrics.TRACE_LOG.recent(session)